@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+ANN 索引基準測試：比較各索引類型相對於 FLAT 的 recall@k 與單筆查詢 p50/p99 延遲。
+
+用法:
+    python benchmarks/bench_ann_index.py --sizes 10000,100000,1000000 --index-types FLAT,IVF_FLAT,HNSW,IVF_SQ8
+    python benchmarks/bench_ann_index.py --uri http://localhost:19530   # 連到 Milvus standalone 以測試 HNSW / IVF_SQ8
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+from pymilvus import DataType, MilvusClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "servers"))
+from rag_index import LOCAL_INDEX_TYPES, build_index_config, is_local_uri  # noqa: E402
+
+INSERT_BATCH = 10000
+
+
+def generate_batch(seed: int, batch: int, size: int, dim: int, centers: np.ndarray) -> np.ndarray:
+    """
+    功能: 以固定種子產生一批分群的正規化向量，重複呼叫可得到相同資料，不必把整個資料集放在記憶體。
+    參數:
+        seed          (int): 基礎亂數種子。
+        batch         (int): 批次編號。
+        size          (int): 批次大小。
+        dim           (int): 向量維度。
+        centers (np.ndarray): 群中心。
+    回傳:
+        np.ndarray: (size, dim) 的 float32 矩陣。
+    """
+    rng = np.random.default_rng(seed + batch + 1)
+    labels = rng.integers(0, len(centers), size)
+    vectors = centers[labels] + rng.normal(scale=0.35, size=(size, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype(np.float32)
+
+
+def build_collection(client: MilvusClient, name: str, dim: int, size: int, index_type: str, metric: str,
+                     seed: int, centers: np.ndarray) -> float:
+    """
+    功能: 建立集合、寫入資料並等待索引完成。
+    參數:
+        client (MilvusClient): Milvus 用戶端。
+        name            (str): 集合名稱。
+        dim             (int): 向量維度。
+        size            (int): 資料筆數。
+        index_type      (str): 索引類型。
+        metric          (str): 距離度量。
+        seed            (int): 亂數種子。
+        centers  (np.ndarray): 群中心。
+    回傳:
+        float: 寫入與建索引耗時（秒）。
+    """
+    if client.has_collection(name):
+        client.drop_collection(name)
+    schema = MilvusClient.create_schema(auto_id=False)
+    schema.add_field("pk", DataType.INT64, is_primary=True)
+    schema.add_field("vector", DataType.FLOAT_VECTOR, dim=dim)
+    index_params, _ = build_index_config(index_type, metric, local=False)
+    prepared = client.prepare_index_params()
+    prepared.add_index(field_name="vector", **index_params)
+
+    start = time.perf_counter()
+    client.create_collection(name, schema=schema, index_params=prepared)
+    for batch, offset in enumerate(range(0, size, INSERT_BATCH)):
+        count = min(INSERT_BATCH, size - offset)
+        vectors = generate_batch(seed, batch, count, dim, centers)
+        client.insert(name, [{"pk": offset + i, "vector": v} for i, v in enumerate(vectors.tolist())])
+    client.flush(name)
+    client.load_collection(name)
+    return time.perf_counter() - start
+
+
+def search_all(client: MilvusClient, name: str, queries: np.ndarray, k: int, search_params: dict):
+    """
+    功能: 逐筆查詢以量測單筆延遲。
+    參數:
+        client  (MilvusClient): Milvus 用戶端。
+        name             (str): 集合名稱。
+        queries   (np.ndarray): 查詢向量。
+        k                (int): top-k。
+        search_params   (dict): 搜尋參數。
+    回傳:
+        Tuple[List[List[int]], List[float]]: 每筆查詢的結果 ID 與延遲（毫秒）。
+    """
+    ids, latencies = [], []
+    for query in queries.tolist():
+        start = time.perf_counter()
+        result = client.search(name, data=[query], anns_field="vector", limit=k, search_params=search_params)
+        latencies.append((time.perf_counter() - start) * 1000)
+        ids.append([hit["id"] for hit in result[0]])
+    return ids, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Milvus ANN index types against FLAT")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="以逗號分隔的子 chunk 數量")
+    parser.add_argument("--index-types", default="FLAT,IVF_FLAT,HNSW,IVF_SQ8")
+    parser.add_argument("--metric", default="IP")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--uri", default="", help="Milvus 位址，預設在暫存目錄建立 Milvus Lite 檔案")
+    parser.add_argument("--output", default="bench_ann_index.json")
+    args = parser.parse_args()
+
+    uri = args.uri or os.path.join(tempfile.mkdtemp(), "bench.db")
+    local = is_local_uri(uri)
+    client = MilvusClient(uri)
+    index_types = [t.strip().upper() for t in args.index_types.split(",") if t.strip()]
+
+    rng = np.random.default_rng(args.seed)
+    centers = rng.normal(size=(256, args.dim)).astype(np.float32)
+    results: List[Dict] = []
+
+    for size in [int(s) for s in args.sizes.split(",")]:
+        # 查詢取自資料分布並加上擾動
+        queries = generate_batch(args.seed + 10_000_000, 0, args.queries, args.dim, centers)
+
+        build_seconds = build_collection(client, "bench_flat", args.dim, size, "FLAT", args.metric, args.seed, centers)
+        _, flat_search = build_index_config("FLAT", args.metric, local=False)
+        truth, flat_latencies = search_all(client, "bench_flat", queries, args.k, flat_search)
+
+        for index_type in index_types:
+            entry = {"size": size, "index_type": index_type, "metric": args.metric, "dim": args.dim, "k": args.k}
+            if local and index_type not in LOCAL_INDEX_TYPES:
+                entry["skipped"] = "Milvus Lite 不支援此索引類型，請以 --uri 指定 Milvus standalone"
+                results.append(entry)
+                print(json.dumps(entry, ensure_ascii=False))
+                continue
+
+            if index_type == "FLAT":
+                ids, latencies, seconds = truth, flat_latencies, build_seconds
+            else:
+                seconds = build_collection(client, "bench_ann", args.dim, size, index_type, args.metric, args.seed, centers)
+                _, search_params = build_index_config(index_type, args.metric, local=False)
+                ids, latencies = search_all(client, "bench_ann", queries, args.k, search_params)
+                client.drop_collection("bench_ann")
+
+            recall = float(np.mean([len(set(a) & set(t)) / args.k for a, t in zip(ids, truth)]))
+            entry.update({
+                "build_seconds": round(seconds, 3),
+                "recall_at_k": round(recall, 4),
+                "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+                "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+            })
+            results.append(entry)
+            print(json.dumps(entry, ensure_ascii=False))
+
+        client.drop_collection("bench_flat")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"結果已寫入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
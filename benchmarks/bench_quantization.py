@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+量化向量基準測試：比較 int8 / binary 量化相對於 float32 精確搜尋的壓縮比、recall@k 損失與查詢延遲，
+並分別列出只用量化碼排序與經全精度重新評分後的 recall。
+
+用法:
+    python benchmarks/bench_quantization.py --sizes 10000,100000 --modes int8,binary --rescore-factors 1,4,10
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "servers"))
+from rag_quantization import QUANTIZATION_MODES, QuantizedVectorStore  # noqa: E402
+from bench_ann_index import generate_batch  # noqa: E402
+
+INSERT_BATCH = 10000
+
+
+def exact_top_k(vectors: np.ndarray, queries: np.ndarray, k: int) -> List[List[int]]:
+    """
+    功能: 以 float32 內積暴力搜尋作為基準答案。
+    參數:
+        vectors (np.ndarray): 資料向量。
+        queries (np.ndarray): 查詢向量。
+        k              (int): top-k。
+    回傳:
+        List[List[int]]: 每筆查詢的列號。
+    """
+    truth = []
+    for start in range(0, len(queries), 64):
+        scores = queries[start:start + 64] @ vectors.T
+        top = np.argpartition(-scores, k, axis=1)[:, :k]
+        for row, candidates in zip(scores, top):
+            truth.append(candidates[np.argsort(-row[candidates])].tolist())
+    return truth
+
+
+def search_all(store: QuantizedVectorStore, queries: np.ndarray, k: int):
+    """
+    功能: 逐筆查詢以量測單筆延遲。
+    參數:
+        store (QuantizedVectorStore): 量化向量儲存。
+        queries         (np.ndarray): 查詢向量。
+        k                      (int): top-k。
+    回傳:
+        Tuple[List[List[int]], List[float]]: 每筆查詢的結果 ID 與延遲（毫秒）。
+    """
+    ids, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        hits = store.search(query[None, :], k)[0]
+        latencies.append((time.perf_counter() - start) * 1000)
+        ids.append([child_id for child_id, _ in hits])
+    return ids, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark int8/binary quantized search against float32")
+    parser.add_argument("--sizes", default="10000,100000", help="以逗號分隔的子 chunk 數量")
+    parser.add_argument("--modes", default=",".join(QUANTIZATION_MODES))
+    parser.add_argument("--rescore-factors", default="1,4,10", help="第一階段候選為 k 的幾倍；1 約等於不重新評分")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="bench_quantization.json")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    centers = rng.normal(size=(256, args.dim)).astype(np.float32)
+    modes = [m.strip().lower() for m in args.modes.split(",") if m.strip()]
+    factors = [int(f) for f in args.rescore_factors.split(",")]
+    results: List[Dict] = []
+
+    for size in [int(s) for s in args.sizes.split(",")]:
+        vectors = np.concatenate([
+            generate_batch(args.seed, batch, min(INSERT_BATCH, size - offset), args.dim, centers)
+            for batch, offset in enumerate(range(0, size, INSERT_BATCH))
+        ])
+        queries = generate_batch(args.seed + 10_000_000, 0, args.queries, args.dim, centers)
+        # 列號從 1 起算，與量化儲存自動配發的 ID 一致
+        truth = [[row + 1 for row in rows] for rows in exact_top_k(vectors, queries, args.k)]
+        float32_bytes = vectors.nbytes
+
+        for mode in modes:
+            store = QuantizedVectorStore(tempfile.mkdtemp(), mode=mode, metric="IP")
+            start = time.perf_counter()
+            for offset in range(0, size, INSERT_BATCH):
+                store.add(vectors[offset:offset + INSERT_BATCH])
+            build_seconds = time.perf_counter() - start
+
+            for factor in factors:
+                store.rescore_factor = factor
+                ids, latencies = search_all(store, queries, args.k)
+                recall = float(np.mean([len(set(a) & set(t)) / args.k for a, t in zip(ids, truth)]))
+                entry = {
+                    "size": size,
+                    "mode": mode,
+                    "dim": args.dim,
+                    "k": args.k,
+                    "rescore_factor": factor,
+                    "build_seconds": round(build_seconds, 3),
+                    "resident_bytes": store.memory_bytes(),
+                    "compression_ratio": round(float32_bytes / store.memory_bytes(), 2),
+                    "recall_at_k": round(recall, 4),
+                    "recall_loss": round(1.0 - recall, 4),
+                    "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+                    "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+                }
+                results.append(entry)
+                print(json.dumps(entry, ensure_ascii=False))
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"結果已寫入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
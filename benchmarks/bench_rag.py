@@ -0,0 +1,450 @@
+# -*- coding: utf-8 -*-
+"""
+ParentRAG 端到端基準測試：以合成語料（可選繁體中文）量測匯入各階段吞吐量、1..N 個並行用戶端的查詢延遲
+p50/p95/p99、docstore 與向量資料庫的記憶體/磁碟用量，以及相對於精確搜尋的 recall@k，結果輸出為 JSON。
+全程在 CPU 上執行且不連網；--model 指定本機的小型 embedding 模型，'hashing' 則使用內建的雜湊向量（不需模型，
+適合做冒煙測試或只比較非 embedding 部分的效能）。
+
+用法:
+    python benchmarks/bench_rag.py --model /models/bge-small-zh --docs 2000 --lang zh --clients 1,4,16
+    VECTOR_QUANTIZATION=int8 python benchmarks/bench_rag.py --model hashing --docs 5000
+"""
+from __future__ import annotations
+import argparse
+import hashlib
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+# 不連網：模型只能從本機載入
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+for key, value in {
+    "CHILD_CHUNK_SIZE": "128",
+    "CHILD_CHUNK_OVERLAP": "32",
+    "TOP_K": "5",
+    "DEVICE": "cpu",
+    "COLLECTION_NAME": "bench",
+}.items():
+    os.environ.setdefault(key, value)
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "servers"))
+from langchain_core.embeddings import Embeddings  # noqa: E402
+from parent_rag_server import IngestPipeline, ParentRAGEngine, QueryResultCache, RetrieveBatcher  # noqa: E402
+from rag_embedding_cache import embed_query_batch  # noqa: E402
+
+ZH_TOPICS = [
+    ["伺服器", "機櫃", "電源供應器", "散熱", "風扇", "主機板", "韌體", "開機", "溫度", "備援"],
+    ["網路卡", "交換器", "頻寬", "封包", "延遲", "光纖", "路由", "防火牆", "虛擬區域網路", "連線"],
+    ["合約", "保固", "授權", "採購", "報價", "付款", "條款", "續約", "供應商", "驗收"],
+    ["硬碟", "固態硬碟", "陣列", "備份", "還原", "快照", "容量", "讀寫", "檔案系統", "儲存池"],
+    ["監控", "告警", "日誌", "儀表板", "指標", "事件", "排程", "通知", "值班", "稽核"],
+    ["部署", "容器", "叢集", "映像檔", "版本", "回滾", "設定檔", "環境變數", "服務", "負載平衡"],
+]
+ZH_FILLERS = ["的", "與", "在", "需要", "進行", "確認", "檢查", "設定", "更新", "支援", "建議", "說明", "以及", "若", "應"]
+EN_TOPICS = [
+    ["server", "rack", "power", "supply", "cooling", "fan", "motherboard", "firmware", "boot", "redundancy"],
+    ["network", "switch", "bandwidth", "packet", "latency", "fiber", "routing", "firewall", "vlan", "link"],
+    ["contract", "warranty", "license", "purchase", "quote", "payment", "clause", "renewal", "vendor", "acceptance"],
+    ["disk", "ssd", "array", "backup", "restore", "snapshot", "capacity", "throughput", "filesystem", "pool"],
+    ["monitoring", "alert", "log", "dashboard", "metric", "event", "schedule", "notification", "oncall", "audit"],
+    ["deploy", "container", "cluster", "image", "version", "rollback", "config", "environment", "service", "balancer"],
+]
+EN_FILLERS = ["the", "and", "in", "requires", "check", "verify", "set", "update", "supports", "should", "when", "for"]
+
+
+# ---------- 合成語料 ----------
+def make_sentence(rng: random.Random, topic: List[str], lang: str) -> str:
+    """
+    功能: 以主題詞彙與虛詞組成一個句子。
+    參數:
+        rng (random.Random): 亂數產生器。
+        topic    (List[str]): 主題詞彙。
+        lang          (str): 'zh' 或 'en'。
+    回傳:
+        str: 句子。
+    """
+    fillers = ZH_FILLERS if lang == "zh" else EN_FILLERS
+    words = [rng.choice(topic) if rng.random() < 0.6 else rng.choice(fillers) for _ in range(rng.randint(6, 12))]
+    if lang == "zh":
+        return "".join(words) + "。"
+    return " ".join(words).capitalize() + "."
+
+
+def make_document(seed: int, index: int, lang: str, paragraphs: int) -> Tuple[str, List[str]]:
+    """
+    功能: 以固定種子產生一份文件，重複呼叫得到相同內容。
+    參數:
+        seed       (int): 基礎亂數種子。
+        index      (int): 文件編號。
+        lang       (str): 'zh' 或 'en'。
+        paragraphs (int): 段落數。
+    回傳:
+        Tuple[str, List[str]]: (全文, 句子列表)。
+    """
+    rng = random.Random(seed * 1_000_003 + index)
+    topics = ZH_TOPICS if lang == "zh" else EN_TOPICS
+    topic = topics[index % len(topics)] + rng.choice(topics)[:3]
+    sentences, blocks = [], []
+    for p in range(paragraphs):
+        block = [make_sentence(rng, topic, lang) for _ in range(rng.randint(3, 6))]
+        if p == 0:
+            block.insert(0, f"料號 PN-{index:06d}。" if lang == "zh" else f"Part number PN-{index:06d}.")
+        sentences.extend(block)
+        blocks.append(("" if lang == "zh" else " ").join(block))
+    return "\n\n".join(blocks), sentences
+
+
+def write_corpus(directory: str, docs: int, seed: int, lang: str, paragraphs: int) -> Dict[str, List[str]]:
+    """
+    功能: 將合成語料寫入目錄。
+    參數:
+        directory  (str): 目錄。
+        docs       (int): 文件數。
+        seed       (int): 亂數種子。
+        lang       (str): 'zh' 或 'en'。
+        paragraphs (int): 每份文件的段落數。
+    回傳:
+        Dict[str, List[str]]: 檔案路徑 -> 句子列表（用於產生查詢）。
+    """
+    sentences = {}
+    for index in range(docs):
+        text, doc_sentences = make_document(seed, index, lang, paragraphs)
+        path = os.path.join(directory, f"doc_{index:06d}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        sentences[path] = doc_sentences
+    return sentences
+
+
+def make_queries(sentences: Dict[str, List[str]], count: int, seed: int, lang: str) -> List[Tuple[str, str]]:
+    """
+    功能: 從文件中隨機取句子並刪去部分詞彙作為查詢，每個查詢都不同以避免命中快取。
+    參數:
+        sentences (Dict[str, List[str]]): 檔案路徑 -> 句子列表。
+        count                      (int): 查詢數量。
+        seed                       (int): 亂數種子。
+        lang                       (str): 'zh' 或 'en'。
+    回傳:
+        List[Tuple[str, str]]: (查詢, 來源檔案路徑)。
+    """
+    rng = random.Random(seed + 7)
+    paths = sorted(sentences)
+    queries = []
+    for i in range(count):
+        path = rng.choice(paths)
+        sentence = rng.choice(sentences[path])
+        if lang == "zh":
+            cut = rng.randint(0, max(0, len(sentence) // 4))
+            query = sentence[cut:len(sentence) - cut] or sentence
+        else:
+            words = sentence.split()
+            query = " ".join(w for w in words if rng.random() > 0.2) or sentence
+        queries.append((f"{query} #{i}", path))
+    return queries
+
+
+# ---------- 不需模型的雜湊向量 ----------
+class HashingEmbeddings(Embeddings):
+    def __init__(self, dim: int = 384):
+        """
+        功能: 以字元二元組雜湊成固定維度並正規化的向量，不需下載模型，結果可重現。
+        參數:
+            dim (int): 向量維度。
+        回傳:
+            None
+        """
+        self.dim = dim
+        self.query_encode_kwargs = {}
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for i in range(len(text) - 1):
+            digest = hashlib.blake2b(text[i:i + 2].encode("utf-8"), digest_size=4).digest()
+            vector[int.from_bytes(digest, "little") % self.dim] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+# ---------- 量測 ----------
+def rss_bytes() -> int:
+    """
+    功能: 回傳目前行程的常駐記憶體；非 Linux 時退回峰值 RSS。
+    參數:
+        無
+    回傳:
+        int: 位元組數。
+    """
+    try:
+        with open("/proc/self/status", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def disk_bytes(path: str) -> int:
+    """
+    功能: 計算檔案或目錄的磁碟用量。
+    參數:
+        path (str): 路徑。
+    回傳:
+        int: 位元組數，不存在時為 0。
+    """
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+
+def percentiles(latencies: List[float]) -> Dict[str, float]:
+    """
+    功能: 計算延遲百分位數。
+    參數:
+        latencies (List[float]): 延遲（毫秒）。
+    回傳:
+        Dict[str, float]: p50 / p95 / p99 / mean（毫秒）。
+    """
+    return {
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+        "mean_ms": round(float(np.mean(latencies)), 3),
+    }
+
+
+def bench_ingest(engine: ParentRAGEngine, corpus_dir: str) -> Dict:
+    """
+    功能: 匯入語料並回報各階段的處理秒數與吞吐量。
+    參數:
+        engine (ParentRAGEngine): 檢索引擎。
+        corpus_dir         (str): 語料目錄。
+    回傳:
+        Dict: 匯入結果。
+    """
+    corpus_bytes = disk_bytes(corpus_dir)
+    pipeline = IngestPipeline(engine, os.path.abspath(corpus_dir), "**/*.txt")
+    start = time.perf_counter()
+    counts = pipeline.run()
+    wall = time.perf_counter() - start
+    stages = {}
+    for stage, seconds in pipeline.stage_seconds.items():
+        stages[stage] = {
+            "seconds": round(seconds, 3),
+            "docs_per_s": round(counts["added"] / seconds, 1) if seconds else None,
+            "chunks_per_s": round(counts["chunks"] / seconds, 1) if seconds else None,
+        }
+    return {
+        **counts,
+        "wall_seconds": round(wall, 3),
+        "docs_per_s": round(counts["added"] / wall, 1),
+        "chunks_per_s": round(counts["chunks"] / wall, 1),
+        "mb_per_s": round(corpus_bytes / wall / 1e6, 3),
+        "stages": stages,
+    }
+
+
+def bench_latency(engine: ParentRAGEngine, queries: List[Tuple[str, str]], clients: List[int],
+                  per_client: int, search: str, via: str) -> List[Dict]:
+    """
+    功能: 以 1..N 個並行用戶端送出查詢，量測延遲百分位數與吞吐量；每個查詢都不同，不會命中結果快取。
+    參數:
+        engine (ParentRAGEngine): 檢索引擎。
+        queries (List[Tuple[str, str]]): 查詢池。
+        clients         (List[int]): 並行用戶端數列表。
+        per_client            (int): 每個用戶端的查詢數。
+        search                (str): 'vector'、'keyword' 或 'hybrid'。
+        via                   (str): 'batcher' 經由 RetrieveBatcher（與 MCP 工具相同路徑），'direct' 直接呼叫 retrieve。
+    回傳:
+        List[Dict]: 每個並行數的結果。
+    """
+    batcher = RetrieveBatcher(engine) if via == "batcher" else None
+    results, offset = [], 0
+    for count in clients:
+        pool = [queries[(offset + i) % len(queries)][0] for i in range(count * per_client)]
+        offset += len(pool)
+        latencies: List[float] = []
+        lock = threading.Lock()
+
+        def client(worker: int) -> None:
+            own = []
+            for query in pool[worker * per_client:(worker + 1) * per_client]:
+                start = time.perf_counter()
+                if batcher is not None:
+                    batcher.submit(query, search=search).result()
+                else:
+                    engine.retrieve(query, search=search)
+                own.append((time.perf_counter() - start) * 1000)
+            with lock:
+                latencies.extend(own)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=count) as executor:
+            list(executor.map(client, range(count)))
+        wall = time.perf_counter() - start
+        entry = {"clients": count, "queries": len(pool), "qps": round(len(pool) / wall, 1), **percentiles(latencies)}
+        results.append(entry)
+        print(json.dumps(entry, ensure_ascii=False))
+    return results
+
+
+def bench_recall(engine: ParentRAGEngine, queries: List[Tuple[str, str]], k: int, search: str) -> Dict:
+    """
+    功能: 以全部子 chunk 向量的暴力內積搜尋作為精確基準，計算引擎檢索的 recall@k，並統計來源文件命中率。
+    參數:
+        engine (ParentRAGEngine): 檢索引擎。
+        queries (List[Tuple[str, str]]): (查詢, 來源檔案路徑)。
+        k                     (int): top-k。
+        search                (str): 'vector'、'keyword' 或 'hybrid'。
+    回傳:
+        Dict: recall_at_k 與 source_hit_rate。
+    """
+    chunks = list(engine.keyword_index.get(engine.keyword_index.child_ids()).values())
+    keys = [(doc.metadata.get("source"), doc.page_content) for doc in chunks]
+    matrix = np.asarray(engine.embeddings.embed_documents([doc.page_content for doc in chunks]), dtype=np.float32)
+    query_vectors = np.asarray(embed_query_batch(engine.embeddings, [q for q, _ in queries]), dtype=np.float32)
+
+    recalls, source_hits = [], []
+    for (query, source), vector in zip(queries, query_vectors):
+        top = np.argsort(-(matrix @ vector))[:k]
+        truth = {keys[i] for i in top}
+        result = engine.retrieve(query, k=k, search=search)
+        got = {(doc.metadata.get("source"), doc.page_content) for doc in result["child_documents"]}
+        recalls.append(len(truth & got) / len(truth) if truth else 1.0)
+        source_hits.append(any(doc.metadata.get("source") == source for doc in result["parent_documents"]))
+    return {
+        "k": k,
+        "queries": len(queries),
+        "recall_at_k": round(float(np.mean(recalls)), 4),
+        "source_hit_rate": round(float(np.mean(source_hits)), 4),
+    }
+
+
+def bench_memory(engine: ParentRAGEngine, db_dir: str, rss: Dict[str, int]) -> Dict:
+    """
+    功能: 回報各儲存的磁碟用量與行程 RSS 變化。
+    參數:
+        engine (ParentRAGEngine): 檢索引擎。
+        db_dir             (str): 資料庫目錄。
+        rss     (Dict[str, int]): 各時間點的 RSS。
+    回傳:
+        Dict: 記憶體與磁碟用量。
+    """
+    name = engine.collection_name
+    report = {
+        "rss_bytes": rss,
+        "disk_bytes": {
+            "docstore": disk_bytes(os.path.join(db_dir, f"{name}_docstore")) or disk_bytes(os.path.join(db_dir, f"{name}.pkl")),
+            "vector_store": disk_bytes(os.path.join(db_dir, f"{name}.db")),
+            "keyword_index": disk_bytes(os.path.join(db_dir, f"{name}_bm25.db")),
+            "embedding_cache": disk_bytes(os.path.join(db_dir, "embedding_cache")),
+        },
+        "children": engine.keyword_index.count(),
+        "parent_cache": engine.doc_store.stats(),
+    }
+    if engine.quantized_store is not None:
+        report["disk_bytes"]["quantized_store"] = disk_bytes(engine.quantized_store.directory)
+        report["quantized_resident_bytes"] = engine.quantized_store.memory_bytes()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end ParentRAG benchmark on a synthetic corpus")
+    parser.add_argument("--model", default=os.getenv("EMBEDDING_MODEL_PATH") or "hashing",
+                        help="本機 embedding 模型路徑，'hashing' 使用內建雜湊向量")
+    parser.add_argument("--docs", type=int, default=1000)
+    parser.add_argument("--paragraphs", type=int, default=6, help="每份文件的段落數")
+    parser.add_argument("--lang", choices=("zh", "en"), default="zh", help="zh 產生繁體中文語料")
+    parser.add_argument("--clients", default="1,2,4,8", help="以逗號分隔的並行用戶端數")
+    parser.add_argument("--queries-per-client", type=int, default=50)
+    parser.add_argument("--recall-queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--search", choices=("vector", "keyword", "hybrid"), default="vector")
+    parser.add_argument("--via", choices=("batcher", "direct"), default="batcher")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workdir", default="", help="語料與資料庫目錄，預設使用暫存目錄")
+    parser.add_argument("--output", default="bench_rag.json")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_rag_")
+    corpus_dir = os.path.join(workdir, "corpus")
+    db_dir = os.path.join(workdir, "db")
+    os.makedirs(corpus_dir, exist_ok=True)
+    clients = [int(c) for c in args.clients.split(",")]
+
+    rss = {"start": rss_bytes()}
+    sentences = write_corpus(corpus_dir, args.docs, args.seed, args.lang, args.paragraphs)
+    queries = make_queries(sentences, max(args.recall_queries, max(clients) * args.queries_per_client), args.seed, args.lang)
+
+    start = time.perf_counter()
+    engine = ParentRAGEngine(
+        embedding_model_path=args.model,
+        database_dir=db_dir,
+        collection_name=os.environ["COLLECTION_NAME"],
+        device="cpu",
+        top_k=args.k,
+        embeddings=HashingEmbeddings() if args.model == "hashing" else None,
+    )
+    engine.query_cache = QueryResultCache(max_size=0)
+    startup_seconds = time.perf_counter() - start
+    rss["engine_loaded"] = rss_bytes()
+
+    ingest = bench_ingest(engine, corpus_dir)
+    print(json.dumps({"ingest": ingest}, ensure_ascii=False))
+    rss["after_ingest"] = rss_bytes()
+
+    latency = bench_latency(engine, queries, clients, args.queries_per_client, args.search, args.via)
+    recall = bench_recall(engine, queries[:args.recall_queries], args.k, args.search)
+    print(json.dumps({"recall": recall}, ensure_ascii=False))
+    rss["after_queries"] = rss_bytes()
+
+    report = {
+        "config": {
+            "model": args.model,
+            "docs": args.docs,
+            "paragraphs": args.paragraphs,
+            "lang": args.lang,
+            "k": args.k,
+            "search": args.search,
+            "via": args.via,
+            "seed": args.seed,
+            "env": {
+                key: os.getenv(key, "") for key in (
+                    "CHILD_CHUNK_SIZE", "CHILD_CHUNK_OVERLAP", "DOCSTORE_BACKEND", "EMBEDDING_CACHE",
+                    "VECTOR_INDEX_TYPE", "VECTOR_METRIC", "VECTOR_QUANTIZATION", "RETRIEVE_BATCH_WINDOW_MS",
+                )
+            },
+        },
+        "startup_seconds": round(startup_seconds, 3),
+        "ingest": ingest,
+        "latency": latency,
+        "recall": recall,
+        "memory": bench_memory(engine, db_dir, rss),
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"結果已寫入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
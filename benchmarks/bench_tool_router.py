@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+工具路由基準測試：以 Experiments/exp_question.md 的問題比較「綁定全部工具」與「embedding 路由後只綁定 top-N 工具」
+每輪送給 LLM 的工具 schema token 數，以及路由結果是否涵蓋回答該問題所需的工具（tool recall）。
+工具 schema 直接取自各 MCP 伺服器模組的 FastMCP 實例（不啟動子行程）；同一段落（以空行分隔）的問題視為同一段對話，
+上一題需要的工具會延續到下一題，與客戶端的行為一致。
+
+用法:
+    python benchmarks/bench_tool_router.py --model /models/bge-m3 --tokenizer /models/Qwen3-32B --top-n 4,8,12
+    python benchmarks/bench_tool_router.py --model hashing
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import sys
+import time
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+for key, value in {
+    "CHILD_CHUNK_SIZE": "128",
+    "CHILD_CHUNK_OVERLAP": "32",
+    "TOP_K": "3",
+}.items():
+    os.environ.setdefault(key, value)
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "servers"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from langchain_core.tools import BaseTool  # noqa: E402
+from langchain_core.utils.function_calling import convert_to_openai_tool  # noqa: E402
+from langchain_mcp_adapters.tools import convert_mcp_tool_to_langchain_tool  # noqa: E402
+from client_memory import TokenCounter  # noqa: E402
+from client_prompt import canonicalize_tools  # noqa: E402
+from client_tools import ToolRouter, load_router_embeddings  # noqa: E402
+
+SERVER_MODULES = ("math_server", "db_server", "filesystem_server", "markitdown_server", "parent_rag_server")
+
+MATH_TOOLS = "add|subtract|multiply|divide|sin|cos|tan|degrees_to_radians|radians_to_degrees|sqrt|log|power|factorial"
+FILESYSTEM_TOOLS = "list_directory|check_exists|get_file_info|create_directory|delete_item|move_or_rename|copy_item"
+
+# 問題（以開頭文字比對）-> 回答所需的工具；以 | 分隔的名稱表示任一個即可
+EXPECTED_TOOLS: List[Tuple[str, List[str]]] = [
+    ("(sin(45°)² + cos(30°)²) + log(100)", ["sin", "cos", "log", "add"]),
+    ("把 /raid2/Billy/RAGwithCache/data/文字類資料", ["convert_directory_to_markdown"]),
+    ("把這寫檔案加入到資料庫", ["add_documents|start_add_documents"]),
+    ("針對 \"AE卡併機\"", ["retrieve|retrieve_many"]),
+    ("增加兩個表格", ["create_table", "insert_data"]),
+    ("請移除第一個和第三個管理者", ["delete_data"]),
+    ("刪除兩個表格的所有資料", ["delete_data"]),
+    ("計算log(100)後取整數視為X", ["log", "create_table", "add", "list_directory", "insert_data"]),
+    ("請先查看並使用你現有的數學工具", [MATH_TOOLS]),
+    ("請先查看你現有的markitdown工具", ["convert_to_markdown|convert_directory_to_markdown"]),
+    ("先查看你現有的filesystem工具", [FILESYSTEM_TOOLS, "retrieve|retrieve_many"]),
+]
+
+
+def load_conversations(path: str) -> List[List[Tuple[str, List[str]]]]:
+    """
+    功能: 讀取問題檔，以空行分隔成對話段落，並對應到標註的所需工具。
+    參數:
+        path (str): exp_question.md 路徑。
+    回傳:
+        List[List[Tuple[str, List[str]]]]: 每段對話的（問題, 所需工具）列表。
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        blocks = [block for block in f.read().split("\n\n") if block.strip()]
+    conversations = []
+    for block in blocks:
+        conversation = []
+        for question in (line.strip() for line in block.splitlines()):
+            if not question:
+                continue
+            expected = next((tools for prefix, tools in EXPECTED_TOOLS if question.startswith(prefix)), None)
+            if expected is None:
+                print(f"略過未標註的問題: {question[:30]}")
+                continue
+            conversation.append((question, expected))
+        if conversation:
+            conversations.append(conversation)
+    return conversations
+
+
+def load_tools() -> Tuple[List[BaseTool], List[str]]:
+    """
+    功能: 匯入各伺服器模組並列出其 FastMCP 工具，轉成 langchain 工具（只取 schema，不會被呼叫）。
+    參數:
+        無
+    回傳:
+        Tuple[List[BaseTool], List[str]]: 正規化排序後的工具，以及因缺少依賴而略過的伺服器。
+    """
+    tools, skipped = [], []
+    for name in SERVER_MODULES:
+        try:
+            module = importlib.import_module(name)
+            mcp_tools = asyncio.run(module.mcp.list_tools())
+        except Exception as e:
+            print(f"略過 {name}: {type(e).__name__}: {e}")
+            skipped.append(name)
+            continue
+        tools.extend(convert_mcp_tool_to_langchain_tool(None, tool) for tool in mcp_tools)
+    return canonicalize_tools(tools), skipped
+
+
+def schema_tokens(counter: TokenCounter, tools: Sequence[BaseTool]) -> int:
+    """
+    功能: 計算工具 schema 在 prompt 中的 token 數（chat template 以每行一個 JSON 物件列出工具）。
+    參數:
+        counter (TokenCounter): token 計數器。
+        tools (Sequence[BaseTool]): 工具。
+    回傳:
+        int: token 數。
+    """
+    return sum(
+        counter.count_text(json.dumps(convert_to_openai_tool(tool), ensure_ascii=False)) for tool in tools
+    )
+
+
+def bench_top_n(router: ToolRouter, counter: TokenCounter, conversations, sticky: bool) -> Dict:
+    """
+    功能: 以目前的 top_n 跑過所有問題，統計工具 token 數、recall 與路由延遲。
+    參數:
+        router      (ToolRouter): 工具路由。
+        counter   (TokenCounter): token 計數器。
+        conversations     (List): load_conversations 的結果。
+        sticky            (bool): 是否延續上一題需要的工具。
+    回傳:
+        Dict: 統計結果與每題的明細。
+    """
+    full_tokens = schema_tokens(counter, router.tools)
+    available = {tool.name for tool in router.tools}
+    rows, latencies = [], []
+    for conversation in conversations:
+        router.reset()
+        recent: List[str] = []
+        for question, expected in conversation:
+            start = time.perf_counter()
+            selected = router.select(question, recent if sticky else ())
+            latencies.append((time.perf_counter() - start) * 1000)
+            names = {tool.name for tool in selected}
+
+            required = [item for item in expected if set(item.split("|")) & available]
+            covered = [item for item in required if set(item.split("|")) & names]
+            rows.append({
+                "question": question[:40],
+                "selected": sorted(names),
+                "missing": [item for item in required if item not in covered],
+                "recall": round(len(covered) / len(required), 4) if required else None,
+                "tool_tokens": schema_tokens(counter, selected),
+            })
+            recent = [name for item in required for name in item.split("|") if name in names][:len(required)]
+
+    scored = [row for row in rows if row["recall"] is not None]
+    routed_tokens = float(np.mean([row["tool_tokens"] for row in rows]))
+    return {
+        "top_n": router.top_n,
+        "avg_selected": round(float(np.mean([len(row["selected"]) for row in rows])), 2),
+        "full_tool_tokens": full_tokens,
+        "avg_routed_tool_tokens": round(routed_tokens, 1),
+        "token_savings": round(1 - routed_tokens / full_tokens, 4) if full_tokens else None,
+        "tool_recall": round(float(np.mean([row["recall"] for row in scored])), 4) if scored else None,
+        "full_coverage": round(sum(row["recall"] == 1 for row in scored) / len(scored), 4) if scored else None,
+        "route_p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        # 工具組合改變的次數（每次都使 prefix cache 只能重用到工具區塊之前），含每段對話的第一輪
+        "tool_set_changes": router.changes,
+        "questions": rows,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tool router token savings and selection accuracy benchmark")
+    parser.add_argument("--model", default=os.getenv("TOOL_ROUTER_MODEL_PATH") or os.getenv("EMBEDDING_MODEL_PATH") or "hashing",
+                        help="本機 embedding 模型路徑，'hashing' 使用 bench_rag 的雜湊向量（只做冒煙測試）")
+    parser.add_argument("--tokenizer", default=os.getenv("LLM_MODEL_PATH", ""),
+                        help="計算 token 數用的 LLM tokenizer 路徑，無法載入時改用估算")
+    parser.add_argument("--questions", default=os.path.join(ROOT, "Experiments", "exp_question.md"))
+    parser.add_argument("--top-n", default="4,8,12", help="以逗號分隔的 top-N")
+    parser.add_argument("--always-on", default="", help="以逗號分隔、每輪都啟用的工具")
+    parser.add_argument("--no-sticky", action="store_true", help="不延續上一題需要的工具")
+    parser.add_argument("--grow-only", action="store_true", help="同一段對話中綁定的工具只增不減（TOOL_ROUTER_GROW_ONLY）")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--output", default="bench_tool_router.json")
+    args = parser.parse_args()
+
+    tools, skipped = load_tools()
+    conversations = load_conversations(args.questions)
+    counter = TokenCounter(args.tokenizer)
+    if args.model == "hashing":
+        from bench_rag import HashingEmbeddings
+        embeddings = HashingEmbeddings()
+    else:
+        embeddings = load_router_embeddings(args.model, args.device)
+    always_on = [name.strip() for name in args.always_on.split(",") if name.strip()]
+
+    results = []
+    for top_n in (int(n) for n in args.top_n.split(",")):
+        router = ToolRouter(tools, embeddings, top_n=top_n, always_on=always_on, grow_only=args.grow_only)
+        result = bench_top_n(router, counter, conversations, sticky=not args.no_sticky)
+        print(json.dumps({key: value for key, value in result.items() if key != "questions"}, ensure_ascii=False))
+        results.append(result)
+
+    report = {
+        "config": {
+            "model": args.model,
+            "tokenizer": args.tokenizer if counter.tokenizer is not None else "estimate",
+            "tools": len(tools),
+            "skipped_servers": skipped,
+            "questions": sum(len(conversation) for conversation in conversations),
+            "always_on": always_on,
+            "sticky": not args.no_sticky,
+            "grow_only": args.grow_only,
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"結果已寫入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,109 +1,164 @@
-from mcp import ClientSession, StdioServerParameters
-from mcp.client.stdio import stdio_client
-from langchain_mcp_adapters.client import MultiServerMCPClient
-from langgraph.prebuilt import create_react_agent
-from langchain_openai import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate
-import asyncio
-from typing import List
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
-from langchain_core.output_parsers import StrOutputParser
-from langchain.agents.output_parsers import JSONAgentOutputParser  # 新增：導入 JSONAgentOutputParser
-from langchain.memory import ConversationBufferMemory
-from dotenv import load_dotenv
-import os
-import time
-
-load_dotenv()
-LLM_URL = os.getenv("LLM_URL", "")
-LLM_MODEL_PATH = os.getenv("LLM_MODEL_PATH", "")
-print(LLM_MODEL_PATH, LLM_URL)
-model = ChatOpenAI(
-    model=LLM_MODEL_PATH,
-    base_url=LLM_URL,
-    api_key="EMPTY",  # 自建vllm服務可填任意字串
-)
-
-# 使用ChatPromptTemplate替換原來的消息列表
-prompt = [
-    SystemMessage(content="你是一個會使用工具的AI助手。"),
-    HumanMessage(content="你使用的語言是什麼?"),
-    AIMessage(content="我只會使用繁體中文和英文，其他語言我都不使用。"),
-    HumanMessage(content="你是否會計劃步驟?"),
-    AIMessage(content="我會先了解使用者的需求後，再來一步一步計畫步驟，最後依照步驟執行，讓我可以準確完成任務。"),
-]
-
-# 初始化聊天記憶，並將 prompt 加入 memory 中
-memory = ConversationBufferMemory(return_messages=True)
-memory.chat_memory.messages = prompt.copy()
-
-async def main():
-
-    async with MultiServerMCPClient(
-        {
-            "math": {
-                "command": "python",
-                "args": ["servers/math_server.py"],
-                "transport": "stdio",
-            },
-            "database": { 
-                "command": "python",
-                "args": ["servers/db_server.py"],
-                "transport": "stdio",
-            },
-            "markitdown": {
-                "command": "python",
-                "args": ["servers/markitdown_server.py"],
-                "transport": "stdio",
-            },
-            "filesystem": {
-                "command": "python",
-                "args": ["servers/filesystem_server.py"],
-                "transport": "stdio",
-            },
-            "parentrag": {
-                "command": "python",
-                "args": ["servers/parent_rag_server.py"],
-                "transport": "stdio",
-            },
-            "test": {
-                "command": "python",
-                "args": ["servers/test_server.py"],
-                "transport": "stdio",
-            }
-        }
-    ) as client:
-        agent = create_react_agent(model, client.get_tools())
-
-        while True:
-            user_input = input("User > ").strip()
-            if user_input.lower() in ['exit', 'q']:
-                print("結束!")
-                return
-            else: 
-                start = time.time()
-
-                all_messages = memory.chat_memory.messages + [HumanMessage(content=user_input)]
-                        
-                agent_response = await agent.ainvoke({"messages": all_messages})
-                
-                # 提取最後一條AI消息作為最終答案
-                final_messages = agent_response.get("messages", [])
-                final_answer = "無法獲得答案"
-                
-                # 從最後往前找AI消息
-                for msg in reversed(final_messages):
-                    if isinstance(msg, AIMessage):
-                        final_answer = msg.content
-                        break
-
-                print(final_answer)
-                # 更新記憶
-                memory.save_context({"input": user_input}, {"output": final_answer})
-
-                end = time.time()
-                print(f"Take {(end-start) / 60} mins")
-
-# 4. 啟動
-if __name__ == "__main__":
+from mcp import ClientSession, StdioServerParameters
+from mcp.client.stdio import stdio_client
+from langgraph.prebuilt import create_react_agent
+from langchain_openai import ChatOpenAI
+from langchain.prompts import ChatPromptTemplate
+import asyncio
+from typing import List
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from langchain_core.output_parsers import StrOutputParser
+from langchain.agents.output_parsers import JSONAgentOutputParser  # 新增：導入 JSONAgentOutputParser
+from dotenv import load_dotenv
+import os
+import time
+
+from client_memory import SummarizingMemory, TokenCounter
+from client_servers import LazyServerPool
+from client_cache import ToolResultCache
+from client_stream import stream_turn, turn_timings
+from client_prompt import PromptCacheStats, canonicalize_tools, prefix_fingerprint
+from client_tools import AgentCache, ToolRouter, called_tools, load_router_embeddings
+
+load_dotenv()
+LLM_URL = os.getenv("LLM_URL", "")
+LLM_MODEL_PATH = os.getenv("LLM_MODEL_PATH", "")
+MEMORY_MAX_TOKENS = int(os.getenv("MEMORY_MAX_TOKENS", "4096"))  # 完整保留的最近對話 token 預算，超過的舊對話併入摘要
+MEMORY_SUMMARY_TOKENS = int(os.getenv("MEMORY_SUMMARY_TOKENS", "512"))  # 滾動摘要的 token 上限
+MCP_TOOL_MANIFEST = os.getenv("MCP_TOOL_MANIFEST", "./database/mcp_tool_manifest.json")  # 工具 schema 快取清單
+MCP_IDLE_TIMEOUT = float(os.getenv("MCP_IDLE_TIMEOUT", "600"))  # 伺服器閒置多少秒後關閉，0 表示不關閉
+MCP_HOST_URL = os.getenv("MCP_HOST_URL", "")  # 例如 http://127.0.0.1:3000，設定時改連 servers/host_server.py 的單一行程
+MCP_SPAWN_TIMEOUT = float(os.getenv("MCP_SPAWN_TIMEOUT", "120"))  # 等待伺服器啟動完成的秒數上限
+TOOL_CACHE = os.getenv("TOOL_CACHE", "true").lower() == "true"  # 客戶端快取純函式與唯讀工具的結果
+TOOL_CACHE_SIZE = int(os.getenv("TOOL_CACHE_SIZE", "512"))
+TOOL_ROUTER = os.getenv("TOOL_ROUTER", "false").lower() == "true"  # 每輪只綁定與輸入相關的工具（工具組合改變時 prefix cache 失效）
+TOOL_ROUTER_GROW_ONLY = os.getenv("TOOL_ROUTER_GROW_ONLY", "true").lower() == "true"  # 綁定的工具在對話中只增不減
+TOOL_ROUTER_MODEL_PATH = os.getenv("TOOL_ROUTER_MODEL_PATH") or os.getenv("EMBEDDING_MODEL_PATH", "")  # 未設定時使用 RAG 的 embedding 模型
+TOOL_ROUTER_DEVICE = os.getenv("TOOL_ROUTER_DEVICE", "cpu")
+TOOL_ROUTER_TOP_N = int(os.getenv("TOOL_ROUTER_TOP_N", "8"))
+TOOL_ROUTER_ALWAYS_ON = [name.strip() for name in os.getenv("TOOL_ROUTER_ALWAYS_ON", "").split(",") if name.strip()]
+print(LLM_MODEL_PATH, LLM_URL)
+model = ChatOpenAI(
+    model=LLM_MODEL_PATH,
+    base_url=LLM_URL,
+    api_key="EMPTY",  # 自建vllm服務可填任意字串
+    stream_usage=True,  # 串流時也回傳 usage，供 prefix cache 命中統計使用
+)
+
+# 使用ChatPromptTemplate替換原來的消息列表
+prompt = [
+    SystemMessage(content="你是一個會使用工具的AI助手。"),
+    HumanMessage(content="你使用的語言是什麼?"),
+    AIMessage(content="我只會使用繁體中文和英文，其他語言我都不使用。"),
+    HumanMessage(content="你是否會計劃步驟?"),
+    AIMessage(content="我會先了解使用者的需求後，再來一步一步計畫步驟，最後依照步驟執行，讓我可以準確完成任務。"),
+]
+
+# 初始化聊天記憶：prompt 作為固定前綴原樣保留，最近的對話在 token 預算內完整保留（只在尾端追加），較舊的對話在背景併入摘要
+token_counter = TokenCounter(LLM_MODEL_PATH)
+memory = SummarizingMemory(
+    prompt,
+    model,
+    token_counter,
+    max_tokens=MEMORY_MAX_TOKENS,
+    summary_tokens=MEMORY_SUMMARY_TOKENS,
+)
+prompt_cache_stats = PromptCacheStats()
+
+# MCP 伺服器設定（格式與 MultiServerMCPClient 相同）
+MCP_SERVERS = {
+    "math": {
+        "command": "python",
+        "args": ["servers/math_server.py"],
+        "transport": "stdio",
+    },
+    "database": {
+        "command": "python",
+        "args": ["servers/db_server.py"],
+        "transport": "stdio",
+    },
+    "markitdown": {
+        "command": "python",
+        "args": ["servers/markitdown_server.py"],
+        "transport": "stdio",
+    },
+    "filesystem": {
+        "command": "python",
+        "args": ["servers/filesystem_server.py"],
+        "transport": "stdio",
+    },
+    "parentrag": {
+        "command": "python",
+        "args": ["servers/parent_rag_server.py"],
+        "transport": "stdio",
+    },
+}
+if MCP_HOST_URL:
+    # 所有伺服器由 host_server.py 在同一個行程以 streamable HTTP 提供，多個客戶端共用同一組已暖機的伺服器
+    MCP_SERVERS = {
+        name: {"transport": "streamable_http", "url": f"{MCP_HOST_URL.rstrip('/')}/{name}/mcp"}
+        for name in MCP_SERVERS
+    }
+
+async def main():
+
+    # 伺服器按需啟動：工具 schema 來自快取清單，第一次呼叫某伺服器的工具時才啟動它，閒置後自動關閉
+    async with LazyServerPool(MCP_SERVERS, MCP_TOOL_MANIFEST, MCP_IDLE_TIMEOUT, MCP_SPAWN_TIMEOUT) as servers:
+        # 工具依名稱排序並正規化 schema，工具區塊 + system / few-shot 組成每次請求都相同的前綴，可重用 vLLM 的 prefix cache
+        tools = canonicalize_tools(await servers.get_tools())
+        # 工具結果快取：相同參數的純函式與唯讀工具不再往返 MCP 伺服器，寫入工具會清除同伺服器的快取
+        tool_cache = ToolResultCache(TOOL_CACHE_SIZE) if TOOL_CACHE else None
+        if tool_cache:
+            tools = tool_cache.wrap(tools)
+        print(f"Prompt prefix: {prefix_fingerprint(prompt, tools)} ({len(tools)} tools)")
+
+        # 工具路由：以 embedding 挑出與輸入相關的工具，每輪只綁定這些工具（相同組合的 agent 會重用）
+        router = None
+        if TOOL_ROUTER and TOOL_ROUTER_MODEL_PATH:
+            router = ToolRouter(
+                tools,
+                load_router_embeddings(TOOL_ROUTER_MODEL_PATH, TOOL_ROUTER_DEVICE),
+                top_n=TOOL_ROUTER_TOP_N,
+                always_on=TOOL_ROUTER_ALWAYS_ON,
+                grow_only=TOOL_ROUTER_GROW_ONLY,
+            )
+        agents = AgentCache(lambda selected: create_react_agent(model, selected))
+        recent_tools = []
+
+        while True:
+            # 在執行緒中等待輸入，等待期間事件迴圈仍可關閉閒置的伺服器
+            user_input = (await asyncio.to_thread(input, "User > ")).strip()
+            if user_input.lower() in ['exit', 'q']:
+                print("結束!")
+                return
+            else: 
+                start = time.time()
+
+                all_messages = await memory.build(user_input)
+                selected = router.select(user_input, recent_tools) if router else tools
+                agent = agents.get(selected)
+
+                # 串流執行：token 邊解碼邊印出，工具呼叫開始與結束時顯示耗時，最終回答即為最後一條 AI 訊息
+                turn = await stream_turn(agent, all_messages)
+                final_messages = turn["messages"]
+                final_answer = turn["final_answer"]
+
+                # 更新記憶：保留這一輪完整的訊息，下一輪的 prompt 以這一輪最後一次請求為前綴（超過預算時在背景摘要較舊的對話）
+                new_messages = final_messages[len(all_messages):]
+                recent_tools = called_tools(new_messages)
+                memory.save_turn(user_input, final_answer, new_messages)
+                cache_usage = prompt_cache_stats.record(new_messages)
+
+                end = time.time()
+                ttft = f"{turn['ttft_seconds']:.2f}s" if turn["ttft_seconds"] is not None else "-"
+                print(f"Turn: {end - start:.2f}s, first token: {ttft}, timings: {turn_timings(turn)}")
+                print(f"Prompt tokens: {token_counter.count(all_messages)}, memory: {memory.stats()}")
+                print(f"Prefix cache: {cache_usage}, session: {prompt_cache_stats.stats()}")
+                print(f"MCP servers: {servers.stats()['servers']}")
+                if tool_cache:
+                    print(f"Tool cache: {tool_cache.stats()}")
+                if router:
+                    print(f"Tools: {len(selected)}/{len(tools)} {[tool.name for tool in selected]}, router: {router.stats()}")
+
+# 4. 啟動
+if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+import json
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.tools import BaseTool
+
+# 可快取的工具 -> 存活秒數（None 表示不過期，只會被同伺服器的寫入清除）
+CACHEABLE_TOOLS: Dict[str, Optional[float]] = {
+    # 數學：純函式
+    **{name: None for name in (
+        "add", "subtract", "multiply", "divide", "sin", "cos", "tan", "degrees_to_radians",
+        "radians_to_degrees", "sqrt", "log", "power", "factorial",
+    )},
+    # 資料庫：結構查詢（query_data 不快取：共用 host_server 時其他客戶端的寫入不會清除這裡的快取）
+    "list_tables": 300,
+    "get_table_schema": 300,
+    # 檔案系統：唯讀查詢（檔案可能被客戶端以外的程式修改，存活時間較短）
+    "list_directory": 30,
+    "check_exists": 30,
+    "get_file_info": 30,
+}
+
+# 不快取、也不會改變任何狀態的工具（呼叫時不清除快取）。
+# RAG 檢索不在客戶端快取：背景匯入完成或共用主機的其他客戶端增刪文件後結果即改變，
+# 由伺服器端以知識庫版本為鍵的檢索結果快取處理
+READ_ONLY_TOOLS = {
+    "query_data", "get_job_status", "rag_health", "rag_stats",
+    "retrieve", "retrieve_many", "get_parent_document",
+}
+
+# 其餘工具視為會寫入：清除同一個伺服器的快取；下列工具另外清除其他伺服器的快取
+CROSS_SERVER_INVALIDATION: Dict[str, Tuple[str, ...]] = {
+    # markitdown 會把轉換結果寫成檔案
+    "convert_to_markdown": ("filesystem",),
+    "convert_directory_to_markdown": ("filesystem",),
+}
+
+
+def cache_key(tool_name: str, arguments: Dict) -> str:
+    """
+    功能: 以工具名稱與正規化（鍵排序）後的參數組成快取鍵。
+    參數:
+        tool_name  (str): 工具名稱。
+        arguments (Dict): 工具參數。
+    回傳:
+        str: 快取鍵。
+    """
+    return f"{tool_name}:{json.dumps(arguments, sort_keys=True, ensure_ascii=False, default=str)}"
+
+
+# ---------- 工具結果快取 ----------
+class ToolResultCache:
+    def __init__(self, max_size: int = 512):
+        """
+        功能: 客戶端的工具結果快取：可快取的工具以相同參數再次呼叫時直接回傳上次的結果，省下 MCP 往返；
+              會寫入的工具執行時清除同一個伺服器（與 CROSS_SERVER_INVALIDATION 指定的伺服器）的快取。
+              同時到達的相同呼叫只會送出一次。
+        參數:
+            max_size (int): 快取筆數上限，超過時移除最久未使用者。
+        回傳:
+            None
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.saved_seconds = 0.0
+        self.tool_hits: Dict[str, int] = {}
+        # key -> (server, 到期時間或 None, 結果, 原本的耗時)
+        self._entries: "OrderedDict[str, Tuple[str, Optional[float], Any, float]]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Future] = {}
+        # 每個伺服器的寫入世代：寫入開始與結束時遞增，讀取期間世代改變則不存入結果
+        self._generations: Dict[str, int] = {}
+
+    def wrap(self, tools: Sequence[BaseTool]) -> List[BaseTool]:
+        """
+        功能: 包裝工具：可快取的工具經過快取，會寫入的工具執行前後清除快取，唯讀工具不變。
+        參數:
+            tools (Sequence[BaseTool]): 工具（metadata["mcp_server"] 為所屬伺服器）。
+        回傳:
+            List[BaseTool]: 包裝後的工具（順序不變）。
+        """
+        wrapped = []
+        for tool in tools:
+            if tool.name in READ_ONLY_TOOLS or getattr(tool, "coroutine", None) is None:
+                wrapped.append(tool)
+                continue
+            server = (tool.metadata or {}).get("mcp_server", "")
+            if tool.name in CACHEABLE_TOOLS:
+                coroutine = self._cached_call(tool, server, CACHEABLE_TOOLS[tool.name])
+            else:
+                coroutine = self._mutating_call(tool, (server, *CROSS_SERVER_INVALIDATION.get(tool.name, ())))
+            wrapped.append(tool.model_copy(update={"coroutine": coroutine}))
+        return wrapped
+
+    def _cached_call(self, tool: BaseTool, server: str, ttl: Optional[float]):
+        """
+        功能: 建立經過快取的工具 coroutine。
+        參數:
+            tool  (BaseTool): 原始工具。
+            server     (str): 所屬伺服器。
+            ttl (Optional[float]): 存活秒數。
+        回傳:
+            Callable: 新的 coroutine 函式。
+        """
+        original = tool.coroutine
+
+        async def call(**arguments: Any):
+            key = cache_key(tool.name, arguments)
+            entry = self._entries.get(key)
+            if entry is not None and (entry[1] is None or entry[1] > time.monotonic()):
+                self._entries.move_to_end(key)
+                self._record_hit(tool.name, entry[3])
+                return entry[2]
+            pending = self._pending.get(key)
+            if pending is not None:
+                result = await asyncio.shield(pending)
+                self._record_hit(tool.name, 0.0)
+                return result
+
+            self.misses += 1
+            future = asyncio.get_running_loop().create_future()
+            self._pending[key] = future
+            generation = self._generations.get(server, 0)
+            start = time.perf_counter()
+            try:
+                result = await original(**arguments)
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except BaseException as e:
+                future.set_exception(e)
+                future.exception()  # 沒有其他等待者時不要留下未取得的例外警告
+                raise
+            else:
+                future.set_result(result)
+                if self._generations.get(server, 0) == generation:
+                    expires = time.monotonic() + ttl if ttl is not None else None
+                    self._store(key, (server, expires, result, time.perf_counter() - start))
+                return result
+            finally:
+                self._pending.pop(key, None)
+
+        return call
+
+    def _mutating_call(self, tool: BaseTool, servers: Tuple[str, ...]):
+        """
+        功能: 建立會寫入的工具 coroutine：執行前後都清除相關伺服器的快取（執行期間完成的讀取不會存入）。
+        參數:
+            tool     (BaseTool): 原始工具。
+            servers (Tuple[str, ...]): 要清除快取的伺服器。
+        回傳:
+            Callable: 新的 coroutine 函式。
+        """
+        original = tool.coroutine
+
+        async def call(**arguments: Any):
+            self.invalidate(servers)
+            try:
+                return await original(**arguments)
+            finally:
+                self.invalidate(servers)
+
+        return call
+
+    def _store(self, key: str, entry: Tuple[str, Optional[float], Any, float]) -> None:
+        """
+        功能: 存入一筆結果，超過上限時移除最久未使用者。
+        參數:
+            key   (str): 快取鍵。
+            entry (Tuple): (server, 到期時間, 結果, 耗時)。
+        回傳:
+            None
+        """
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _record_hit(self, tool_name: str, seconds: float) -> None:
+        """
+        功能: 記錄一次命中與省下的時間。
+        參數:
+            tool_name (str): 工具名稱。
+            seconds (float): 原本呼叫的耗時。
+        回傳:
+            None
+        """
+        self.hits += 1
+        self.saved_seconds += seconds
+        self.tool_hits[tool_name] = self.tool_hits.get(tool_name, 0) + 1
+
+    def invalidate(self, servers: Sequence[str]) -> int:
+        """
+        功能: 清除指定伺服器的所有快取結果，並遞增其寫入世代。
+        參數:
+            servers (Sequence[str]): 伺服器名稱。
+        回傳:
+            int: 清除的筆數。
+        """
+        targets = set(servers)
+        for server in targets:
+            self._generations[server] = self._generations.get(server, 0) + 1
+        keys = [key for key, entry in self._entries.items() if entry[0] in targets]
+        for key in keys:
+            del self._entries[key]
+        if keys:
+            self.invalidations += 1
+        return len(keys)
+
+    def stats(self) -> Dict:
+        """
+        功能: 回傳快取統計。
+        參數:
+            無
+        回傳:
+            Dict: 命中、未命中、命中率、清除次數、省下的秒數、目前筆數與各工具的命中次數。
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "invalidations": self.invalidations,
+            "saved_seconds": round(self.saved_seconds, 3),
+            "size": len(self._entries),
+            "tool_hits": dict(sorted(self.tool_hits.items(), key=lambda item: -item[1])),
+        }
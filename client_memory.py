@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+import os
+import re
+import sys
+import asyncio
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+from functools import lru_cache
+from typing import List, Optional, Sequence
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+# 與 RAG 伺服器的 snippet 預算共用同一份 token 估算，避免兩邊的估計值分歧
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "servers"))
+from rag_snippets import estimate_tokens  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+_THINK_RE = re.compile(r"<think>.*?</think>", re.S)
+
+# 每則訊息在 chat template 中的角色標記等額外 token（Qwen 的 <|im_start|>role\n ... <|im_end|>\n 約 4 個）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_INSTRUCTION = (
+    "你負責維護對話摘要。請將「既有摘要」與「新的對話內容」合併成一份新的摘要，"
+    "保留使用者的需求、已確認的事實與數值、檔案路徑與資料表名稱、已完成與尚未完成的步驟，省略寒暄與重複內容。"
+    "只輸出摘要本身，使用繁體中文，不超過 {max_tokens} 個 token。"
+)
+
+
+@lru_cache(maxsize=4)
+def load_tokenizer(model_path: str):
+    """
+    功能: 載入並快取 LLM 的 tokenizer（只讀本機檔案，不連網下載）；無法載入時回傳 None，改用估算。
+    參數:
+        model_path (str): LLM_MODEL_PATH。
+    回傳:
+        PreTrainedTokenizerBase 或 None。
+    """
+    if not model_path:
+        return None
+    try:
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(model_path, local_files_only=True)
+    except Exception as e:
+        logger.warning(f"Tokenizer for {model_path} unavailable ({type(e).__name__}), estimating token counts")
+        return None
+
+
+def strip_thinking(text: str) -> str:
+    """
+    功能: 移除推理模型輸出的 <think>...</think> 區塊。
+    參數:
+        text (str): 模型輸出。
+    回傳:
+        str: 去除推理內容後的文字。
+    """
+    return _THINK_RE.sub("", text).strip()
+
+
+# ---------- token 計數 ----------
+class TokenCounter:
+    def __init__(self, model_path: str, cache_size: int = 4096):
+        """
+        功能: 以 LLM 的 tokenizer 計算訊息 token 數，同一內容只編碼一次（對話中的訊息每輪都會重算）。
+        參數:
+            model_path (str): LLM_MODEL_PATH。
+            cache_size (int): 快取的訊息數上限。
+        回傳:
+            None
+        """
+        self.tokenizer = load_tokenizer(model_path)
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, int]" = OrderedDict()
+
+    def count_text(self, text: str) -> int:
+        """
+        功能: 計算文字的 token 數。
+        參數:
+            text (str): 文字。
+        回傳:
+            int: token 數。
+        """
+        key = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            return cached
+        if self.tokenizer is not None:
+            count = len(self.tokenizer.encode(text, add_special_tokens=False))
+        else:
+            count = estimate_tokens(text)
+        self._cache[key] = count
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return count
+
+    def count(self, messages: Sequence[BaseMessage]) -> int:
+        """
+        功能: 計算訊息列表的 token 數（含每則訊息的角色標記與工具呼叫參數）。
+        參數:
+            messages (Sequence[BaseMessage]): 訊息列表。
+        回傳:
+            int: token 數。
+        """
+        total = 0
+        for message in messages:
+            total += self.count_text(str(message.content)) + MESSAGE_OVERHEAD_TOKENS
+            tool_calls = getattr(message, "tool_calls", None)
+            if tool_calls:
+                total += self.count_text(json.dumps(
+                    [{"name": call["name"], "arguments": call["args"]} for call in tool_calls], ensure_ascii=False
+                ))
+        return total
+
+
+# ---------- 有預算的摘要式對話記憶 ----------
+class SummarizingMemory:
+    def __init__(
+        self,
+        prefix: Sequence[BaseMessage],
+        llm: BaseChatModel,
+        counter: TokenCounter,
+        *,
+        max_tokens: int = 4096,
+        summary_tokens: int = 512,
+    ):
+        """
+        功能: 對話記憶：固定的 system / few-shot 前綴原樣保留，最近幾輪完整保留在 max_tokens 預算內，
+              超出預算的較舊輪次在兩輪之間於背景交給 LLM 併入滾動摘要，每輪送出的 prompt 長度不再隨對話線性成長。
+              兩次摘要之間歷史只會在尾端追加，每輪的 prompt 都以上一輪的 prompt 為前綴，可重用 vLLM 的 prefix cache。
+        參數:
+            prefix (Sequence[BaseMessage]): 固定前綴（system prompt 與 few-shot 範例）。
+            llm          (BaseChatModel): 產生摘要的模型。
+            counter        (TokenCounter): token 計數器。
+            max_tokens              (int): 最近輪次（不含前綴與摘要）的 token 預算。
+            summary_tokens          (int): 摘要的 token 上限。
+        回傳:
+            None
+        """
+        self.prefix = list(prefix)
+        self.llm = llm
+        self.counter = counter
+        self.max_tokens = max_tokens
+        self.summary_tokens = summary_tokens
+        self.summary = ""
+        self.summarized_turns = 0
+        self.turns: List[List[BaseMessage]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def _turn_tokens(self, turns: Sequence[Sequence[BaseMessage]]) -> int:
+        """
+        功能: 計算輪次的 token 數。
+        參數:
+            turns (Sequence[Sequence[BaseMessage]]): 輪次列表。
+        回傳:
+            int: token 數。
+        """
+        return sum(self.counter.count(turn) for turn in turns)
+
+    def _summary_message(self) -> List[BaseMessage]:
+        """
+        功能: 將摘要包成緊接在前綴之後的 system 訊息。
+        參數:
+            無
+        回傳:
+            List[BaseMessage]: 摘要訊息，尚無摘要時為空列表。
+        """
+        if not self.summary:
+            return []
+        return [SystemMessage(content=f"先前對話的摘要：\n{self.summary}")]
+
+    async def build(self, user_input: str) -> List[BaseMessage]:
+        """
+        功能: 組出這一輪要送給 agent 的訊息：前綴 + 摘要 + 最近輪次 + 新的使用者輸入。
+              背景摘要尚未完成且最近輪次已超過預算兩倍時，先等待摘要完成。
+        參數:
+            user_input (str): 使用者輸入。
+        回傳:
+            List[BaseMessage]: 訊息列表。
+        """
+        if self._task is not None and not self._task.done() and self._turn_tokens(self.turns) > 2 * self.max_tokens:
+            await self._task
+        recent = [message for turn in self.turns for message in turn]
+        return self.prefix + self._summary_message() + recent + [HumanMessage(content=user_input)]
+
+    def save_turn(self, user_input: str, answer: str, messages: Optional[Sequence[BaseMessage]] = None) -> None:
+        """
+        功能: 記錄一輪對話；最近輪次超過預算且沒有進行中的摘要時，在背景開始摘要最舊的輪次。
+              提供 messages 時保留這一輪 agent 的完整訊息（含工具呼叫與結果），下一輪的 prompt 與這一輪最後一次請求的前綴相同。
+        參數:
+            user_input                      (str): 使用者輸入。
+            answer                          (str): 最終回答。
+            messages (Sequence[BaseMessage], 可選): 這一輪 agent 在使用者輸入之後產生的訊息（最後一則為最終回答）。
+        回傳:
+            None
+        """
+        turn: List[BaseMessage] = [HumanMessage(content=user_input)]
+        if messages:
+            # 與 Qwen3 chat template 對歷史 assistant 訊息的處理一致：只保留 </think> 之後的內容
+            for message in messages:
+                if isinstance(message, AIMessage) and isinstance(message.content, str):
+                    message = message.model_copy(update={"content": strip_thinking(message.content)})
+                turn.append(message)
+        else:
+            turn.append(AIMessage(content=strip_thinking(answer)))
+        self.turns.append(turn)
+        if self._task is not None and not self._task.done():
+            return
+        if self._turn_tokens(self.turns) <= self.max_tokens:
+            return
+
+        # 摘要到剩下約一半預算，避免每一輪都觸發一次摘要
+        folded, remaining = [], list(self.turns)
+        while len(remaining) > 1 and self._turn_tokens(remaining) > self.max_tokens // 2:
+            folded.append(remaining.pop(0))
+        if folded:
+            self._task = asyncio.create_task(self._fold(folded))
+
+    async def _fold(self, folded: List[List[BaseMessage]]) -> None:
+        """
+        功能: 將較舊的輪次與既有摘要合併成新摘要，完成後才從最近輪次移除，摘要期間的 prompt 仍是完整的。
+              摘要失敗時直接捨棄這些輪次，避免 prompt 無限制成長。
+        參數:
+            folded (List[List[BaseMessage]]): 要併入摘要的輪次（最舊者在前）。
+        回傳:
+            None
+        """
+        transcript = "\n".join(
+            f"使用者: {turn[0].content}\n助手: {turn[-1].content}" for turn in folded
+        )
+        request = [
+            SystemMessage(content=SUMMARY_INSTRUCTION.format(max_tokens=self.summary_tokens)),
+            HumanMessage(content=f"既有摘要：\n{self.summary or '（無）'}\n\n新的對話內容：\n{transcript}"),
+        ]
+        try:
+            response = await self.llm.ainvoke(request, max_tokens=self.summary_tokens * 2)
+            self.summary = strip_thinking(str(response.content))
+        except Exception as e:
+            logger.warning(f"Conversation summary failed ({e}), dropping {len(folded)} oldest turns")
+        self.turns = self.turns[len(folded):]
+        self.summarized_turns += len(folded)
+
+    def stats(self) -> dict:
+        """
+        功能: 回傳目前各部分的 token 數。
+        參數:
+            無
+        回傳:
+            dict: prefix / summary / recent 的 token 數、保留的輪次數與已摘要的輪次數。
+        """
+        return {
+            "prefix_tokens": self.counter.count(self.prefix),
+            "summary_tokens": self.counter.count(self._summary_message()),
+            "recent_tokens": self._turn_tokens(self.turns),
+            "recent_turns": len(self.turns),
+            "summarized_turns": self.summarized_turns,
+        }
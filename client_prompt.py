@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+import copy
+import hashlib
+import inspect
+import json
+from typing import Any, Dict, List, Optional, Sequence
+
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.tools import BaseTool
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+# JSON Schema 中內容是「名稱 -> schema」的欄位，其下的鍵是參數名稱而不是 schema 關鍵字
+_NAMED_SCHEMA_KEYS = ("properties", "$defs", "definitions", "patternProperties")
+
+
+def _canonical_schema(schema: Any) -> Any:
+    """
+    功能: 將 JSON Schema 正規化：所有物件的鍵依字母排序、required 排序，
+          讓同一組參數不論伺服器以何種順序產生都序列化成相同的位元組。
+    參數:
+        schema (Any): JSON Schema（或其中的一部分）。
+    回傳:
+        Any: 正規化後的副本。
+    """
+    if isinstance(schema, list):
+        return [_canonical_schema(item) for item in schema]
+    if not isinstance(schema, dict):
+        return schema
+    canonical = {}
+    for key in sorted(schema):
+        value = schema[key]
+        if key in _NAMED_SCHEMA_KEYS and isinstance(value, dict):
+            canonical[key] = {name: _canonical_schema(value[name]) for name in sorted(value)}
+        elif key == "required" and isinstance(value, list):
+            canonical[key] = sorted(value)
+        else:
+            canonical[key] = _canonical_schema(value)
+    return canonical
+
+
+def canonicalize_tools(tools: Sequence[BaseTool]) -> List[BaseTool]:
+    """
+    功能: 依名稱排序工具，並正規化描述（去除縮排與頭尾空白）與參數 schema，
+          使送給 LLM 的工具區塊與 MCP 伺服器的啟動順序、schema 鍵順序無關，每次請求都相同，
+          vLLM 的 prefix caching 才能重用這段 prompt。
+    參數:
+        tools (Sequence[BaseTool]): client.get_tools() 回傳的工具。
+    回傳:
+        List[BaseTool]: 正規化後的工具副本。
+    """
+    canonical = []
+    for tool in sorted(tools, key=lambda t: t.name):
+        update = {"description": inspect.cleandoc(tool.description or "")}
+        if isinstance(tool.args_schema, dict):
+            update["args_schema"] = _canonical_schema(copy.deepcopy(tool.args_schema))
+        canonical.append(tool.model_copy(update=update))
+    return canonical
+
+
+def prefix_fingerprint(prefix: Sequence[BaseMessage], tools: Sequence[BaseTool]) -> str:
+    """
+    功能: 計算固定前綴（工具 schema + system / few-shot 訊息）的雜湊，用來確認每次啟動與每輪請求的前綴相同。
+    參數:
+        prefix (Sequence[BaseMessage]): 固定前綴訊息。
+        tools       (Sequence[BaseTool]): 正規化後的工具。
+    回傳:
+        str: sha1 雜湊的前 12 碼。
+    """
+    payload = {
+        "tools": [convert_to_openai_tool(tool) for tool in tools],
+        "messages": [{"type": message.type, "content": message.content} for message in prefix],
+    }
+    serialized = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha1(serialized.encode("utf-8")).hexdigest()[:12]
+
+
+# ---------- prefix cache 命中統計 ----------
+class PromptCacheStats:
+    def __init__(self):
+        """
+        功能: 從 LLM 回應的 usage（prompt_tokens_details.cached_tokens）統計每次請求命中 prefix cache 的 prompt token 數。
+              vLLM 需以 --enable-prompt-tokens-details 啟動才會回報 cached_tokens，未回報時為 None。
+        參數:
+            無
+        回傳:
+            None
+        """
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.reported = 0
+
+    def record(self, messages: Sequence[BaseMessage]) -> Dict:
+        """
+        功能: 統計一輪 agent 執行中每次 LLM 請求的 prompt token 數與命中快取的 token 數，並累計到整個對話。
+        參數:
+            messages (Sequence[BaseMessage]): 這一輪 agent 新產生的訊息。
+        回傳:
+            Dict: requests 為每次請求的 prompt / cached / uncached token 數，另含這一輪的合計。
+        """
+        requests = []
+        for message in messages:
+            usage = getattr(message, "usage_metadata", None) if isinstance(message, AIMessage) else None
+            if not usage:
+                continue
+            prompt_tokens = usage.get("input_tokens", 0)
+            cached: Optional[int] = (usage.get("input_token_details") or {}).get("cache_read")
+            requests.append({
+                "prompt": prompt_tokens,
+                "cached": cached,
+                "uncached": prompt_tokens - cached if cached is not None else None,
+            })
+            self.requests += 1
+            self.prompt_tokens += prompt_tokens
+            if cached is not None:
+                self.reported += 1
+                self.cached_tokens += cached
+
+        prompt_total = sum(r["prompt"] for r in requests)
+        cached_total = sum(r["cached"] for r in requests if r["cached"] is not None)
+        return {
+            "requests": requests,
+            "prompt_tokens": prompt_total,
+            "cached_tokens": cached_total if any(r["cached"] is not None for r in requests) else None,
+        }
+
+    def stats(self) -> Dict:
+        """
+        功能: 回傳整個對話的累計統計。
+        參數:
+            無
+        回傳:
+            Dict: 請求數、prompt token 數、命中快取的 token 數與命中比例（伺服器未回報時為 None）。
+        """
+        return {
+            "requests": self.requests,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens if self.reported else None,
+            "cache_hit_ratio": round(self.cached_tokens / self.prompt_tokens, 4)
+            if self.reported and self.prompt_tokens else None,
+        }
@@ -0,0 +1,458 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+import os
+import sys
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from contextlib import AsyncExitStack
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.tools import BaseTool, StructuredTool, ToolException
+from mcp import ClientSession, StdioServerParameters
+from mcp.client.sse import sse_client
+from mcp.client.stdio import stdio_client
+from mcp.client.streamable_http import streamablehttp_client
+from mcp.types import CallToolResult, TextContent
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+
+# BaseExceptionGroup 在 Python 3.11 才成為內建類別；3.10 由 anyio 依賴的 exceptiongroup 套件提供
+if sys.version_info >= (3, 11):
+    _ExceptionGroup = BaseExceptionGroup  # noqa: F821
+else:
+    try:
+        from exceptiongroup import BaseExceptionGroup as _ExceptionGroup
+    except ImportError:
+        _ExceptionGroup = ()
+
+
+def call_result_content(result: CallToolResult) -> Tuple[Any, Optional[list]]:
+    """
+    功能: 將 MCP 工具的回傳轉成 langchain 工具的 (content, artifact)，與 langchain-mcp-adapters 的轉換相同。
+    參數:
+        result (CallToolResult): MCP 工具回傳。
+    回傳:
+        Tuple[Any, Optional[list]]: 文字內容（單一段落為字串）與非文字內容。
+    """
+    texts = [content.text for content in result.content if isinstance(content, TextContent)]
+    others = [content for content in result.content if not isinstance(content, TextContent)]
+    content: Any = texts[0] if len(texts) == 1 else (texts or "")
+    if result.isError:
+        raise ToolException(content)
+    return content, others or None
+
+
+def describe_error(error: BaseException) -> str:
+    """
+    功能: 取出例外的根本原因（anyio 的 TaskGroup 會把錯誤包成 ExceptionGroup）並格式化。
+    參數:
+        error (BaseException): 例外。
+    回傳:
+        str: "類型: 訊息"。
+    """
+    while isinstance(error, _ExceptionGroup) and error.exceptions:
+        error = error.exceptions[0]
+    return f"{type(error).__name__}: {error}"
+
+
+def missing_scripts(connection: Dict) -> List[str]:
+    """
+    功能: 找出 stdio 設定中不存在的 .py 腳本，避免為不存在的伺服器啟動子行程。
+    參數:
+        connection (Dict): 連線設定。
+    回傳:
+        List[str]: 不存在的腳本路徑。
+    """
+    if connection.get("transport", "stdio") != "stdio":
+        return []
+    cwd = connection.get("cwd") or ""
+    return [
+        arg for arg in connection.get("args", [])
+        if isinstance(arg, str) and arg.endswith(".py") and not os.path.isfile(os.path.join(cwd, arg))
+    ]
+
+
+def connection_fingerprint(connection: Dict) -> str:
+    """
+    功能: 計算伺服器設定的指紋：設定內容加上參數中伺服器腳本的大小與修改時間，腳本改動後清單會重新取得。
+    參數:
+        connection (Dict): MultiServerMCPClient 格式的連線設定。
+    回傳:
+        str: sha1 雜湊。
+    """
+    parts = [json.dumps(connection, sort_keys=True, ensure_ascii=False)]
+    cwd = connection.get("cwd") or ""
+    for arg in connection.get("args", []):
+        path = os.path.join(cwd, arg) if isinstance(arg, str) else ""
+        if path and os.path.isfile(path):
+            stat = os.stat(path)
+            parts.append(f"{arg}:{stat.st_size}:{stat.st_mtime_ns}")
+    return hashlib.sha1("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+# ---------- 單一伺服器 ----------
+class LazyServer:
+    def __init__(self, name: str, connection: Dict, spawn_timeout: float = 120.0):
+        """
+        功能: 一個按需啟動的 MCP 伺服器：第一次呼叫工具時才建立連線（stdio 則啟動子行程），閒置後可關閉，下次呼叫再啟動。
+              連線的開啟與關閉都在同一個背景 task 中進行（stdio_client 等 context 必須在同一個 task 進出）。
+        參數:
+            name            (str): 伺服器名稱。
+            connection     (Dict): 連線設定（transport 為 stdio、sse 或 streamable_http）。
+            spawn_timeout (float): 等待伺服器完成初始化的秒數上限。
+        回傳:
+            None
+        """
+        self.name = name
+        self.connection = connection
+        self.spawn_timeout = spawn_timeout
+        self.session: Optional[ClientSession] = None
+        self.last_used = 0.0
+        self.in_flight = 0
+        self.spawns = 0
+        self.calls = 0
+        self.spawn_seconds: List[float] = []
+        self._lock = asyncio.Lock()
+        self._stop: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self.session is not None
+
+    async def _open(self, stack: AsyncExitStack) -> ClientSession:
+        """
+        功能: 依 transport 建立連線並初始化 session。
+        參數:
+            stack (AsyncExitStack): 負責關閉連線的 exit stack。
+        回傳:
+            ClientSession: 已初始化的 session。
+        """
+        transport = self.connection.get("transport", "stdio")
+        if transport == "stdio":
+            params = StdioServerParameters(
+                command=self.connection["command"],
+                args=self.connection.get("args", []),
+                env=self.connection.get("env"),
+                cwd=self.connection.get("cwd"),
+            )
+            read, write = await stack.enter_async_context(stdio_client(params))
+        elif transport == "sse":
+            read, write = await stack.enter_async_context(
+                sse_client(self.connection["url"], self.connection.get("headers"))
+            )
+        elif transport == "streamable_http":
+            read, write, _ = await stack.enter_async_context(
+                streamablehttp_client(self.connection["url"], self.connection.get("headers"))
+            )
+        else:
+            raise ValueError(f"Unsupported transport for {self.name}: {transport}")
+        session = await stack.enter_async_context(ClientSession(read, write))
+        await session.initialize()
+        return session
+
+    async def _run(self, ready: asyncio.Future) -> None:
+        """
+        功能: 背景 task：開啟連線、通知已就緒，等待停止訊號後在同一個 task 內關閉連線。
+        參數:
+            ready (asyncio.Future): 連線就緒（或失敗）時設定結果。
+        回傳:
+            None
+        """
+        try:
+            async with AsyncExitStack() as stack:
+                session = await self._open(stack)
+                ready.set_result(session)
+                await self._stop.wait()
+        except Exception as e:
+            if not ready.done():
+                ready.set_exception(e)
+            else:
+                logger.warning(f"MCP server {self.name} exited: {describe_error(e)}")
+        finally:
+            self.session = None
+
+    async def ensure(self) -> ClientSession:
+        """
+        功能: 取得 session，尚未啟動時啟動伺服器並記錄啟動耗時。
+        參數:
+            無
+        回傳:
+            ClientSession: 已初始化的 session。
+        """
+        if self.session is not None:
+            return self.session
+        async with self._lock:
+            if self.session is not None:
+                return self.session
+            start = time.perf_counter()
+            self._stop = asyncio.Event()
+            ready = asyncio.get_running_loop().create_future()
+            self._task = asyncio.create_task(self._run(ready), name=f"mcp-{self.name}")
+            try:
+                self.session = await asyncio.wait_for(ready, self.spawn_timeout)
+            except BaseException:
+                self._task.cancel()
+                self._task = None
+                raise
+            seconds = time.perf_counter() - start
+            self.spawns += 1
+            self.spawn_seconds.append(seconds)
+            self.last_used = time.monotonic()
+            logger.info(f"Started MCP server {self.name} in {seconds:.2f}s")
+            return self.session
+
+    async def list_tools(self) -> List[Dict]:
+        """
+        功能: 向伺服器列出工具並轉成可寫入清單的字典。
+        參數:
+            無
+        回傳:
+            List[Dict]: 每個工具的 name / description / inputSchema。
+        """
+        session = await self.ensure()
+        result = await session.list_tools()
+        return [
+            {"name": tool.name, "description": tool.description or "", "inputSchema": tool.inputSchema}
+            for tool in result.tools
+        ]
+
+    async def call_tool(self, tool_name: str, arguments: Dict) -> Tuple[Any, Optional[list]]:
+        """
+        功能: 呼叫工具（必要時先啟動伺服器）。
+        參數:
+            tool_name  (str): 工具名稱。
+            arguments (Dict): 工具參數。
+        回傳:
+            Tuple[Any, Optional[list]]: 工具的 (content, artifact)。
+        """
+        session = await self.ensure()
+        self.in_flight += 1
+        self.calls += 1
+        try:
+            result = await session.call_tool(tool_name, arguments)
+        finally:
+            self.in_flight -= 1
+            self.last_used = time.monotonic()
+        return call_result_content(result)
+
+    async def shutdown(self) -> None:
+        """
+        功能: 關閉伺服器連線（stdio 會結束子行程）。
+        參數:
+            無
+        回傳:
+            None
+        """
+        async with self._lock:
+            if self._task is None:
+                return
+            self._stop.set()
+            try:
+                await self._task
+            finally:
+                self._task = None
+                self.session = None
+
+    def stats(self) -> Dict:
+        """
+        功能: 回傳這個伺服器的啟動與呼叫統計。
+        參數:
+            無
+        回傳:
+            Dict: 是否執行中、啟動次數、最近與平均啟動秒數、呼叫次數。
+        """
+        return {
+            "running": self.running,
+            "spawns": self.spawns,
+            "last_spawn_seconds": round(self.spawn_seconds[-1], 3) if self.spawn_seconds else None,
+            "avg_spawn_seconds": round(sum(self.spawn_seconds) / len(self.spawn_seconds), 3) if self.spawn_seconds else None,
+            "calls": self.calls,
+        }
+
+
+# ---------- 伺服器集合 ----------
+class LazyServerPool:
+    def __init__(
+        self,
+        connections: Dict[str, Dict],
+        manifest_path: str,
+        idle_timeout: float = 600.0,
+        spawn_timeout: float = 120.0,
+    ):
+        """
+        功能: 取代一次啟動所有伺服器的 MultiServerMCPClient：工具 schema 從快取的清單提供，
+              伺服器在其工具第一次被呼叫時才啟動，閒置超過 idle_timeout 秒後關閉。
+              清單中沒有或設定（含伺服器腳本）已改變的伺服器，會在載入工具時啟動一次以更新清單。
+        參數:
+            connections (Dict[str, Dict]): 伺服器名稱 -> 連線設定（與 MultiServerMCPClient 相同格式）。
+            manifest_path          (str): 工具清單的快取檔路徑。
+            idle_timeout         (float): 閒置關閉的秒數，0 表示不關閉。
+            spawn_timeout        (float): 等待單一伺服器完成初始化的秒數上限。
+        回傳:
+            None
+        """
+        self.servers = {
+            name: LazyServer(name, connection, spawn_timeout) for name, connection in connections.items()
+        }
+        self.manifest_path = manifest_path
+        self.idle_timeout = idle_timeout
+        self.manifest_hits = 0
+        self.manifest_misses = 0
+        self.failed: Dict[str, str] = {}
+        self._reaper: Optional[asyncio.Task] = None
+
+    async def __aenter__(self) -> "LazyServerPool":
+        if self.idle_timeout > 0:
+            self._reaper = asyncio.create_task(self._reap(), name="mcp-idle-reaper")
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.aclose()
+
+    def _load_manifest(self) -> Dict:
+        """
+        功能: 讀取工具清單快取，不存在或格式不符時回傳空清單。
+        參數:
+            無
+        回傳:
+            Dict: 伺服器名稱 -> {"fingerprint", "tools"}。
+        """
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return manifest.get("servers", {}) if manifest.get("version") == MANIFEST_VERSION else {}
+
+    def _save_manifest(self, servers: Dict) -> None:
+        """
+        功能: 寫入工具清單快取（先寫暫存檔再取代，避免中斷時留下不完整的檔案）。
+        參數:
+            servers (Dict): 伺服器名稱 -> {"fingerprint", "tools"}。
+        回傳:
+            None
+        """
+        directory = os.path.dirname(self.manifest_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "servers": servers}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _make_tool(self, server: LazyServer, spec: Dict) -> BaseTool:
+        """
+        功能: 以清單中的 schema 建立 langchain 工具，呼叫時才經由 server 啟動伺服器並轉送。
+        參數:
+            server (LazyServer): 工具所屬的伺服器。
+            spec         (Dict): 工具的 name / description / inputSchema。
+        回傳:
+            BaseTool: langchain 工具（metadata 記錄所屬伺服器）。
+        """
+        tool_name = spec["name"]
+
+        async def call_tool(**arguments: Any) -> Tuple[Any, Optional[list]]:
+            return await server.call_tool(tool_name, arguments)
+
+        return StructuredTool(
+            name=tool_name,
+            description=spec["description"],
+            args_schema=spec["inputSchema"],
+            coroutine=call_tool,
+            response_format="content_and_artifact",
+            metadata={"mcp_server": server.name},
+        )
+
+    async def get_tools(self) -> List[BaseTool]:
+        """
+        功能: 取得所有伺服器的工具；清單中有效的伺服器不啟動，其餘啟動一次取得工具並更新清單。
+              無法啟動的伺服器（例如腳本不存在）記錄警告後略過，不影響其他伺服器。
+        參數:
+            無
+        回傳:
+            List[BaseTool]: 工具列表。
+        """
+        cached = self._load_manifest()
+        manifest, tools, changed = {}, [], False
+        for name, server in self.servers.items():
+            missing = missing_scripts(server.connection)
+            if missing:
+                logger.warning(f"Skipping MCP server {name}: script not found: {', '.join(missing)}")
+                self.failed[name] = f"script not found: {', '.join(missing)}"
+                continue
+            fingerprint = connection_fingerprint(server.connection)
+            entry = cached.get(name)
+            if entry and entry.get("fingerprint") == fingerprint:
+                self.manifest_hits += 1
+            else:
+                self.manifest_misses += 1
+                try:
+                    entry = {"fingerprint": fingerprint, "tools": await server.list_tools()}
+                except Exception as e:
+                    logger.warning(f"Skipping MCP server {name}: {describe_error(e)}")
+                    self.failed[name] = describe_error(e)
+                    continue
+                changed = True
+            manifest[name] = entry
+            tools.extend(self._make_tool(server, spec) for spec in entry["tools"])
+        if changed or set(manifest) != set(cached):
+            self._save_manifest(manifest)
+        return tools
+
+    async def _reap(self) -> None:
+        """
+        功能: 定期關閉閒置超過 idle_timeout 秒且沒有進行中呼叫的伺服器。
+        參數:
+            無
+        回傳:
+            None
+        """
+        interval = max(1.0, min(self.idle_timeout / 4, 30.0))
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            for server in self.servers.values():
+                if server.running and server.in_flight == 0 and now - server.last_used > self.idle_timeout:
+                    logger.info(f"Stopping idle MCP server {server.name}")
+                    try:
+                        await server.shutdown()
+                    except Exception as e:
+                        logger.warning(f"Failed to stop MCP server {server.name}: {e}")
+
+    async def aclose(self) -> None:
+        """
+        功能: 停止閒置檢查並關閉所有執行中的伺服器。
+        參數:
+            無
+        回傳:
+            None
+        """
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        for server in self.servers.values():
+            try:
+                await server.shutdown()
+            except Exception as e:
+                logger.warning(f"Failed to stop MCP server {server.name}: {e}")
+
+    def stats(self) -> Dict:
+        """
+        功能: 回傳各伺服器的啟動延遲與呼叫統計，以及清單快取的命中情況。
+        參數:
+            無
+        回傳:
+            Dict: 統計結果。
+        """
+        return {
+            "manifest_hits": self.manifest_hits,
+            "manifest_misses": self.manifest_misses,
+            "failed": self.failed,
+            "servers": {name: server.stats() for name, server in self.servers.items()},
+        }
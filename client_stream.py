@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+import sys
+import json
+import time
+from typing import Any, Dict, Optional, Sequence
+
+from langchain_core.messages import AIMessage, BaseMessage
+
+# 工具參數與結果在終端機上顯示的字元上限
+PREVIEW_CHARS = 120
+
+
+def preview(value: Any, limit: int = PREVIEW_CHARS) -> str:
+    """
+    功能: 將工具參數或結果轉成單行、截斷過的預覽文字。
+    參數:
+        value (Any): 參數或結果。
+        limit (int): 字元上限。
+    回傳:
+        str: 預覽文字。
+    """
+    if hasattr(value, "content"):
+        value = value.content
+    text = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False, default=str)
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit] + "…"
+
+
+def turn_timings(result: Dict) -> Dict:
+    """
+    功能: 整理一輪的計時摘要。
+    參數:
+        result (Dict): stream_turn 的回傳值。
+    回傳:
+        Dict: 總秒數、第一個 token 的秒數、每次 LLM 請求的 ttft / 秒數，以及 LLM 與工具各自的總耗時（並行的工具呼叫耗時相加）。
+    """
+    def rounded(value: Optional[float]) -> Optional[float]:
+        return round(value, 3) if value is not None else None
+
+    return {
+        "total_s": rounded(result["total_seconds"]),
+        "ttft_s": rounded(result["ttft_seconds"]),
+        "llm_calls": [{"ttft_s": rounded(call["ttft"]), "s": rounded(call["seconds"])} for call in result["llm_calls"]],
+        "llm_s": rounded(sum(call["seconds"] for call in result["llm_calls"])),
+        "tool_s": rounded(sum(call["seconds"] for call in result["tool_calls"])),
+    }
+
+
+async def stream_turn(agent, messages: Sequence[BaseMessage], out=sys.stdout) -> Dict:
+    """
+    功能: 以 astream_events 執行一輪 agent：模型輸出的 token 邊解碼邊印出，工具呼叫在開始與結束時顯示並計時，
+          另外量測第一個 token 的時間（TTFT）與整輪時間。
+    參數:
+        agent: create_react_agent 建立的 agent。
+        messages (Sequence[BaseMessage]): 這一輪的輸入訊息。
+        out: 輸出串流，預設 stdout。
+    回傳:
+        Dict: messages（agent 最終狀態的全部訊息）、final_answer、total_seconds、ttft_seconds（這一輪送出到第一個 token）、
+              llm_calls（每次 LLM 請求的 ttft / seconds）、tool_calls（每次工具呼叫的 name / seconds / error）。
+    """
+    result = {
+        "messages": [],
+        "final_answer": "無法獲得答案",
+        "total_seconds": 0.0,
+        "ttft_seconds": None,
+        "llm_calls": [],
+        "tool_calls": [],
+    }
+    start = time.perf_counter()
+    llm_started: Dict[str, Dict] = {}
+    tool_started: Dict[str, float] = {}
+    at_line_start = True
+
+    def write(text: str) -> None:
+        nonlocal at_line_start
+        out.write(text)
+        out.flush()
+        at_line_start = text.endswith("\n")
+
+    async for event in agent.astream_events({"messages": list(messages)}, version="v2"):
+        kind, run_id, now = event["event"], event["run_id"], time.perf_counter()
+
+        if kind == "on_chat_model_start":
+            llm_started[run_id] = {"start": now, "ttft": None}
+        elif kind == "on_chat_model_stream":
+            chunk = event["data"]["chunk"]
+            call = llm_started.get(run_id)
+            if call is not None and call["ttft"] is None and (chunk.content or chunk.tool_call_chunks):
+                call["ttft"] = now - call["start"]
+                if result["ttft_seconds"] is None:
+                    result["ttft_seconds"] = now - start
+            if isinstance(chunk.content, str) and chunk.content:
+                write(chunk.content)
+        elif kind == "on_chat_model_end":
+            call = llm_started.pop(run_id, None)
+            if call is not None:
+                result["llm_calls"].append({"ttft": call["ttft"], "seconds": now - call["start"]})
+        elif kind == "on_tool_start":
+            tool_started[run_id] = now
+            if not at_line_start:
+                write("\n")
+            write(f"  → {event['name']}({preview(event['data'].get('input', {}))})\n")
+        elif kind in ("on_tool_end", "on_tool_error"):
+            seconds = now - tool_started.pop(run_id, now)
+            failed = kind == "on_tool_error"
+            result["tool_calls"].append({"name": event["name"], "seconds": seconds, "error": failed})
+            outcome = preview(event["data"].get("error" if failed else "output", ""))
+            write(f"  ← {event['name']} {seconds:.2f}s{' 失敗' if failed else ''}: {outcome}\n")
+        elif kind == "on_chain_end" and not event.get("parent_ids"):
+            # 最外層的 graph 結束時帶出最終狀態
+            output = event["data"].get("output")
+            if isinstance(output, dict):
+                result["messages"] = list(output.get("messages", []))
+
+    if not at_line_start:
+        write("\n")
+    result["total_seconds"] = time.perf_counter() - start
+    for message in reversed(result["messages"]):
+        if isinstance(message, AIMessage):
+            result["final_answer"] = message.content
+            break
+    return result
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+import re
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.tools import BaseTool
+
+# 多步驟的需求依標點與連接詞切段，每段各自比對工具，避免長句的向量被單一主題主導
+_SEGMENT_RE = re.compile("[\u3002\uff0c\uff1b\uff01\uff1f\n,;!?]|\u7136\u5f8c|\u63a5\u8457|\u6700\u5f8c|\u4e26\u4e14")  # 。，；！？ 然後 接著 最後 並且
+_MIN_SEGMENT_CHARS = 4
+
+
+def load_router_embeddings(model_path: str, device: str = "cpu") -> Embeddings:
+    """
+    功能: 載入工具路由用的本機 embedding 模型（與 RAG 伺服器相同的 HuggingFace 模型，向量正規化）。
+    參數:
+        model_path (str): Embedding 模型路徑。
+        device     (str): 運算裝置，預設 CPU，避免與 vLLM 搶 GPU 記憶體。
+    回傳:
+        Embeddings: 已載入的模型。
+    """
+    from langchain_huggingface import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(
+        model_name=model_path,
+        model_kwargs={"device": device},
+        encode_kwargs={"normalize_embeddings": True},
+    )
+
+
+def tool_document(tool: BaseTool) -> str:
+    """
+    功能: 組出工具的索引文字：名稱（底線換成空白）加上描述的第一段。
+    參數:
+        tool (BaseTool): 工具。
+    回傳:
+        str: 索引文字。
+    """
+    description = (tool.description or "").strip().split("\n\n")[0]
+    return f"{tool.name.replace('_', ' ')}: {' '.join(description.split())}"
+
+
+def split_segments(query: str) -> List[str]:
+    """
+    功能: 將使用者輸入依標點與連接詞切成子句，太短的子句捨棄。
+    參數:
+        query (str): 使用者輸入。
+    回傳:
+        List[str]: 子句列表（只有一段時為空列表）。
+    """
+    segments = [segment.strip() for segment in _SEGMENT_RE.split(query)]
+    segments = [segment for segment in segments if len(segment) >= _MIN_SEGMENT_CHARS]
+    return segments if len(segments) > 1 else []
+
+
+def called_tools(messages: Iterable[BaseMessage]) -> List[str]:
+    """
+    功能: 取出訊息中 agent 呼叫過的工具名稱。
+    參數:
+        messages (Iterable[BaseMessage]): 訊息列表。
+    回傳:
+        List[str]: 工具名稱（保留順序、不重複）。
+    """
+    names: Dict[str, None] = {}
+    for message in messages:
+        if isinstance(message, AIMessage):
+            for call in message.tool_calls:
+                names[call["name"]] = None
+    return list(names)
+
+
+# ---------- 工具路由 ----------
+class ToolRouter:
+    def __init__(
+        self,
+        tools: Sequence[BaseTool],
+        embeddings: Embeddings,
+        *,
+        top_n: int = 8,
+        always_on: Sequence[str] = (),
+        grow_only: bool = False,
+    ):
+        """
+        功能: 以本機 embedding 模型為工具名稱與描述建立索引，每輪只挑出與使用者輸入最相關的 top_n 個工具，
+              加上固定啟用的工具與上一輪用過的工具，縮小每次請求送給 LLM 的工具 schema。
+              工具區塊位於 prompt 開頭，組合改變時 vLLM 的 prefix cache 只能重用到工具區塊之前；
+              grow_only 時綁定的工具只增不減（本次對話選過的工具都保留），組合只在加入新工具的那一輪改變。
+        參數:
+            tools      (Sequence[BaseTool]): 全部工具。
+            embeddings         (Embeddings): Embedding 模型。
+            top_n                     (int): 依相似度挑選的工具數。
+            always_on       (Sequence[str]): 每輪都啟用的工具名稱。
+            grow_only                (bool): 是否保留先前各輪選過的工具。
+        回傳:
+            None
+        """
+        self.tools = list(tools)
+        self.embeddings = embeddings
+        self.top_n = top_n
+        self.always_on = [name for name in always_on if any(tool.name == name for tool in self.tools)]
+        self.grow_only = grow_only
+        self.changes = 0
+        self._bound: set = set()
+        self.selections = 0
+        self.selected_total = 0
+        self.seconds = 0.0
+
+        start = time.perf_counter()
+        self._matrix = self._normalize(embeddings.embed_documents([tool_document(tool) for tool in self.tools]))
+        self.index_seconds = time.perf_counter() - start
+
+    @staticmethod
+    def _normalize(vectors: Sequence[Sequence[float]]) -> np.ndarray:
+        """
+        功能: 將向量轉為 float32 矩陣並逐列正規化，內積即為餘弦相似度。
+        參數:
+            vectors (Sequence[Sequence[float]]): 向量。
+        回傳:
+            np.ndarray: 正規化後的矩陣。
+        """
+        matrix = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms == 0, 1.0, norms)
+
+    def scores(self, query: str) -> np.ndarray:
+        """
+        功能: 計算每個工具與使用者輸入的相關分數：整句與各子句相似度的最大值。
+        參數:
+            query (str): 使用者輸入。
+        回傳:
+            np.ndarray: 每個工具的分數。
+        """
+        pieces = [query] + split_segments(query)
+        vectors = self._normalize([self.embeddings.embed_query(piece) for piece in pieces])
+        return (vectors @ self._matrix.T).max(axis=0)
+
+    def select(self, query: str, recent: Sequence[str] = ()) -> List[BaseTool]:
+        """
+        功能: 挑出這一輪要綁定給 agent 的工具。
+        參數:
+            query           (str): 使用者輸入。
+            recent (Sequence[str]): 上一輪呼叫過的工具名稱（延續同一件工作的追問常需要相同工具）。
+        回傳:
+            List[BaseTool]: 選出的工具，維持原本的（已排序）順序。
+        """
+        start = time.perf_counter()
+        scores = self.scores(query)
+        chosen = set(self.always_on) | set(recent)
+        for index in np.argsort(-scores, kind="stable")[:self.top_n]:
+            chosen.add(self.tools[index].name)
+        if self.grow_only:
+            chosen |= self._bound
+        if chosen != self._bound:
+            self.changes += 1
+            self._bound = chosen
+        selected = [tool for tool in self.tools if tool.name in chosen]
+
+        self.seconds += time.perf_counter() - start
+        self.selections += 1
+        self.selected_total += len(selected)
+        return selected
+
+    def reset(self) -> None:
+        """
+        功能: 開始新的對話：清除目前綁定的工具組合。
+        參數:
+            無
+        回傳:
+            None
+        """
+        self._bound = set()
+
+    def stats(self) -> Dict:
+        """
+        功能: 回傳路由統計。
+        參數:
+            無
+        回傳:
+            Dict: 工具總數、平均選出的工具數、工具組合改變的次數（每次都會使 prefix cache 失效）、平均路由耗時與建立索引的耗時。
+        """
+        return {
+            "tools": len(self.tools),
+            "selections": self.selections,
+            "changes": self.changes,
+            "avg_selected": round(self.selected_total / self.selections, 2) if self.selections else None,
+            "avg_route_ms": round(self.seconds / self.selections * 1000, 3) if self.selections else None,
+            "index_seconds": round(self.index_seconds, 3),
+        }
+
+
+# ---------- 依工具組合快取 agent ----------
+class AgentCache:
+    def __init__(self, factory: Callable[[List[BaseTool]], object], max_size: int = 16):
+        """
+        功能: 依選出的工具組合快取已編譯的 agent，相同組合不重新建立圖。
+        參數:
+            factory (Callable): 以工具列表建立 agent 的函式，例如 lambda tools: create_react_agent(model, tools)。
+            max_size     (int): 快取的組合數上限。
+        回傳:
+            None
+        """
+        self.factory = factory
+        self.max_size = max_size
+        self._agents: "OrderedDict[tuple, object]" = OrderedDict()
+
+    def get(self, tools: List[BaseTool]):
+        """
+        功能: 取得綁定這組工具的 agent。
+        參數:
+            tools (List[BaseTool]): 工具列表。
+        回傳:
+            已編譯的 agent。
+        """
+        key = tuple(tool.name for tool in tools)
+        agent: Optional[object] = self._agents.get(key)
+        if agent is None:
+            agent = self.factory(tools)
+            self._agents[key] = agent
+            while len(self._agents) > self.max_size:
+                self._agents.popitem(last=False)
+        else:
+            self._agents.move_to_end(key)
+        return agent
@@ -0,0 +1,192 @@
+import asyncio
+import argparse
+import functools
+import importlib
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+
+import uvicorn
+from dotenv import load_dotenv
+from mcp.server.fastmcp import FastMCP
+from mcp.server.transport_security import TransportSecuritySettings
+from starlette.applications import Starlette
+from starlette.routing import Mount
+
+# 設定日誌（在匯入各伺服器模組之前設定，各模組自己的 basicConfig 不會再生效）
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(name)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+MCP_HOST_WORKERS = int(os.getenv("MCP_HOST_WORKERS", "8"))  # 所有伺服器共用的執行緒池大小
+MCP_HOST_SERVERS = os.getenv("MCP_HOST_SERVERS", "math,database,filesystem,markitdown,parentrag")
+# DNS rebinding 防護：除了本機位址外，額外允許的 Host 標頭（例如 "10.0.0.5:3000,mcp.lan:*"）與 Origin 標頭；
+# 綁定到非本機位址時需列出用戶端連線所用的位址，否則遠端請求會被拒絕
+MCP_HOST_ALLOWED_HOSTS = os.getenv("MCP_HOST_ALLOWED_HOSTS", "")
+MCP_HOST_ALLOWED_ORIGINS = os.getenv("MCP_HOST_ALLOWED_ORIGINS", "")
+
+# 掛載名稱（與 client.py 的 MCP_SERVERS 相同）-> 伺服器模組
+SERVER_MODULES = {
+    "math": "math_server",
+    "database": "db_server",
+    "filesystem": "filesystem_server",
+    "markitdown": "markitdown_server",
+    "parentrag": "parent_rag_server",
+}
+
+LOOPBACK_HOSTS = ("127.0.0.1", "localhost", "::1")
+LOOPBACK_HOST_HEADERS = ["127.0.0.1:*", "localhost:*", "[::1]:*"]
+LOOPBACK_ORIGINS = ["http://127.0.0.1:*", "http://localhost:*", "http://[::1]:*"]
+
+
+def split_list(value: str) -> List[str]:
+    """
+    功能: 將逗號分隔的設定值拆成列表。
+    參數:
+        value (str): 設定值。
+    回傳:
+        List[str]: 去除空白後的非空項目。
+    """
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def transport_security(host: str, allowed_hosts: List[str], allowed_origins: List[str]) -> TransportSecuritySettings:
+    """
+    功能: 建立開啟 DNS rebinding 防護的設定：一律允許本機位址，另加上部署者明確列出的 Host 與 Origin。
+          主機沒有驗證機制且掛載了檔案系統與資料庫工具，因此不提供關閉防護的選項。
+    參數:
+        host                  (str): 綁定的位址。
+        allowed_hosts   (List[str]): 額外允許的 Host 標頭（可用 "位址:*" 允許任意埠）。
+        allowed_origins (List[str]): 額外允許的 Origin 標頭。
+    回傳:
+        TransportSecuritySettings: 傳輸安全設定。
+    """
+    if host not in LOOPBACK_HOSTS and not allowed_hosts:
+        logger.warning(
+            f"Binding to {host} without MCP_HOST_ALLOWED_HOSTS: requests whose Host header is not a loopback "
+            f"address will be rejected; list the addresses clients connect to, e.g. MCP_HOST_ALLOWED_HOSTS=\"{host}:*\""
+        )
+    return TransportSecuritySettings(
+        enable_dns_rebinding_protection=True,
+        allowed_hosts=LOOPBACK_HOST_HEADERS + allowed_hosts,
+        allowed_origins=LOOPBACK_ORIGINS + allowed_origins,
+    )
+
+
+def load_servers(names: List[str]) -> Dict[str, Tuple[object, FastMCP]]:
+    """
+    功能: 匯入要掛載的伺服器模組並取出其 FastMCP 實例；缺少依賴的伺服器記錄警告後略過。
+    參數:
+        names (List[str]): 掛載名稱。
+    回傳:
+        Dict[str, Tuple[object, FastMCP]]: 掛載名稱 -> (模組, FastMCP 實例)。
+    """
+    servers = {}
+    for name in names:
+        if name not in SERVER_MODULES:
+            logger.warning(f"Unknown server {name}, expected one of {', '.join(SERVER_MODULES)}")
+            continue
+        try:
+            module = importlib.import_module(SERVER_MODULES[name])
+        except Exception as e:
+            logger.warning(f"Skipping server {name}: {type(e).__name__}: {e}")
+            continue
+        servers[name] = (module, module.mcp)
+    return servers
+
+
+def offload_sync_tools(server: FastMCP, executor: ThreadPoolExecutor) -> int:
+    """
+    功能: 將同步工具改為在共用執行緒池執行。FastMCP 直接在事件迴圈上呼叫同步工具，
+          單一行程掛載多個伺服器時，一個慢的 SQLite 查詢或檔案操作會卡住所有伺服器的請求。
+    參數:
+        server          (FastMCP): 伺服器。
+        executor (ThreadPoolExecutor): 共用執行緒池。
+    回傳:
+        int: 改為在執行緒池執行的工具數。
+    """
+    count = 0
+    for tool in server._tool_manager.list_tools():
+        if tool.is_async:
+            continue
+        fn = tool.fn
+
+        async def run_in_pool(*, _fn=fn, **arguments):
+            return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(_fn, **arguments))
+
+        tool.fn = run_in_pool
+        tool.is_async = True
+        count += 1
+    return count
+
+
+def create_host_app(servers: Dict[str, Tuple[object, FastMCP]], executor: ThreadPoolExecutor, *,
+                    host: str, allowed_hosts: Optional[List[str]] = None, allowed_origins: Optional[List[str]] = None,
+                    debug: bool = False) -> Starlette:
+    """
+    功能: 建立單一 Starlette 應用，將各伺服器的 streamable HTTP 端點掛在 /<名稱>/mcp，
+          並在 lifespan 中啟動所有伺服器的 session manager、設定共用執行緒池與暖機 RAG 引擎。
+    參數:
+        servers (Dict[str, Tuple[object, FastMCP]]): load_servers 的結果。
+        executor            (ThreadPoolExecutor): 共用執行緒池。
+        host                               (str): 綁定的位址。
+        allowed_hosts              (List[str], optional): 本機位址以外允許的 Host 標頭。
+        allowed_origins            (List[str], optional): 本機位址以外允許的 Origin 標頭。
+        debug                             (bool): Starlette debug 模式。
+    回傳:
+        Starlette: ASGI 應用。
+    """
+    routes = []
+    security = transport_security(host, list(allowed_hosts or []), list(allowed_origins or []))
+    for name, (_, server) in servers.items():
+        # 各伺服器共用同一份 DNS rebinding 防護設定（FastMCP 只在以本機位址建立時才預設開啟）
+        server.settings.transport_security = security
+        offloaded = offload_sync_tools(server, executor)
+        routes.append(Mount(f"/{name}", app=server.streamable_http_app()))
+        logger.info(f"Mounted {name} at /{name}/mcp ({offloaded} sync tools on the shared pool)")
+
+    @asynccontextmanager
+    async def lifespan(app: Starlette):
+        # 共用池只執行工具本身；asyncio.to_thread 等其他背景等待仍使用事件迴圈的預設執行緒池，不會佔用工具與查詢的執行緒
+        async with AsyncExitStack() as stack:
+            for _, server in servers.values():
+                await stack.enter_async_context(server.session_manager.run())
+            if "parentrag" in servers:
+                # 所有用戶端共用同一個 RAG 引擎與 embedding 模型，啟動時即在背景載入
+                module = servers["parentrag"][0]
+                module.Lanes.share_query(executor)
+                module.ParentRAG.start()
+            yield
+        executor.shutdown(wait=False)
+
+    return Starlette(debug=debug, routes=routes, lifespan=lifespan)
+
+
+# Main entry point
+def main():
+    parser = argparse.ArgumentParser(description="Host several MCP servers in one process over streamable HTTP")
+    parser.add_argument("--host", default="127.0.0.1", help="Host to bind to (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=3000, help="Port to listen on (default: 3000)")
+    parser.add_argument("--servers", default=MCP_HOST_SERVERS, help="Comma-separated servers to mount")
+    parser.add_argument("--allowed-hosts", default=MCP_HOST_ALLOWED_HOSTS,
+                        help="Comma-separated Host headers to accept besides loopback (e.g. 10.0.0.5:*)")
+    parser.add_argument("--allowed-origins", default=MCP_HOST_ALLOWED_ORIGINS,
+                        help="Comma-separated Origin headers to accept besides loopback")
+    args = parser.parse_args()
+
+    servers = load_servers(split_list(args.servers))
+    executor = ThreadPoolExecutor(max_workers=MCP_HOST_WORKERS, thread_name_prefix="mcp-host")
+    app = create_host_app(
+        servers, executor, host=args.host,
+        allowed_hosts=split_list(args.allowed_hosts), allowed_origins=split_list(args.allowed_origins),
+    )
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,307 +1,2017 @@
-# -*- coding: utf-8 -*-
-from __future__ import annotations
-import os
-import pickle
-from typing import List, Dict
-import logging
-
-# 設定日誌
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s"
-)
-logger = logging.getLogger(__name__)
-
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_milvus import Milvus
-from langchain.retrievers import ParentDocumentRetriever
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_core.documents import Document
-from langchain.storage._lc_store import create_kv_docstore
-from langchain.storage import InMemoryStore
-from dotenv import load_dotenv
-import os
-
-load_dotenv()
-EMBEDDING_MODEL_PATH = os.getenv("EMBEDDING_MODEL_PATH", "")
-DB_DIR = os.getenv("DB_DIR", "")
-COLLECTION_NAME = os.getenv("COLLECTION_NAME", "")
-CHILD_CHUNK_SIZE = os.getenv("CHILD_CHUNK_SIZE", "")
-CHILD_CHUNK_OVERLAP = os.getenv("CHILD_CHUNK_OVERLAP", "")
-TOP_K = os.getenv("TOP_K", "")
-DEVICE = os.getenv("DEVICE", "")
-DOCUMENT_PATH = os.getenv("MARKITDOWN_OUTPUT_PATH", "")
-
-# ---------- 自訂持久化的 InMemoryStore ----------
-class PersistentInMemoryStore(InMemoryStore):
-    def __init__(self, file_path: str):
-        """
-        功能: 初始化可持久化的 InMemoryStore。
-        參數:
-            file_path (str): 用於序列化與反序列化的檔案路徑。
-        回傳:
-            None
-        """
-        self.file_path = file_path
-        self.store = self._load()
-
-    def _load(self):
-        """
-        功能: 從檔案載入先前儲存的 store。
-        參數:
-            無
-        回傳:
-            dict: 載入的鍵值對儲存結構；若檔案不存在則回傳空 dict。
-        """
-        if os.path.exists(self.file_path):
-            with open(self.file_path, "rb") as f:
-                return pickle.load(f)
-        return {}
-
-    def _save(self):
-        """
-        功能: 將目前的 store 序列化後寫入檔案。
-        參數:
-            無
-        回傳:
-            None
-        """
-        with open(self.file_path, "wb") as f:
-            pickle.dump(self.store, f)
-
-    def mset(self, key_value_pairs):
-        """
-        功能: 批次寫入多組鍵值並立即持久化。
-        參數:
-            key_value_pairs (Iterable): 要寫入的鍵值對清單。
-        回傳:
-            None
-        """
-        super().mset(key_value_pairs)
-        self._save()
-
-    def mdelete(self, keys):
-        """
-        功能: 批次刪除多個鍵並立即持久化。
-        參數:
-            keys (Iterable): 要刪除的鍵列表。
-        回傳:
-            None
-        """
-        super().mdelete(keys)
-        self._save()
-
-# ---------- ParentRAGEngine ----------
-class ParentRAGEngine:
-    def __init__(
-        self,
-        *,
-        embedding_model_path: str = EMBEDDING_MODEL_PATH,
-        database_dir: str = DB_DIR,
-        collection_name: str = COLLECTION_NAME,
-        child_chunk_size: int = int(CHILD_CHUNK_SIZE),
-        child_chunk_overlap: int = int(CHILD_CHUNK_OVERLAP),
-        top_k: int = int(TOP_K),
-        device: str = DEVICE,
-    ):
-        """
-        功能: 建立 Parent RAG 引擎，初始化 embedding、向量資料庫、分割器與檢索器。
-        參數:
-            embedding_model_path (str): Embedding 模型路徑或名稱。
-            database_dir       (str): 向量資料庫目錄。
-            collection_name    (str): 資料集合名稱。
-            child_chunk_size   (int): 子 chunk 大小。
-            child_chunk_overlap(int): 子 chunk 重疊大小。
-            top_k              (int): 檢索時的 top-K 數量。
-            device             (str): 運算裝置（如 'cpu' 或 'cuda'）。
-        回傳:
-            None
-        """
-        self.top_k = top_k
-        self._init_embeddings(embedding_model_path, device)
-        self._init_vector_store(database_dir, collection_name)
-        self._init_child_splitter(size=child_chunk_size, overlap=child_chunk_overlap)
-        self._init_retriever()
-
-    # ---------- private ----------
-    def _init_embeddings(self, model_path: str, device: str):
-        """
-        功能: 初始化 HuggingFace Embeddings。
-        參數:
-            model_path (str): Embedding 模型路徑或名稱。
-            device     (str): 運算裝置。
-        回傳:
-            None
-        """
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name=model_path,
-            model_kwargs={"device": device},
-            encode_kwargs={"normalize_embeddings": True},
-        )
-
-    def _init_vector_store(self, db_dir: str, collection: str):
-        """
-        功能: 初始化 Milvus 向量資料庫與持久化 docstore。
-        參數:
-            db_dir     (str): 資料庫目錄。
-            collection (str): 集合名稱。
-        回傳:
-            None
-        """
-        os.makedirs(db_dir, exist_ok=True)
-        uri = os.path.join(db_dir, f"{collection}.db")
-        self.vector_store = Milvus(
-            embedding_function=self.embeddings,
-            collection_name=collection,
-            connection_args={"uri": uri},
-            index_params={"index_type": "FLAT", "metric_type": "L2"},
-            auto_id=True,
-        )
-
-        # 父文件 docstore（可持久化）
-        store_file = os.path.join(db_dir, f"{collection}.pkl")
-        self.doc_store = create_kv_docstore(PersistentInMemoryStore(store_file))
-
-    def _init_child_splitter(self, size: int, overlap: int):
-        """
-        功能: 初始化子文件分割器。
-        參數:
-            size    (int): chunk 大小。
-            overlap (int): chunk 重疊大小。
-        回傳:
-            None
-        """
-        self.child_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=size,
-            chunk_overlap=overlap,
-            separators=["\n\n", "\n", "。", "，", " "],
-        )
-
-    def _init_retriever(self):
-        """
-        功能: 建立 ParentDocumentRetriever 作為檢索器。
-        參數:
-            無
-        回傳:
-            None
-        """
-        self.retriever = ParentDocumentRetriever(
-            vectorstore=self.vector_store,
-            docstore=self.doc_store,
-            child_splitter=self.child_splitter,
-            search_kwargs={"k": self.top_k},
-        )
-
-    # ---------- public ----------
-    def add_documents(self, docs: List[Document]) -> None:
-        """
-        功能: 新增文件至檢索器與向量資料庫。
-        參數:
-            docs (List[Document]): 要新增的文件列表。
-        回傳:
-            None
-        """
-        if docs:
-            self.retriever.add_documents(docs)
-
-    def retrieve(self, query: str) -> Dict[str, List[Document]]:
-        """
-        功能: 執行檢索，回傳父文件與子 chunk。
-        參數:
-            query (str): 查詢字串。
-        回傳:
-            Dict[str, List[Document]]: 
-                'parent' -> 父文件列表，
-                'child'  -> 子 chunk 列表。
-        """
-        parent_docs = self.retriever.invoke(query)
-        child_docs = self.vector_store.similarity_search(query, k=self.top_k)
-
-        return {"parent_documents": parent_docs, "child_documents": child_docs}
-    
-
-from mcp.server.fastmcp import FastMCP
-from langchain_community.document_loaders import DirectoryLoader, TextLoader
-import os
-
-mcp = FastMCP("ParentRAG")
-
-ParentRAG = ParentRAGEngine()
-
-@mcp.tool(description="從指定目錄添加文件到知識庫")
-def add_documents(directory_path: str = None):
-    """
-    功能: 從指定目錄載入所有txt文件，並添加到ParentRAG知識庫
-    參數: 
-        directory_path (str, optional): 文件目錄路徑，默認使用環境變數DOCUMENT_PATH
-    回傳:
-        dict: 包含添加的文件數量和狀態信息
-    """
-    logger.info(f"Called add_documents with args: directory_path={directory_path}")
-    # 使用提供的路徑或環境變數
-    document_path = directory_path or DOCUMENT_PATH
-    
-    # 檢查路徑是否存在且為目錄
-    if not document_path:
-        return {"status": "error", "message": "未提供文件路徑，請指定路徑或設置MARKITDOWN_OUTPUT_PATH環境變數"}
-    
-    if not os.path.exists(document_path):
-        return {"status": "error", "message": f"路徑不存在: {document_path}"}
-    
-    if not os.path.isdir(document_path):
-        return {"status": "error", "message": f"{document_path} 不是有效目錄"}
-    
-    try:
-        # 使用DirectoryLoader加載文件，啟用多線程和進度條
-        loader = DirectoryLoader(
-            document_path,
-            glob="**/*.txt",
-            loader_cls=TextLoader,
-            loader_kwargs={"encoding": "utf-8"},
-            use_multithreading=True,  # 啟用多線程
-            show_progress=True,  # 顯示進度條
-            max_concurrency=8  # 控制最大線程數量
-        )
-
-        documents = loader.load()
-        
-        if not documents:
-            return {"status": "warning", "message": f"在 {document_path} 中未找到txt文件", "count": 0}
-        
-        ParentRAG.add_documents(documents)
-        
-        return {
-            "status": "success", 
-            "message": f"成功添加 {len(documents)} 個文件到知識庫", 
-            "count": len(documents)
-        }
-        
-    except Exception as e:
-        return {"status": "error", "message": f"添加文件時發生錯誤: {str(e)}", "count": 0}
-
-@mcp.tool(description="使用查詢語句從知識庫中檢索相關文件")
-def retrieve(query: str):
-    """
-    功能: 根據查詢字串從知識庫中檢索相關文件
-    參數:
-        query (str): 查詢字串
-    回傳:
-        dict: 包含父文檔檢索結果的字典
-    """
-    logger.info(f"Called retrieve with args: query={query}")
-    if not query or not query.strip():
-        return {"status": "error", "message": "查詢字串不能為空"}
-    
-    try:
-        result = ParentRAG.retrieve(query=query)
-        
-        return {
-            "status": "success",
-            "documents": result["parent_documents"],
-            "count": len(result["parent_documents"])
-        }
-    except Exception as e:
-        return {"status": "error", "message": f"檢索過程中發生錯誤: {str(e)}"}
-    
-if __name__ == "__main__":
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+import os
+import json
+import pickle
+import hashlib
+import pathlib
+import uuid
+import time
+import queue
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import Executor, Future
+from typing import List, Dict, Optional, Tuple
+import logging
+
+# 設定日誌
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+from langchain_huggingface import HuggingFaceEmbeddings
+from langchain_milvus import Milvus
+from langchain.retrievers import ParentDocumentRetriever
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain.storage._lc_store import create_kv_docstore
+from langchain.storage import InMemoryStore
+from dotenv import load_dotenv
+import os
+
+from rag_docstore import LogStructuredStore, LRUDocumentCache
+from rag_manifest import IngestManifest
+from rag_embedding_cache import CachedEmbeddings, embed_query_batch, normalize_text
+from rag_index import build_index_config, is_local_uri
+from rag_bm25 import BM25Index, reciprocal_rank_fusion
+from rag_quantization import QuantizedVectorStore
+from rag_snippets import build_snippets
+from rag_concurrency import ExecutorLanes, JobRegistry, QueryGate, ReadWriteLock
+from rag_dedup import ChildDeduplicator, SignatureSet, collapse, signature
+from rag_metrics import JsonlDumper, StageMetrics
+
+load_dotenv()
+EMBEDDING_MODEL_PATH = os.getenv("EMBEDDING_MODEL_PATH", "")
+DB_DIR = os.getenv("DB_DIR", "")
+COLLECTION_NAME = os.getenv("COLLECTION_NAME", "")
+CHILD_CHUNK_SIZE = os.getenv("CHILD_CHUNK_SIZE", "")
+CHILD_CHUNK_OVERLAP = os.getenv("CHILD_CHUNK_OVERLAP", "")
+TOP_K = os.getenv("TOP_K", "")
+DEVICE = os.getenv("DEVICE", "")
+DOCUMENT_PATH = os.getenv("MARKITDOWN_OUTPUT_PATH", "")
+DOCSTORE_BACKEND = os.getenv("DOCSTORE_BACKEND", "log")  # 'log' 或 'pickle'
+DOCSTORE_FSYNC = os.getenv("DOCSTORE_FSYNC", "true").lower() == "true"
+DOCSTORE_COMPRESS_LEVEL = int(os.getenv("DOCSTORE_COMPRESS_LEVEL", "6"))  # 父文件的 zlib 壓縮等級，0 表示不壓縮
+PARENT_CACHE_SIZE = int(os.getenv("PARENT_CACHE_SIZE", "256"))  # 記憶體中保留的已解碼父文件數，0 表示停用
+INGEST_EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", "256"))  # 每批嵌入與寫入的子 chunk 數
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "64"))  # 各階段之間佇列的檔案數上限
+EMBEDDING_CACHE = os.getenv("EMBEDDING_CACHE", "true").lower() == "true"
+EMBEDDING_CACHE_DTYPE = os.getenv("EMBEDDING_CACHE_DTYPE", "float16")  # 'float16' 或 'float32'
+MILVUS_URI = os.getenv("MILVUS_URI", "")  # 未設定時使用 DB_DIR 下的 Milvus Lite 檔案
+VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "FLAT")
+VECTOR_METRIC = os.getenv("VECTOR_METRIC", "L2")
+VECTOR_INDEX_PARAMS = os.getenv("VECTOR_INDEX_PARAMS", "")
+VECTOR_SEARCH_PARAMS = os.getenv("VECTOR_SEARCH_PARAMS", "")
+RETRIEVE_BATCH_WINDOW_MS = float(os.getenv("RETRIEVE_BATCH_WINDOW_MS", "5"))
+RETRIEVE_BATCH_SIZE = int(os.getenv("RETRIEVE_BATCH_SIZE", "32"))
+RETRIEVE_SEARCH = os.getenv("RETRIEVE_SEARCH", "vector")  # 'vector'、'keyword' 或 'hybrid'
+HYBRID_CANDIDATE_FACTOR = int(os.getenv("HYBRID_CANDIDATE_FACTOR", "4"))  # 融合前各路取 k 的幾倍候選
+RRF_K = int(os.getenv("RRF_K", "60"))
+ENGINE_READY_TIMEOUT = float(os.getenv("ENGINE_READY_TIMEOUT", "600"))  # 工具等待引擎載入的秒數
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))  # 0 表示停用
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "300"))  # 秒
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none").lower()  # 'none'、'int8' 或 'binary'
+QUANTIZATION_RESCORE_FACTOR = int(os.getenv("QUANTIZATION_RESCORE_FACTOR", "4"))  # 第一階段取 k 的幾倍候選重新評分
+SNIPPET_CONTEXT_CHARS = int(os.getenv("SNIPPET_CONTEXT_CHARS", "200"))  # snippet 模式下子 chunk 前後保留的字元數
+SNIPPET_MAX_CHARS = int(os.getenv("SNIPPET_MAX_CHARS", "4000"))  # snippet 模式未指定預算時的字元上限
+RAG_QUERY_WORKERS = int(os.getenv("RAG_QUERY_WORKERS", "4"))  # 查詢執行緒池大小
+RAG_INGEST_WORKERS = int(os.getenv("RAG_INGEST_WORKERS", "1"))  # 匯入執行緒池大小
+INGEST_YIELD_SECONDS = float(os.getenv("INGEST_YIELD_SECONDS", "1"))  # 每批嵌入前最多讓路給查詢的秒數
+COMPACT_FRAGMENTATION_THRESHOLD = float(os.getenv("COMPACT_FRAGMENTATION_THRESHOLD", "0.2"))  # 已刪除子 chunk 比例超過時重建索引
+MILVUS_COMPACTION_TIMEOUT = float(os.getenv("MILVUS_COMPACTION_TIMEOUT", "600"))  # 等待 Milvus 壓縮完成的秒數上限
+CHILD_DEDUP = os.getenv("CHILD_DEDUP", "true").lower() == "true"  # 匯入時合併文字完全相同的子 chunk
+CHILD_NEAR_DEDUP = os.getenv("CHILD_NEAR_DEDUP", "false").lower() == "true"  # 另外合併近似重複的子 chunk
+DEDUP_MAX_DISTANCE = int(os.getenv("DEDUP_MAX_DISTANCE", "3"))  # 近似重複候選的 SimHash 漢明距離上限（0-3）
+DEDUP_MIN_JACCARD = float(os.getenv("DEDUP_MIN_JACCARD", "0.9"))  # 確認近似重複的相異詞彙 Jaccard 相似度門檻
+RAG_STATS_WINDOW = int(os.getenv("RAG_STATS_WINDOW", "1024"))  # 各階段延遲直方圖保留的最近樣本數
+RAG_STATS_FILE = os.getenv("RAG_STATS_FILE", "")  # 設定時定期將 rag_stats 以 JSON lines 追加到此檔案
+RAG_STATS_INTERVAL = float(os.getenv("RAG_STATS_INTERVAL", "60"))  # 輸出間隔秒數
+
+# ---------- 自訂持久化的 InMemoryStore ----------
+class PersistentInMemoryStore(InMemoryStore):
+    def __init__(self, file_path: str):
+        """
+        功能: 初始化可持久化的 InMemoryStore。
+        參數:
+            file_path (str): 用於序列化與反序列化的檔案路徑。
+        回傳:
+            None
+        """
+        self.file_path = file_path
+        self.store = self._load()
+
+    def _load(self):
+        """
+        功能: 從檔案載入先前儲存的 store。
+        參數:
+            無
+        回傳:
+            dict: 載入的鍵值對儲存結構；若檔案不存在則回傳空 dict。
+        """
+        if os.path.exists(self.file_path):
+            with open(self.file_path, "rb") as f:
+                return pickle.load(f)
+        return {}
+
+    def _save(self):
+        """
+        功能: 將目前的 store 序列化後寫入檔案。
+        參數:
+            無
+        回傳:
+            None
+        """
+        with open(self.file_path, "wb") as f:
+            pickle.dump(self.store, f)
+
+    def mset(self, key_value_pairs):
+        """
+        功能: 批次寫入多組鍵值並立即持久化。
+        參數:
+            key_value_pairs (Iterable): 要寫入的鍵值對清單。
+        回傳:
+            None
+        """
+        super().mset(key_value_pairs)
+        self._save()
+
+    def mdelete(self, keys):
+        """
+        功能: 批次刪除多個鍵並立即持久化。
+        參數:
+            keys (Iterable): 要刪除的鍵列表。
+        回傳:
+            None
+        """
+        super().mdelete(keys)
+        self._save()
+
+    def count(self) -> int:
+        """
+        功能: 回傳目前的鍵數量。
+        參數:
+            無
+        回傳:
+            int: 鍵數量。
+        """
+        return len(self.store)
+
+SEARCH_MODES = ("vector", "keyword", "hybrid")
+
+
+# ---------- 檢索結果快取 ----------
+class QueryResultCache:
+    def __init__(self, max_size: int = QUERY_CACHE_SIZE, ttl: float = QUERY_CACHE_TTL):
+        """
+        功能: 以大小與存活時間為上限的 LRU 檢索結果快取。
+        參數:
+            max_size (int): 最多保留的結果數，0 表示停用。
+            ttl    (float): 結果存活秒數。
+        回傳:
+            None
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[tuple, Tuple[float, Dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[Dict]:
+        """
+        功能: 讀取快取結果，過期者視為未命中並移除。
+        參數:
+            key (tuple): 快取鍵。
+        回傳:
+            Optional[Dict]: 檢索結果，未命中為 None。
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: tuple, value: Dict) -> None:
+        """
+        功能: 寫入結果，超過上限時淘汰最久未使用者。
+        參數:
+            key   (tuple): 快取鍵。
+            value  (Dict): 檢索結果。
+        回傳:
+            None
+        """
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """
+        功能: 清空快取。
+        參數:
+            無
+        回傳:
+            None
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        """
+        功能: 回傳命中統計。
+        參數:
+            無
+        回傳:
+            Dict[str, float]: hits / misses / hit_rate / size。
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "size": len(self._entries),
+        }
+
+# ---------- ParentRAGEngine ----------
+class ParentRAGEngine:
+    def __init__(
+        self,
+        *,
+        embedding_model_path: str = EMBEDDING_MODEL_PATH,
+        database_dir: str = DB_DIR,
+        collection_name: str = COLLECTION_NAME,
+        child_chunk_size: int = int(CHILD_CHUNK_SIZE),
+        child_chunk_overlap: int = int(CHILD_CHUNK_OVERLAP),
+        top_k: int = int(TOP_K),
+        device: str = DEVICE,
+        embeddings: Optional[Embeddings] = None,
+    ):
+        """
+        功能: 建立 Parent RAG 引擎，初始化 embedding、向量資料庫、分割器與檢索器。
+        參數:
+            embedding_model_path (str): Embedding 模型路徑或名稱。
+            database_dir       (str): 向量資料庫目錄。
+            collection_name    (str): 資料集合名稱。
+            child_chunk_size   (int): 子 chunk 大小。
+            child_chunk_overlap(int): 子 chunk 重疊大小。
+            top_k              (int): 檢索時的 top-K 數量。
+            device             (str): 運算裝置（如 'cpu' 或 'cuda'）。
+            embeddings  (Embeddings, optional): 直接指定 Embeddings（例如基準測試），未提供則載入 HuggingFace 模型。
+        回傳:
+            None
+        """
+        self.top_k = top_k
+        self.collection_name = collection_name
+        # 每次新增或刪除文件都遞增，作為檢索結果快取鍵的一部分，確保不會回傳過期結果
+        self.generation = 0
+        self.query_cache = QueryResultCache()
+        # 寫入（新增、刪除）獨占，搜尋與父文件讀取可並行
+        self.lock = ReadWriteLock()
+        self.query_gate = QueryGate(INGEST_YIELD_SECONDS)
+        # 各階段（query.embed、query.search、query.mget、ingest.split、ingest.insert、ingest.persist …）的延遲
+        self.metrics = StageMetrics(RAG_STATS_WINDOW)
+        self._init_embeddings(embedding_model_path, device, database_dir, embeddings)
+        self._init_vector_store(database_dir, collection_name)
+        self._init_child_splitter(size=child_chunk_size, overlap=child_chunk_overlap)
+        self._init_retriever()
+        self.manifest = IngestManifest(os.path.join(database_dir, f"{collection_name}_manifest.db"))
+        # 上次重建索引後從 Milvus 刪除的子 chunk 數，用於估算碎片比例
+        self._compaction_state_path = os.path.join(database_dir, f"{collection_name}_compaction.json")
+        self.deleted_since_rebuild = self._load_compaction_state()
+        self._init_keyword_index(database_dir, collection_name)
+        self._init_quantized_store(database_dir, collection_name)
+        self.deduplicator = (
+            ChildDeduplicator(
+                os.path.join(database_dir, f"{collection_name}_dedup.db"),
+                DEDUP_MAX_DISTANCE if CHILD_NEAR_DEDUP else None,
+                DEDUP_MIN_JACCARD,
+            )
+            if CHILD_DEDUP else None
+        )
+
+    # ---------- private ----------
+    def _init_embeddings(self, model_path: str, device: str, db_dir: str, embeddings: Optional[Embeddings] = None):
+        """
+        功能: 初始化 HuggingFace Embeddings，並視 EMBEDDING_CACHE 設定包上持久化的 embedding 快取。
+        參數:
+            model_path (str): Embedding 模型路徑或名稱。
+            device     (str): 運算裝置。
+            db_dir     (str): 資料庫目錄，快取存放於其下的 embedding_cache/。
+            embeddings (Embeddings, optional): 已建立的 Embeddings，提供時不再載入模型。
+        回傳:
+            None
+        """
+        self.embeddings = embeddings or HuggingFaceEmbeddings(
+            model_name=model_path,
+            model_kwargs={"device": device},
+            encode_kwargs={"normalize_embeddings": True},
+        )
+        if EMBEDDING_CACHE:
+            self.embeddings = CachedEmbeddings(
+                self.embeddings,
+                model_id=model_path,
+                cache_dir=os.path.join(db_dir, "embedding_cache"),
+                dtype=EMBEDDING_CACHE_DTYPE,
+            )
+
+    def _init_vector_store(self, db_dir: str, collection: str):
+        """
+        功能: 初始化 Milvus 向量資料庫與持久化 docstore。
+        參數:
+            db_dir     (str): 資料庫目錄。
+            collection (str): 集合名稱。
+        回傳:
+            None
+        """
+        os.makedirs(db_dir, exist_ok=True)
+        uri = MILVUS_URI or os.path.join(db_dir, f"{collection}.db")
+        index_params, search_params = build_index_config(
+            VECTOR_INDEX_TYPE,
+            VECTOR_METRIC,
+            VECTOR_INDEX_PARAMS,
+            VECTOR_SEARCH_PARAMS,
+            local=is_local_uri(uri),
+        )
+        self.vector_store = Milvus(
+            embedding_function=self.embeddings,
+            collection_name=collection,
+            connection_args={"uri": uri},
+            index_params=index_params,
+            search_params=search_params,
+            auto_id=True,
+        )
+        self._check_existing_index(index_params)
+
+        # 父文件 docstore（可持久化）
+        self.doc_store = LRUDocumentCache(create_kv_docstore(self._init_byte_store(db_dir, collection)), PARENT_CACHE_SIZE)
+
+    def _check_existing_index(self, index_params: dict) -> None:
+        """
+        功能: 既有集合沿用建立時的索引；設定不同時改用既有索引的搜尋參數並提示需重建。
+        參數:
+            index_params (dict): 目前設定的索引參數。
+        回傳:
+            None
+        """
+        existing = self.vector_store._get_index()
+        if existing is None:
+            return
+        existing_type = existing["index_param"]["index_type"]
+        existing_metric = existing["index_param"]["metric_type"]
+        if (existing_type, existing_metric) != (index_params["index_type"], index_params["metric_type"]):
+            logger.warning(
+                f"Collection already uses {existing_type}/{existing_metric}, "
+                f"ignoring configured {index_params['index_type']}/{index_params['metric_type']} until it is rebuilt"
+            )
+            _, search_params = build_index_config(existing_type, existing_metric, local=False)
+            self.vector_store.search_params = search_params
+
+    def _init_byte_store(self, db_dir: str, collection: str):
+        """
+        功能: 依 DOCSTORE_BACKEND 建立 docstore 底層的位元組儲存。
+              'log' 使用附加寫入式 segment 檔（父文件以 zlib 壓縮、讀取時才解壓縮）；若存在舊版 pickle 檔則先一次性匯入。
+        參數:
+            db_dir     (str): 資料庫目錄。
+            collection (str): 集合名稱。
+        回傳:
+            ByteStore: 位元組鍵值儲存。
+        """
+        store_file = os.path.join(db_dir, f"{collection}.pkl")
+        if DOCSTORE_BACKEND == "pickle":
+            self.byte_store = PersistentInMemoryStore(store_file)
+            return self.byte_store
+
+        self.byte_store = LogStructuredStore(
+            os.path.join(db_dir, f"{collection}_docstore"),
+            fsync=DOCSTORE_FSYNC,
+            compress_level=DOCSTORE_COMPRESS_LEVEL,
+        )
+        if os.path.exists(store_file):
+            logger.info(f"Migrating pickle docstore {store_file} to log-structured store")
+            legacy = PersistentInMemoryStore(store_file)
+            self.byte_store.import_items(legacy.store)
+            os.replace(store_file, store_file + ".migrated")
+        return self.byte_store
+
+    def _init_child_splitter(self, size: int, overlap: int):
+        """
+        功能: 初始化子文件分割器。
+        參數:
+            size    (int): chunk 大小。
+            overlap (int): chunk 重疊大小。
+        回傳:
+            None
+        """
+        self.child_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=size,
+            chunk_overlap=overlap,
+            separators=["\n\n", "\n", "。", "，", " "],
+        )
+
+    def _init_retriever(self):
+        """
+        功能: 建立 ParentDocumentRetriever 作為檢索器。
+        參數:
+            無
+        回傳:
+            None
+        """
+        self.retriever = ParentDocumentRetriever(
+            vectorstore=self.vector_store,
+            docstore=self.doc_store,
+            child_splitter=self.child_splitter,
+            search_kwargs={"k": self.top_k},
+        )
+
+    def _init_keyword_index(self, db_dir: str, collection: str):
+        """
+        功能: 初始化子 chunk 的 BM25 倒排索引；既有集合尚未建立索引時，從向量資料庫回填。
+        參數:
+            db_dir     (str): 資料庫目錄。
+            collection (str): 集合名稱。
+        回傳:
+            None
+        """
+        self.keyword_index = BM25Index(os.path.join(db_dir, f"{collection}_bm25.db"))
+        if self.keyword_index.count() > 0 or self.vector_store.col is None:
+            return
+
+        logger.info("Backfilling BM25 index from the vector store")
+        store = self.vector_store
+        iterator = store.col.query_iterator(
+            batch_size=1000,
+            expr=f"{store._primary_field} >= 0 or {store._primary_field} < 0",
+            output_fields=store._remove_forbidden_fields(store.fields[:]),
+        )
+        while True:
+            rows = iterator.next()
+            if not rows:
+                break
+            docs = [store._parse_document(row) for row in rows]
+            self.keyword_index.add([row[store._primary_field] for row in rows], docs, self.retriever.id_key)
+        iterator.close()
+
+    def _init_quantized_store(self, db_dir: str, collection: str):
+        """
+        功能: VECTOR_QUANTIZATION 不為 'none' 時，改以量化向量儲存做第一階段搜尋，子 chunk 文字由 BM25 索引的
+              chunks 表提供，Milvus 不再寫入；量化儲存為空而 Milvus 已有資料時，沿用主鍵回填。
+        參數:
+            db_dir     (str): 資料庫目錄。
+            collection (str): 集合名稱。
+        回傳:
+            None
+        """
+        self.quantized_store = None
+        if VECTOR_QUANTIZATION == "none":
+            return
+        self.quantized_store = QuantizedVectorStore(
+            os.path.join(db_dir, f"{collection}_{VECTOR_QUANTIZATION}"),
+            mode=VECTOR_QUANTIZATION,
+            metric=VECTOR_METRIC,
+            rescore_factor=QUANTIZATION_RESCORE_FACTOR,
+        )
+        store = self.vector_store
+        if self.quantized_store.count() > 0 or store.col is None:
+            return
+
+        logger.info(f"Backfilling {VECTOR_QUANTIZATION} quantized vectors from the vector store")
+        iterator = store.col.query_iterator(
+            batch_size=1000,
+            expr=f"{store._primary_field} >= 0 or {store._primary_field} < 0",
+            output_fields=[store._primary_field, store._vector_field],
+        )
+        while True:
+            rows = iterator.next()
+            if not rows:
+                break
+            self.quantized_store.add(
+                [row[store._vector_field] for row in rows],
+                ids=[row[store._primary_field] for row in rows],
+            )
+        iterator.close()
+
+    def _load_compaction_state(self) -> int:
+        """
+        功能: 讀取上次重建索引後累計刪除的子 chunk 數。
+        參數:
+            無
+        回傳:
+            int: 刪除數量。
+        """
+        if not os.path.exists(self._compaction_state_path):
+            return 0
+        with open(self._compaction_state_path, "r", encoding="utf-8") as f:
+            return json.load(f).get("deleted_since_rebuild", 0)
+
+    def _save_compaction_state(self) -> None:
+        """
+        功能: 以 tmp + rename 寫入累計刪除數。
+        參數:
+            無
+        回傳:
+            None
+        """
+        tmp_path = self._compaction_state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"deleted_since_rebuild": self.deleted_since_rebuild}, f)
+        os.replace(tmp_path, self._compaction_state_path)
+
+    # ---------- public ----------
+    def add_documents(self, docs: List[Document], ids: Optional[List[str]] = None) -> Dict[str, List]:
+        """
+        功能: 切分父文件並新增子 chunk 至向量資料庫、父文件至 docstore。
+        參數:
+            docs (List[Document]): 要新增的文件列表。
+            ids  (List[str], optional): 父文件 ID，未提供則自動產生。
+        回傳:
+            Dict[str, List]: 父文件 ID -> 其子 chunk 在向量資料庫中的主鍵列表。
+        """
+        if not docs:
+            return {}
+        if ids is None:
+            ids = [str(uuid.uuid4()) for _ in docs]
+
+        child_docs, owners = [], []
+        with self.metrics.time("ingest.split", len(docs)):
+            for doc, doc_id in zip(docs, ids):
+                for child in self.child_splitter.split_documents([doc]):
+                    child_docs.append(child)
+                    owners.append(doc_id)
+        with self.metrics.time("ingest.embed", len(child_docs)):
+            vectors = self.embeddings.embed_documents([child.page_content for child in child_docs]) if child_docs else []
+        return self._write(docs, ids, child_docs, owners, vectors)
+
+    def _write(
+        self,
+        docs: List[Document],
+        ids: List[str],
+        child_docs: List[Document],
+        owners: List[str],
+        vectors: List[List[float]],
+        signatures: Optional[List] = None,
+    ) -> Dict[str, List]:
+        """
+        功能: 將已嵌入的子 chunk 寫入向量資料庫、父文件寫入 docstore；啟用去重時一併登記子 chunk 的簽章。
+        參數:
+            docs       (List[Document]): 父文件列表。
+            ids             (List[str]): 父文件 ID。
+            child_docs (List[Document]): 子 chunk 列表。
+            owners          (List[str]): 每個子 chunk 所屬的父文件 ID。
+            vectors (List[List[float]]): 子 chunk 向量。
+            signatures (List, optional): 子 chunk 簽章（匯入管線已計算者），未提供時在此計算。
+        回傳:
+            Dict[str, List]: 父文件 ID -> 其子 chunk 在向量資料庫中的主鍵列表。
+        """
+        for child, owner in zip(child_docs, owners):
+            child.metadata[self.retriever.id_key] = owner
+        if self.deduplicator is not None and signatures is None:
+            signatures = [signature(child.page_content) for child in child_docs]
+        with self.lock.write():
+            with self.metrics.time("ingest.insert", len(child_docs)):
+                if not child_docs:
+                    child_ids = []
+                elif self.quantized_store is not None:
+                    child_ids = self.quantized_store.add(vectors)
+                else:
+                    child_ids = self.vector_store.add_embeddings(
+                        texts=[child.page_content for child in child_docs],
+                        embeddings=vectors,
+                        metadatas=[child.metadata for child in child_docs],
+                    )
+                self.keyword_index.add(child_ids, child_docs, self.retriever.id_key)
+                if self.deduplicator is not None:
+                    self.deduplicator.add(child_ids, signatures, owners)
+            with self.metrics.time("ingest.persist", len(docs)):
+                self.doc_store.mset(list(zip(ids, docs)))
+            self._bump_generation()
+
+        mapping = {doc_id: [] for doc_id in ids}
+        for owner, child_id in zip(owners, child_ids):
+            mapping[owner].append(child_id)
+        return mapping
+
+    def _bump_generation(self) -> None:
+        """
+        功能: 知識庫內容改變時遞增版本並清空檢索結果快取。
+        參數:
+            無
+        回傳:
+            None
+        """
+        self.generation += 1
+        self.query_cache.clear()
+
+    def delete_documents(self, parent_ids: List[str], child_ids: List) -> None:
+        """
+        功能: 從向量資料庫刪除子 chunk，並從 docstore 刪除父文件；啟用去重時，仍被其他父文件引用的子 chunk 會保留。
+        參數:
+            parent_ids (List[str]): 父文件 ID 列表。
+            child_ids  (List): 子 chunk 主鍵列表。
+        回傳:
+            None
+        """
+        with self.lock.write(), self.metrics.time("delete", len(parent_ids)):
+            if self.deduplicator is not None:
+                child_ids = self.deduplicator.release(parent_ids, child_ids)
+            if child_ids:
+                if self.quantized_store is not None:
+                    self.quantized_store.delete(child_ids)
+                else:
+                    self.vector_store.delete(ids=child_ids)
+                    self.deleted_since_rebuild += len(child_ids)
+                    self._save_compaction_state()
+                self.keyword_index.delete(child_ids)
+            if parent_ids:
+                self.doc_store.mdelete(parent_ids)
+            if child_ids or parent_ids:
+                self._bump_generation()
+
+    def remove_documents(self, sources: Optional[List[str]] = None, parent_ids: Optional[List[str]] = None) -> Dict[str, int]:
+        """
+        功能: 依來源路徑或父文件 ID 刪除父文件及其所有子 chunk，並移除對應的 manifest 紀錄。
+              來源路徑為目錄時刪除其下所有已匯入的檔案。
+        參數:
+            sources    (List[str], optional): 來源檔案或目錄路徑。
+            parent_ids (List[str], optional): 父文件 ID。
+        回傳:
+            Dict[str, int]: parents / children 刪除數量。
+        """
+        paths = []
+        for source in sources or []:
+            source = os.path.abspath(source)
+            paths.extend([source] if self.manifest.get(source) else self.manifest.paths_under(source))
+        records = [self.manifest.get(path) for path in dict.fromkeys(paths)]
+        targets = list(dict.fromkeys([record["parent_id"] for record in records] + list(parent_ids or [])))
+
+        with self.lock.write():
+            # 以 BM25 chunks 表為準找出子 chunk，不在 manifest 中的父文件（例如直接呼叫 add_documents 新增者）也能刪除；
+            # 去重後與其他父文件共用的子 chunk 記在引用表中
+            child_ids = self.keyword_index.children_of(targets)
+            if self.deduplicator is not None:
+                child_ids = list(dict.fromkeys(child_ids + self.deduplicator.children_of(targets)))
+            existing = [doc_id for doc_id, doc in zip(targets, self.doc_store.mget(targets)) if doc is not None]
+            live = self.keyword_index.count()
+            self.delete_documents(existing, child_ids)
+            removed = live - self.keyword_index.count()
+            self.manifest.remove(list(dict.fromkeys(paths + self.manifest.paths_for_parents(targets))))
+        return {"parents": len(existing), "children": removed}
+
+    def fragmentation(self) -> float:
+        """
+        功能: 估算向量索引中已刪除資料所佔的比例。
+        參數:
+            無
+        回傳:
+            float: 0 到 1 之間的比例。
+        """
+        if self.quantized_store is not None:
+            return self.quantized_store.fragmentation()
+        live = self.keyword_index.count()
+        total = live + self.deleted_since_rebuild
+        return self.deleted_since_rebuild / total if total else 0.0
+
+    def compact(self, force: bool = False) -> Dict:
+        """
+        功能: 回收刪除後留下的空間：docstore 改寫存活紀錄、BM25 索引合併並 VACUUM；
+              向量索引的碎片比例超過 COMPACT_FRAGMENTATION_THRESHOLD（或 force）時壓縮量化儲存或重建 Milvus 索引。
+        參數:
+            force (bool): 不論碎片比例皆重建向量索引。
+        回傳:
+            Dict: 各儲存的處理結果。
+        """
+        report = {"fragmentation": round(self.fragmentation(), 4), "vector_index_rebuilt": False}
+        with self.lock.write():
+            if isinstance(self.byte_store, LogStructuredStore):
+                before = self.byte_store.total_bytes()
+                self.byte_store.compact()
+                report["docstore_bytes"] = {"before": before, "after": self.byte_store.total_bytes()}
+
+            before = os.path.getsize(self.keyword_index.db_path)
+            self.keyword_index.optimize()
+            report["keyword_index_bytes"] = {"before": before, "after": os.path.getsize(self.keyword_index.db_path)}
+
+            if force or report["fragmentation"] >= COMPACT_FRAGMENTATION_THRESHOLD:
+                if self.quantized_store is not None:
+                    report["quantized_rows_removed"] = self.quantized_store.compact()
+                else:
+                    self._rebuild_vector_index()
+                    self.deleted_since_rebuild = 0
+                    self._save_compaction_state()
+                report["vector_index_rebuilt"] = True
+            # 重建索引後近似搜尋的結果與分數可能改變，不沿用壓縮前的檢索結果
+            self._bump_generation()
+        return report
+
+    def _rebuild_vector_index(self) -> None:
+        """
+        功能: 壓縮 Milvus 集合並重建向量索引；Milvus Lite 不支援 compact，刪除已即時生效，只重建索引。
+              等待壓縮超過 MILVUS_COMPACTION_TIMEOUT 秒時不再等待（壓縮仍在 Milvus 端繼續），直接重建索引。
+        參數:
+            無
+        回傳:
+            None
+        """
+        store = self.vector_store
+        if store.col is None:
+            return
+        client = store.client
+        try:
+            job_id = client.compact(store.collection_name)
+            deadline = time.monotonic() + MILVUS_COMPACTION_TIMEOUT
+            while client.get_compaction_state(job_id) != "Completed":
+                if time.monotonic() >= deadline:
+                    logger.warning(
+                        f"Milvus compaction {job_id} not completed after {MILVUS_COMPACTION_TIMEOUT:.0f}s, rebuilding index without waiting"
+                    )
+                    break
+                time.sleep(0.5)
+        except Exception as e:
+            logger.info(f"Milvus compaction unavailable ({type(e).__name__}), rebuilding index only")
+
+        # 沿用集合既有的索引設定（可能與目前的 VECTOR_INDEX_TYPE 不同，見 _check_existing_index）
+        index = store._get_index()
+        if index is not None:
+            param = index["index_param"]
+            index_params = {"index_type": param["index_type"], "metric_type": param["metric_type"], "params": param.get("params", {})}
+        else:
+            index_params = store._as_list(store.index_params)[0]
+        client.release_collection(store.collection_name)
+        if index is not None:
+            client.drop_index(store.collection_name, index["index_name"])
+        prepared = client.prepare_index_params()
+        prepared.add_index(field_name=store._vector_field, **index_params)
+        client.create_index(store.collection_name, prepared)
+        client.load_collection(store.collection_name)
+        logger.info(f"Rebuilt vector index for {store.collection_name}")
+
+    def ingest_directory(self, directory: str, glob: str = "**/*.txt", progress=None) -> Dict[str, int]:
+        """
+        功能: 以串流管線增量匯入目錄：依 manifest 比對 (大小, mtime, 內容雜湊)，只切分與嵌入新增或變更的檔案，
+              變更檔案先移除舊的父/子文件，已刪除的檔案則從知識庫清除。
+        參數:
+            directory (str): 文件目錄。
+            glob      (str): 檔案比對樣式。
+            progress  (Callable, optional): 每寫入一批後以目前的計數字典呼叫。
+        回傳:
+            Dict[str, int]: added / updated / skipped / removed / chunks 數量。
+        """
+        return IngestPipeline(self, os.path.abspath(directory), glob, progress).run()
+
+    def retrieve(self, query: str, k: Optional[int] = None, search: str = RETRIEVE_SEARCH) -> Dict[str, List[Document]]:
+        """
+        功能: 執行單次檢索：查詢只嵌入一次、向量資料庫只搜尋一次，再以一次 mget 取回父文件。
+        參數:
+            query  (str): 查詢字串。
+            k      (int, optional): 子 chunk 數量，預設為 top_k。
+            search (str): 'vector' 向量檢索、'keyword' BM25 關鍵字檢索、'hybrid' 兩者以 RRF 融合。
+        回傳:
+            Dict[str, List[Document]]:
+                'parent_documents' -> 父文件列表（依最佳子 chunk 排序），
+                'parent_ids'       -> 與 parent_documents 對應的父文件 ID，
+                'child_documents'  -> 子 chunk 列表（metadata 含分數與父文件 ID）。
+        """
+        return self.retrieve_many([query], k, search)[0]
+
+    def get_parent(self, parent_id: str) -> Optional[Document]:
+        """
+        功能: 依 ID 取回單一父文件，供 snippet 模式的呼叫端按需讀取完整內容。
+        參數:
+            parent_id (str): 父文件 ID。
+        回傳:
+            Optional[Document]: 父文件，不存在時為 None。
+        """
+        with self.lock.read():
+            return self.doc_store.mget([parent_id])[0]
+
+    def retrieve_many(
+        self, queries: List[str], k: Optional[int] = None, search: str = RETRIEVE_SEARCH
+    ) -> List[Dict[str, List[Document]]]:
+        """
+        功能: 批次檢索：所有查詢以一次批次前向運算嵌入、一次向量搜尋，父文件以一次 mget 取回。
+        參數:
+            queries (List[str]): 查詢字串列表。
+            k       (int, optional): 每個查詢的子 chunk 數量，預設為 top_k。
+            search  (str): 'vector'、'keyword' 或 'hybrid'。
+        回傳:
+            List[Dict[str, List[Document]]]: 與 queries 順序對應的檢索結果，格式同 retrieve。
+        """
+        if not queries:
+            return []
+        if search not in SEARCH_MODES:
+            raise ValueError(f"不支援的 search: {search}，請使用 {'、'.join(SEARCH_MODES)}")
+        k = k or self.top_k
+        # 先讀取版本，搜尋期間若有寫入，結果會存在舊版本的鍵下而不會被使用
+        generation = self.generation
+        keys = [(normalize_text(query), k, search, self.collection_name, generation) for query in queries]
+        results = [self.query_cache.get(key) for key in keys]
+
+        # 正規化文字只作為快取鍵；嵌入與關鍵字搜尋使用原始查詢（同鍵的查詢取第一個），結果與 retrieve 一致
+        missing = {}
+        for query, key, result in zip(queries, keys, results):
+            if result is None:
+                missing.setdefault(key, query)
+        if missing:
+            with self.query_gate.active(), self.metrics.time("query.total", len(missing)):
+                computed = dict(zip(missing, self._retrieve_uncached(list(missing.values()), k, search)))
+            for key in missing:
+                self.query_cache.put(key, computed[key])
+            results = [result if result is not None else computed[key] for key, result in zip(keys, results)]
+        return results
+
+    def _retrieve_uncached(self, queries: List[str], k: int, search: str) -> List[Dict[str, List[Document]]]:
+        """
+        功能: 實際執行檢索與父文件解析；hybrid 時兩路各取 k * HYBRID_CANDIDATE_FACTOR 個候選後以 RRF 融合，
+              啟用去重時 vector 模式多取一倍候選，合併近似重複後仍有 k 個子 chunk。
+        參數:
+            queries (List[str]): 查詢字串列表。
+            k              (int): 每個查詢的子 chunk 數量。
+            search         (str): 'vector'、'keyword' 或 'hybrid'。
+        回傳:
+            List[Dict[str, List[Document]]]: 檢索結果列表。
+        """
+        if search == "vector":
+            candidates = k * 2 if self.deduplicator is not None else k
+        else:
+            candidates = k * HYBRID_CANDIDATE_FACTOR
+        embeddings = None
+        if search in ("vector", "hybrid"):
+            with self.metrics.time("query.embed", len(queries)):
+                embeddings = embed_query_batch(self.embeddings, queries)
+        # 查詢嵌入不需持鎖；搜尋到取回父文件之間持有讀取鎖，不會看到寫入到一半的資料
+        start = time.perf_counter()
+        with self.lock.read():
+            # 等待讀取鎖的時間反映匯入寫入造成的阻塞
+            self.metrics.record("query.lock_wait", time.perf_counter() - start, len(queries))
+            return self._search_and_resolve(queries, embeddings, k, search, candidates)
+
+    def _search_and_resolve(
+        self, queries: List[str], embeddings: Optional[List[List[float]]], k: int, search: str, candidates: int
+    ) -> List[Dict[str, List[Document]]]:
+        """
+        功能: 執行向量／關鍵字搜尋與融合，合併近似重複的子 chunk，再以一次 mget 取回父文件；
+              去重後共用的子 chunk 會帶出所有引用它的父文件（metadata 的 shared_parents）。
+        參數:
+            queries            (List[str]): 查詢字串列表。
+            embeddings (List[List[float]]): 查詢向量，keyword 模式為 None。
+            k                        (int): 每個查詢的子 chunk 數量。
+            search                   (str): 'vector'、'keyword' 或 'hybrid'。
+            candidates               (int): 各路候選數量。
+        回傳:
+            List[Dict[str, List[Document]]]: 檢索結果列表。
+        """
+        search_start = time.perf_counter()
+        if search in ("vector", "hybrid"):
+            with self.metrics.time("query.search.vector", len(queries)):
+                vector_lists = self._search_by_vectors(embeddings, candidates)
+        if search in ("keyword", "hybrid"):
+            with self.metrics.time("query.search.keyword", len(queries)):
+                keyword_lists = [self.keyword_index.search(query, candidates) for query in queries]
+
+        if search == "vector":
+            child_lists = vector_lists
+        elif search == "keyword":
+            child_lists = keyword_lists
+        else:
+            child_lists = [
+                reciprocal_rank_fusion([vector_docs, keyword_docs], candidates, RRF_K)
+                for vector_docs, keyword_docs in zip(vector_lists, keyword_lists)
+            ]
+        if self.deduplicator is not None:
+            child_lists = [collapse(docs, self.deduplicator.max_distance, self.deduplicator.min_jaccard) for docs in child_lists]
+        child_lists = [docs[:k] for docs in child_lists]
+
+        id_key = self.retriever.id_key
+        # 首位擁有者已被刪除或更新的共用子 chunk：改由仍引用它的父文件接手，取回父文件後覆寫其 metadata（含 source）
+        inherited: List[Document] = []
+        if self.deduplicator is not None:
+            refs = self.deduplicator.parents_of(list({
+                doc.metadata["pk"] for docs in child_lists for doc in docs if "pk" in doc.metadata
+            }))
+            for docs in child_lists:
+                for doc in docs:
+                    holders = refs.get(doc.metadata.get("pk"), [])
+                    if holders and doc.metadata.get(id_key) not in holders:
+                        doc.metadata[id_key] = holders[0]
+                        inherited.append(doc)
+                    shared = [pid for pid in holders if pid != doc.metadata.get(id_key)]
+                    if shared:
+                        doc.metadata["shared_parents"] = shared
+
+        def owners(doc: Document) -> List[str]:
+            return ([doc.metadata[id_key]] if id_key in doc.metadata else []) + doc.metadata.get("shared_parents", [])
+
+        parent_ids = list(dict.fromkeys(doc_id for docs in child_lists for doc in docs for doc_id in owners(doc)))
+        # query.search 含融合、去重合併與共用父文件查詢
+        self.metrics.record("query.search", time.perf_counter() - search_start, len(queries))
+        with self.metrics.time("query.mget", len(parent_ids)):
+            parents = dict(zip(parent_ids, self.doc_store.mget(parent_ids)))
+        for doc in inherited:
+            owner = parents.get(doc.metadata[id_key])
+            if owner is not None:
+                doc.metadata.update({key: value for key, value in owner.metadata.items() if key != id_key})
+
+        results = []
+        for child_docs in child_lists:
+            own_ids = [doc_id for doc_id in dict.fromkeys(
+                doc_id for doc in child_docs for doc_id in owners(doc)
+            ) if parents.get(doc_id) is not None]
+            results.append({
+                "parent_documents": [parents[doc_id] for doc_id in own_ids],
+                "parent_ids": own_ids,
+                "child_documents": child_docs,
+            })
+        return results
+
+    def _search_by_vectors(self, embeddings: List[List[float]], k: int) -> List[List[Document]]:
+        """
+        功能: 以一次 Milvus 搜尋處理多個查詢向量，並將距離分數寫入子 chunk 的 metadata。
+        參數:
+            embeddings (List[List[float]]): 查詢向量列表。
+            k                        (int): 每個查詢的子 chunk 數量。
+        回傳:
+            List[List[Document]]: 每個查詢對應的子 chunk 列表。
+        """
+        if self.quantized_store is not None:
+            return self._search_quantized(embeddings, k)
+
+        store = self.vector_store
+        if store.col is None:
+            return [[] for _ in embeddings]
+
+        if store.enable_dynamic_field:
+            output_fields = ["*"]
+        else:
+            output_fields = store._remove_forbidden_fields(store.fields[:])
+        results = store.client.search(
+            store.collection_name,
+            data=embeddings,
+            anns_field=store._vector_field,
+            search_params=store._as_list(store.search_params)[0],
+            limit=k,
+            output_fields=output_fields,
+        )
+
+        child_lists = []
+        for hits in results:
+            child_docs = []
+            for hit in hits:
+                doc = store._parse_document(hit["entity"])
+                doc.metadata["score"] = float(hit["distance"])
+                child_docs.append(doc)
+            child_lists.append(child_docs)
+        return child_lists
+
+    def stats(self) -> Dict:
+        """
+        功能: 彙整各階段的延遲直方圖、集合大小與快取統計。
+        參數:
+            無
+        回傳:
+            Dict: generation / uptime_seconds / sizes / caches / fragmentation / stages。
+        """
+        sizes = {
+            "parents": self.byte_store.count(),
+            "children": self.keyword_index.count(),
+            "files": self.manifest.count(),
+        }
+        if self.quantized_store is not None:
+            sizes["quantized_vectors"] = self.quantized_store.count()
+            sizes["quantized_resident_bytes"] = self.quantized_store.memory_bytes()
+        if self.deduplicator is not None:
+            sizes["child_refs"] = self.deduplicator.stats()["refs"]
+
+        caches = {"query_cache": self.query_cache.stats(), "parent_cache": self.doc_store.stats()}
+        if isinstance(self.embeddings, CachedEmbeddings):
+            caches["embedding_cache"] = self.embeddings.stats()
+        return {
+            "generation": self.generation,
+            "uptime_seconds": round(time.time() - self.metrics.started_at, 1),
+            "sizes": sizes,
+            "caches": caches,
+            "fragmentation": round(self.fragmentation(), 4),
+            "stages": self.metrics.snapshot(),
+        }
+
+    def _search_quantized(self, embeddings: List[List[float]], k: int) -> List[List[Document]]:
+        """
+        功能: 以量化向量儲存搜尋（量化碼取候選、全精度向量重新評分），再從 BM25 索引一次取回子 chunk 內容。
+        參數:
+            embeddings (List[List[float]]): 查詢向量列表。
+            k                        (int): 每個查詢的子 chunk 數量。
+        回傳:
+            List[List[Document]]: 每個查詢對應的子 chunk 列表。
+        """
+        hit_lists = self.quantized_store.search(embeddings, k)
+        chunks = self.keyword_index.get(list({child_id for hits in hit_lists for child_id, _ in hits}))
+
+        child_lists = []
+        for hits in hit_lists:
+            child_docs = []
+            for child_id, score in hits:
+                if child_id not in chunks:
+                    continue
+                doc = Document(page_content=chunks[child_id].page_content, metadata=dict(chunks[child_id].metadata))
+                doc.metadata["score"] = score
+                child_docs.append(doc)
+            child_lists.append(child_docs)
+        return child_lists
+
+
+# ---------- 串流匯入管線 ----------
+_END = object()
+
+
+class IngestPipeline:
+    def __init__(
+        self,
+        engine: ParentRAGEngine,
+        root: str,
+        glob: str,
+        progress=None,
+        embed_batch_size: int = INGEST_EMBED_BATCH_SIZE,
+        queue_size: int = INGEST_QUEUE_SIZE,
+    ):
+        """
+        功能: 建立匯入管線：檔案探索與讀取 → 切分 →（去重）→ 批次嵌入 → 批次寫入，各階段以有界佇列串接，
+              讀檔、切分與嵌入可同時進行，記憶體用量與語料大小無關。
+        參數:
+            engine (ParentRAGEngine): 檢索引擎。
+            root              (str): 文件目錄絕對路徑。
+            glob              (str): 檔案比對樣式。
+            progress     (Callable): 進度回呼，可為 None。
+            embed_batch_size  (int): 每批嵌入的子 chunk 數。
+            queue_size        (int): 佇列上限（檔案數）。
+        回傳:
+            None
+        """
+        self.engine = engine
+        self.root = root
+        self.glob = glob
+        self.progress = progress
+        self.embed_batch_size = embed_batch_size
+        self.counts = {"added": 0, "updated": 0, "skipped": 0, "removed": 0, "chunks": 0, "duplicates": 0}
+        self.seen = set()
+        # 各階段實際處理的累計秒數（不含佇列等待），供基準測試計算各階段吞吐量
+        self.stage_seconds = {"read": 0.0, "split": 0.0, "dedup": 0.0, "embed": 0.0, "write": 0.0}
+
+        self._read_q: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._split_q: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._dedup_q: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._embed_q: queue.Queue = queue.Queue(maxsize=2)
+        # 去重階段可能跑在寫入之前，同一次匯入中已切分但尚未寫入的子 chunk 以記憶體中的簽章比對
+        self._pending = SignatureSet(engine.deduplicator.max_distance, engine.deduplicator.min_jaccard) if engine.deduplicator is not None else None
+        self._stop = threading.Event()
+        self._errors: List[BaseException] = []
+
+    def run(self) -> Dict[str, int]:
+        """
+        功能: 啟動讀取、切分、去重（啟用時）、嵌入等背景階段，並在目前執行緒負責寫入；完成後清除已刪除的檔案。
+        參數:
+            無
+        回傳:
+            Dict[str, int]: 匯入計數。
+        """
+        stages = [(self._read, self._read_q), (self._split, self._split_q)]
+        if self._pending is not None:
+            stages.append((self._dedup, self._dedup_q))
+        stages.append((self._embed, self._embed_q))
+        threads = [
+            threading.Thread(target=self._run_stage, args=stage, name=f"ingest-{stage[0].__name__.strip('_')}", daemon=True)
+            for stage in stages
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for items, vectors in self._drain(self._embed_q):
+                start = time.perf_counter()
+                self._write(items, vectors)
+                self._record("write", start, len(vectors))
+        except BaseException as e:
+            self._errors.append(e)
+            self._stop.set()
+        for thread in threads:
+            thread.join()
+        if self._errors:
+            raise self._errors[0]
+
+        self._purge_removed()
+        return self.counts
+
+    # ---------- private ----------
+    def _record(self, stage: str, start: float, items: int = 1) -> None:
+        """
+        功能: 累計階段耗時，並記錄到引擎的 ingest.<stage> 延遲直方圖。
+        參數:
+            stage   (str): 階段名稱。
+            start (float): time.perf_counter() 的起始值。
+            items   (int): 處理的項目數。
+        回傳:
+            None
+        """
+        seconds = time.perf_counter() - start
+        self.stage_seconds[stage] += seconds
+        self.engine.metrics.record(f"ingest.{stage}", seconds, items)
+
+    def _run_stage(self, stage, out_q: queue.Queue) -> None:
+        """
+        功能: 執行單一階段，發生例外時通知其他階段停止；結束時送出結束標記。
+        參數:
+            stage  (Callable): 階段函式。
+            out_q (queue.Queue): 輸出佇列。
+        回傳:
+            None
+        """
+        try:
+            stage(out_q)
+        except BaseException as e:
+            self._errors.append(e)
+            self._stop.set()
+        finally:
+            self._put(out_q, _END)
+
+    def _put(self, q: queue.Queue, item) -> bool:
+        """
+        功能: 放入佇列；佇列滿時等待（背壓），管線停止時放棄。
+        參數:
+            q (queue.Queue): 佇列。
+            item           : 項目。
+        回傳:
+            bool: 是否成功放入。
+        """
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _drain(self, q: queue.Queue):
+        """
+        功能: 逐一取出佇列項目直到收到結束標記或管線停止。
+        參數:
+            q (queue.Queue): 佇列。
+        回傳:
+            Iterator: 佇列項目。
+        """
+        while not self._stop.is_set():
+            try:
+                item = q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is _END:
+                return
+            yield item
+
+    def _read(self, out_q: queue.Queue) -> None:
+        """
+        功能: 探索檔案並比對 manifest，只讀取新增或變更的檔案。
+        參數:
+            out_q (queue.Queue): 輸出佇列。
+        回傳:
+            None
+        """
+        manifest = self.engine.manifest
+        for file_path in pathlib.Path(self.root).glob(self.glob):
+            if self._stop.is_set():
+                return
+            start = time.perf_counter()
+            if not file_path.is_file():
+                continue
+            path = str(file_path)
+            self.seen.add(path)
+            stat = file_path.stat()
+            record = manifest.get(path)
+            # 大小與 mtime 皆相同時不讀檔，直接略過
+            if record and record["size"] == stat.st_size and record["mtime_ns"] == stat.st_mtime_ns:
+                self.counts["skipped"] += 1
+                self._record("read", start)
+                continue
+
+            data = file_path.read_bytes()
+            digest = hashlib.sha256(data).hexdigest()
+            if record and record["sha256"] == digest:
+                manifest.touch(path, stat.st_size, stat.st_mtime_ns)
+                self.counts["skipped"] += 1
+                self._record("read", start)
+                continue
+
+            item = {
+                "path": path,
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "sha256": digest,
+                "old": record,
+                "doc": Document(page_content=data.decode("utf-8"), metadata={"source": path}),
+            }
+            self._record("read", start)
+            self._put(out_q, item)
+
+    def _split(self, out_q: queue.Queue) -> None:
+        """
+        功能: 將父文件切分為子 chunk。
+        參數:
+            out_q (queue.Queue): 輸出佇列。
+        回傳:
+            None
+        """
+        for item in self._drain(self._read_q):
+            start = time.perf_counter()
+            item["children"] = self.engine.child_splitter.split_documents([item["doc"]])
+            self._record("split", start, len(item["children"]))
+            self._put(out_q, item)
+
+    def _dedup(self, out_q: queue.Queue) -> None:
+        """
+        功能: 計算每個子 chunk 的簽章，與知識庫及本次匯入中較早的子 chunk 比對；完全或近似重複者不再嵌入與寫入，
+              改為記錄引用（item["shared"] 為 (子 chunk, 既有主鍵或較早的子 chunk)）。
+        參數:
+            out_q (queue.Queue): 輸出佇列。
+        回傳:
+            None
+        """
+        deduplicator = self.engine.deduplicator
+        for item in self._drain(self._split_q):
+            start = time.perf_counter()
+            unique, signatures, shared = [], [], []
+            for child in item["children"]:
+                sig = signature(child.page_content)
+                # 先查尚未寫入者：寫入階段先登記持久化索引才移除記憶體中的簽章，兩者之間不會漏掉
+                target = self._pending.find(sig)
+                if target is None:
+                    target = deduplicator.find(sig)
+                if target is None:
+                    unique.append(child)
+                    signatures.append(sig)
+                    self._pending.add(sig, child)
+                else:
+                    shared.append((child, target))
+            item["children"], item["signatures"], item["shared"] = unique, signatures, shared
+            self._record("dedup", start, len(unique) + len(shared))
+            self._put(out_q, item)
+
+    def _embed(self, out_q: queue.Queue) -> None:
+        """
+        功能: 累積子 chunk 至 embed_batch_size 後一次批次嵌入；同一檔案的子 chunk 不會被拆到兩批。
+        參數:
+            out_q (queue.Queue): 輸出佇列。
+        回傳:
+            None
+        """
+        items, size = [], 0
+        for item in self._drain(self._dedup_q if self._pending is not None else self._split_q):
+            items.append(item)
+            size += len(item["children"])
+            if size >= self.embed_batch_size:
+                self._put(out_q, (items, self._embed_items(items)))
+                items, size = [], 0
+        if items and not self._stop.is_set():
+            self._put(out_q, (items, self._embed_items(items)))
+
+    def _embed_items(self, items: List[Dict]) -> List[List[float]]:
+        """
+        功能: 嵌入一批檔案的所有子 chunk。
+        參數:
+            items (List[Dict]): 檔案資訊。
+        回傳:
+            List[List[float]]: 依序對應的子 chunk 向量。
+        """
+        texts = [child.page_content for item in items for child in item["children"]]
+        self.engine.query_gate.yield_to_queries()
+        start = time.perf_counter()
+        vectors = self.engine.embeddings.embed_documents(texts) if texts else []
+        self._record("embed", start, len(texts))
+        return vectors
+
+    def _write(self, items: List[Dict], vectors: List[List[float]]) -> None:
+        """
+        功能: 寫入新版本、登記共用子 chunk 的引用後移除變更檔案的舊版本，並更新 manifest 與進度。
+        參數:
+            items       (List[Dict]): 檔案資訊。
+            vectors (List[List[float]]): 子 chunk 向量。
+        回傳:
+            None
+        """
+        ids = [self._parent_id(item) for item in items]
+        deduplicator = self.engine.deduplicator
+        child_docs, owners, signatures = [], [], []
+        for item, doc_id in zip(items, ids):
+            child_docs.extend(item["children"])
+            owners.extend([doc_id] * len(item["children"]))
+            signatures.extend(item.get("signatures", []))
+        with self.engine.lock.write():
+            self._drop_unrecorded(ids)
+
+        # 比對到的既有子 chunk 若在嵌入期間已被刪除（包含剛移除的中斷殘留），改為在此補嵌入並當作新的子 chunk 寫入
+        if deduplicator is not None:
+            live = deduplicator.known(
+                target for item in items for _, target in item["shared"] if not isinstance(target, Document)
+            )
+            revived = []
+            for item, doc_id in zip(items, ids):
+                kept = []
+                for child, target in item["shared"]:
+                    if isinstance(target, Document) or target in live:
+                        kept.append((child, target))
+                    else:
+                        revived.append((child, doc_id))
+                item["shared"] = kept
+            if revived:
+                vectors = list(vectors) + self.engine.embeddings.embed_documents([child.page_content for child, _ in revived])
+                child_docs.extend(child for child, _ in revived)
+                owners.extend(doc_id for _, doc_id in revived)
+                signatures.extend(signature(child.page_content) for child, _ in revived)
+
+        # 新版本的寫入與舊版本的刪除在同一個寫入鎖內完成，查詢不會看到檔案暫時消失；
+        # 先登記新版本對共用子 chunk 的引用再刪除舊版本，仍被引用的子 chunk 不會被刪除
+        with self.engine.lock.write():
+            mapping = self.engine._write(
+                [item["doc"] for item in items], ids, child_docs, owners, vectors,
+                signatures if deduplicator is not None else None,
+            )
+            if deduplicator is not None:
+                # 記下主鍵，供同一次匯入中較晚比對到這些子 chunk 的檔案登記引用
+                assigned = {doc_id: iter(mapping[doc_id]) for doc_id in ids}
+                for child, owner in zip(child_docs, owners):
+                    child.metadata["pk"] = next(assigned[owner])
+                refs = []
+                for item, doc_id in zip(items, ids):
+                    for child, target in item["shared"]:
+                        child_id = target.metadata["pk"] if isinstance(target, Document) else target
+                        if child_id not in mapping[doc_id]:
+                            mapping[doc_id].append(child_id)
+                            refs.append((child_id, doc_id))
+                    self.counts["duplicates"] += len(item["shared"])
+                deduplicator.add_refs(refs)
+            for item in items:
+                if item["old"]:
+                    self.engine.delete_documents([item["old"]["parent_id"]], item["old"]["child_ids"])
+                    self.counts["updated"] += 1
+                else:
+                    self.counts["added"] += 1
+        if self._pending is not None:
+            for sig in signatures:
+                self._pending.remove(sig)
+
+        start = time.perf_counter()
+        self.engine.manifest.upsert(
+            {
+                "path": item["path"],
+                "size": item["size"],
+                "mtime_ns": item["mtime_ns"],
+                "sha256": item["sha256"],
+                "parent_id": doc_id,
+                "child_ids": mapping[doc_id],
+            }
+            for item, doc_id in zip(items, ids)
+        )
+        self.engine.metrics.record("ingest.manifest", time.perf_counter() - start, len(items))
+        self.counts["chunks"] += len(child_docs)
+        logger.info(f"Ingest progress: {self.counts}")
+        if self.progress:
+            self.progress(dict(self.counts))
+
+    @staticmethod
+    def _parent_id(item: Dict) -> str:
+        """
+        功能: 由檔案路徑與內容雜湊決定父文件 ID；同一版本重新匯入時 ID 相同，可找出上次中斷留下的資料。
+        參數:
+            item (Dict): 檔案資訊。
+        回傳:
+            str: 父文件 ID。
+        """
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{item['path']}\0{item['sha256']}"))
+
+    def _drop_unrecorded(self, ids: List[str]) -> None:
+        """
+        功能: 刪除上次匯入已寫入知識庫、但在更新 manifest 前中斷而沒有紀錄的同一版本，避免重新匯入後重複。
+        參數:
+            ids (List[str]): 即將寫入的父文件 ID。
+        回傳:
+            None
+        """
+        engine = self.engine
+        child_ids = engine.keyword_index.children_of(ids)
+        if engine.deduplicator is not None:
+            child_ids = list(dict.fromkeys(child_ids + engine.deduplicator.children_of(ids)))
+        parents = [doc_id for doc_id, doc in zip(ids, engine.doc_store.mget(ids)) if doc is not None]
+        if parents or child_ids:
+            logger.info(f"Removing {len(parents)} parents left by an interrupted ingest before rewriting them")
+            engine.delete_documents(parents, child_ids)
+
+    def _purge_removed(self) -> None:
+        """
+        功能: 清除 manifest 中已不存在於目錄的檔案。
+        參數:
+            無
+        回傳:
+            None
+        """
+        manifest = self.engine.manifest
+        removed = [path for path in manifest.paths_under(self.root) if path not in self.seen]
+        for path in removed:
+            record = manifest.get(path)
+            self.engine.delete_documents([record["parent_id"]], record["child_ids"])
+        manifest.remove(removed)
+        self.counts["removed"] = len(removed)
+
+
+# ---------- 檢索微批次器 ----------
+class RetrieveBatcher:
+    def __init__(
+        self,
+        engine: ParentRAGEngine,
+        window_ms: float = RETRIEVE_BATCH_WINDOW_MS,
+        max_batch: int = RETRIEVE_BATCH_SIZE,
+        executor: Optional[Executor] = None,
+    ):
+        """
+        功能: 將短時間內同時到達的單一檢索請求合併成一批，以一次批次嵌入與搜尋處理。
+        參數:
+            engine (ParentRAGEngine): 檢索引擎。
+            window_ms        (float): 第一個請求到達後等待其他請求的時間（毫秒）。
+            max_batch          (int): 單批最大請求數。
+            executor      (Executor, optional): 執行批次的執行緒池，讓多個批次可同時進行；未提供時在收集執行緒上執行。
+        回傳:
+            None
+        """
+        self.engine = engine
+        self.executor = executor
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue: "queue.Queue[Tuple[str, Optional[int], str, Future]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, query: str, k: Optional[int] = None, search: str = RETRIEVE_SEARCH) -> Future:
+        """
+        功能: 送出一個檢索請求。
+        參數:
+            query  (str): 查詢字串。
+            k      (int, optional): 子 chunk 數量。
+            search (str): 'vector'、'keyword' 或 'hybrid'。
+        回傳:
+            Future: 完成後結果格式同 ParentRAGEngine.retrieve。
+        """
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="retrieve-batcher", daemon=True)
+                self._thread.start()
+        future: Future = Future()
+        self._queue.put((query, k, search, future))
+        return future
+
+    def _loop(self) -> None:
+        """
+        功能: 背景執行緒：收集一個時間窗內的請求後批次執行。
+        參數:
+            無
+        回傳:
+            None
+        """
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            if self.executor is not None:
+                self.executor.submit(self._run, batch)
+            else:
+                self._run(batch)
+
+    def _run(self, batch: List[Tuple[str, Optional[int], str, Future]]) -> None:
+        """
+        功能: 依 (k, search) 分組後呼叫 retrieve_many，並將結果或例外交回各自的 Future。
+        參數:
+            batch (List[Tuple[str, Optional[int], str, Future]]): 請求列表。
+        回傳:
+            None
+        """
+        groups: Dict[Tuple[Optional[int], str], List[Tuple[str, Future]]] = {}
+        for query, k, search, future in batch:
+            groups.setdefault((k, search), []).append((query, future))
+        for (k, search), items in groups.items():
+            try:
+                results = self.engine.retrieve_many([query for query, _ in items], k, search)
+            except Exception as e:
+                for _, future in items:
+                    future.set_exception(e)
+            else:
+                for (_, future), result in zip(items, results):
+                    future.set_result(result)
+
+
+# ---------- 延遲載入與背景暖機 ----------
+class LazyParentRAG:
+    def __init__(self, timeout: float = ENGINE_READY_TIMEOUT):
+        """
+        功能: 延遲建立 ParentRAGEngine，讓 MCP 伺服器不必等 embedding 模型與 Milvus 載入完成即可回應握手。
+        參數:
+            timeout (float): 工具等待引擎就緒的秒數上限。
+        回傳:
+            None
+        """
+        self.timeout = timeout
+        self.engine: Optional[ParentRAGEngine] = None
+        self.batcher: Optional[RetrieveBatcher] = None
+        self.error: Optional[BaseException] = None
+        self.load_seconds: Optional[float] = None
+        self.stats_dumper: Optional[JsonlDumper] = None
+        self._ready = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        # 各事件迴圈上等待載入完成的 asyncio.Event；等待不佔用執行緒，載入完成時由暖機執行緒喚醒
+        self._waiters: Dict[asyncio.AbstractEventLoop, asyncio.Event] = {}
+
+    def start(self) -> None:
+        """
+        功能: 在背景執行緒開始載入引擎（重複呼叫不會重複載入）。
+        參數:
+            無
+        回傳:
+            None
+        """
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._load, name="parentrag-warmup", daemon=True)
+                self._thread.start()
+
+    def _load(self) -> None:
+        """
+        功能: 建立引擎與檢索微批次器，完成或失敗後標記為就緒。
+        參數:
+            無
+        回傳:
+            None
+        """
+        start = time.perf_counter()
+        try:
+            self.engine = ParentRAGEngine()
+            self.batcher = RetrieveBatcher(self.engine, executor=Lanes.query)
+            if RAG_STATS_FILE:
+                self.stats_dumper = JsonlDumper(RAG_STATS_FILE, RAG_STATS_INTERVAL, self.engine.stats)
+                self.stats_dumper.start()
+            logger.info(f"ParentRAG engine ready in {time.perf_counter() - start:.2f}s")
+        except BaseException as e:
+            self.error = e
+            logger.exception("Failed to load ParentRAG engine")
+        finally:
+            self.load_seconds = time.perf_counter() - start
+            with self._start_lock:
+                self._ready.set()
+                waiters, self._waiters = self._waiters, {}
+            for loop, event in waiters.items():
+                if not loop.is_closed():
+                    loop.call_soon_threadsafe(event.set)
+
+    async def get(self) -> ParentRAGEngine:
+        """
+        功能: 等待引擎就緒後回傳；以事件迴圈上的 asyncio.Event 等待，不阻塞事件迴圈也不佔用執行緒池
+              （暖機期間同時到達的請求不會佔滿共用執行緒池，使其他伺服器的工具與查詢無法執行）。
+        參數:
+            無
+        回傳:
+            ParentRAGEngine: 檢索引擎。
+        """
+        self.start()
+        if not self._ready.is_set():
+            loop = asyncio.get_running_loop()
+            with self._start_lock:
+                event = None if self._ready.is_set() else self._waiters.setdefault(loop, asyncio.Event())
+            if event is not None:
+                try:
+                    await asyncio.wait_for(event.wait(), self.timeout)
+                except asyncio.TimeoutError:
+                    pass
+        return self._result()
+
+    def wait(self) -> ParentRAGEngine:
+        """
+        功能: 同步等待引擎就緒後回傳，供背景工作在執行緒中使用。
+        參數:
+            無
+        回傳:
+            ParentRAGEngine: 檢索引擎。
+        """
+        self.start()
+        self._ready.wait(self.timeout)
+        return self._result()
+
+    def _result(self) -> ParentRAGEngine:
+        """
+        功能: 回傳已載入的引擎，載入失敗或逾時則拋出例外。
+        參數:
+            無
+        回傳:
+            ParentRAGEngine: 檢索引擎。
+        """
+        if self.error is not None:
+            raise RuntimeError(f"知識庫引擎載入失敗: {self.error}")
+        if self.engine is None:
+            raise TimeoutError(f"知識庫引擎在 {self.timeout} 秒內未完成載入")
+        return self.engine
+
+    def status(self) -> Dict:
+        """
+        功能: 回傳載入狀態。
+        參數:
+            無
+        回傳:
+            Dict: ready / loading / error / load_seconds。
+        """
+        return {
+            "ready": self.engine is not None,
+            "loading": self._thread is not None and not self._ready.is_set(),
+            "error": str(self.error) if self.error is not None else None,
+            "load_seconds": round(self.load_seconds, 3) if self.load_seconds is not None else None,
+        }
+
+
+from mcp.server.fastmcp import FastMCP, Context
+import os
+
+mcp = FastMCP("ParentRAG")
+
+# 查詢與匯入分別使用各自的執行緒池，長時間匯入時查詢仍可即時回應
+Lanes = ExecutorLanes(RAG_QUERY_WORKERS, RAG_INGEST_WORKERS)
+Jobs = JobRegistry()
+ParentRAG = LazyParentRAG()
+
+@mcp.tool(description="從指定目錄添加文件到知識庫")
+async def add_documents(directory_path: str = None, ctx: Context = None):
+    """
+    功能: 從指定目錄增量匯入txt文件到ParentRAG知識庫，只處理新增或變更的檔案並清除已刪除的檔案
+    參數: 
+        directory_path (str, optional): 文件目錄路徑，默認使用環境變數DOCUMENT_PATH
+        ctx        (Context, optional): MCP 請求上下文，用於回報匯入進度
+    回傳:
+        dict: 包含 added/updated/skipped/removed 數量和狀態信息
+    """
+    logger.info(f"Called add_documents with args: directory_path={directory_path}")
+    document_path, error = _check_directory(directory_path)
+    if error:
+        return error
+
+    try:
+        loop = asyncio.get_running_loop()
+
+        def report(counts):
+            if ctx is not None:
+                done = counts["added"] + counts["updated"] + counts["skipped"]
+                asyncio.run_coroutine_threadsafe(ctx.report_progress(done), loop)
+
+        engine = await ParentRAG.get()
+        counts = await Lanes.run(Lanes.ingest, engine.ingest_directory, document_path, "**/*.txt", report)
+        return _summarize_ingest(document_path, counts)
+
+    except Exception as e:
+        return {"status": "error", "message": f"添加文件時發生錯誤: {str(e)}", "count": 0}
+
+def _check_directory(directory_path: Optional[str]) -> Tuple[Optional[str], Optional[Dict]]:
+    """
+    功能: 決定要匯入的目錄並檢查是否存在
+    參數:
+        directory_path (str, optional): 文件目錄路徑，默認使用環境變數DOCUMENT_PATH
+    回傳:
+        tuple: (目錄路徑, 錯誤回應)，檢查通過時錯誤回應為 None
+    """
+    # 使用提供的路徑或環境變數
+    document_path = directory_path or DOCUMENT_PATH
+
+    # 檢查路徑是否存在且為目錄
+    if not document_path:
+        return None, {"status": "error", "message": "未提供文件路徑，請指定路徑或設置MARKITDOWN_OUTPUT_PATH環境變數"}
+
+    if not os.path.exists(document_path):
+        return None, {"status": "error", "message": f"路徑不存在: {document_path}"}
+
+    if not os.path.isdir(document_path):
+        return None, {"status": "error", "message": f"{document_path} 不是有效目錄"}
+    return document_path, None
+
+def _summarize_ingest(document_path: str, counts: Dict[str, int]) -> Dict:
+    """
+    功能: 將匯入計數整理成工具回應
+    參數:
+        document_path (str): 文件目錄路徑
+        counts       (dict): ParentRAGEngine.ingest_directory 的計數
+    回傳:
+        dict: 包含 added/updated/skipped/removed 數量和狀態信息
+    """
+    changed = counts["added"] + counts["updated"]
+    if changed == 0 and counts["skipped"] == 0 and counts["removed"] == 0:
+        return {"status": "warning", "message": f"在 {document_path} 中未找到txt文件", "count": 0, **counts}
+
+    return {
+        "status": "success",
+        "message": (
+            f"新增 {counts['added']} 個、更新 {counts['updated']} 個、"
+            f"略過 {counts['skipped']} 個未變更、移除 {counts['removed']} 個已刪除的文件"
+        ),
+        "count": changed,
+        **counts,
+    }
+
+@mcp.tool(description="在背景開始從指定目錄匯入文件，立即回傳 job_id，之後以 get_job_status 查詢進度；匯入期間仍可正常檢索")
+async def start_add_documents(directory_path: str = None):
+    """
+    功能: 以背景工作增量匯入目錄，不等待完成
+    參數:
+        directory_path (str, optional): 文件目錄路徑，默認使用環境變數DOCUMENT_PATH
+    回傳:
+        dict: job_id 與狀態
+    """
+    logger.info(f"Called start_add_documents with args: directory_path={directory_path}")
+    document_path, error = _check_directory(directory_path)
+    if error:
+        return error
+
+    def ingest(path: str, progress) -> Dict:
+        counts = ParentRAG.wait().ingest_directory(path, progress=progress)
+        return _summarize_ingest(path, counts)
+
+    job_id = Jobs.submit(Lanes.ingest, "add_documents", ingest, document_path)
+    return {"status": "success", "job_id": job_id, "message": f"已開始匯入 {document_path}"}
+
+@mcp.tool(description=(
+    "從知識庫刪除文件：source 為來源檔案或目錄路徑（目錄會刪除其下所有已匯入檔案），ids 為父文件 ID 列表；"
+    "刪除後碎片比例超過門檻時會在背景自動執行 compact"
+))
+async def delete_documents(source: str = None, ids: List[str] = None):
+    """
+    功能: 依來源路徑或父文件 ID 刪除父文件與其子 chunk
+    參數:
+        source    (str, optional): 來源檔案或目錄路徑
+        ids (List[str], optional): 父文件 ID 列表
+    回傳:
+        dict: 刪除數量、碎片比例，以及自動 compact 的 job_id（若有）
+    """
+    logger.info(f"Called delete_documents with args: source={source}, ids={ids}")
+    if not source and not ids:
+        return {"status": "error", "message": "請提供 source 或 ids"}
+    try:
+        engine = await ParentRAG.get()
+        counts = await Lanes.run(Lanes.ingest, engine.remove_documents, [source] if source else None, ids)
+    except Exception as e:
+        return {"status": "error", "message": f"刪除文件時發生錯誤: {str(e)}"}
+    if counts["parents"] == 0 and counts["children"] == 0:
+        return {"status": "warning", "message": "找不到符合的文件", **counts}
+
+    response = {
+        "status": "success",
+        "message": f"已刪除 {counts['parents']} 個父文件與 {counts['children']} 個子 chunk",
+        **counts,
+        "fragmentation": round(engine.fragmentation(), 4),
+    }
+    if response["fragmentation"] >= COMPACT_FRAGMENTATION_THRESHOLD:
+        response["compact_job_id"] = Jobs.submit(Lanes.ingest, "compact", lambda progress: engine.compact())
+    return response
+
+@mcp.tool(description="壓縮知識庫以回收已刪除文件佔用的磁碟空間；碎片比例超過門檻或 force=true 時重建向量索引")
+async def compact(force: bool = False):
+    """
+    功能: 壓縮 docstore 與 BM25 索引，必要時重建向量索引
+    參數:
+        force (bool): 不論碎片比例皆重建向量索引
+    回傳:
+        dict: 各儲存壓縮前後的大小與是否重建索引
+    """
+    logger.info(f"Called compact with args: force={force}")
+    try:
+        engine = await ParentRAG.get()
+        report = await Lanes.run(Lanes.ingest, engine.compact, force)
+    except Exception as e:
+        return {"status": "error", "message": f"壓縮知識庫時發生錯誤: {str(e)}"}
+    return {"status": "success", **report}
+
+@mcp.tool(description="查詢背景工作的 state 與進度（queued / running / succeeded / failed）；未提供 job_id 時列出所有工作")
+def get_job_status(job_id: str = None):
+    """
+    功能: 回傳背景工作的狀態、進度、結果或錯誤
+    參數:
+        job_id (str, optional): 工作 ID
+    回傳:
+        dict: 工作狀態
+    """
+    logger.info(f"Called get_job_status with args: job_id={job_id}")
+    if job_id is None:
+        return {"status": "success", "jobs": Jobs.list()}
+    job = Jobs.get(job_id)
+    if job is None:
+        return {"status": "error", "message": f"找不到工作: {job_id}"}
+    return {"status": "success", **job}
+
+RETRIEVE_MODES = ("parent", "child", "both", "snippet")
+
+def _format_retrieve_result(
+    result: Dict[str, List[Document]], mode: str, max_chars: int = None, max_tokens: int = None
+) -> Dict:
+    """
+    功能: 依 mode 組出檢索工具的回傳內容
+    參數:
+        result     (dict): ParentRAGEngine.retrieve 的結果
+        mode        (str): 'parent'、'child'、'both' 或 'snippet'
+        max_chars   (int, optional): snippet 模式的字元預算，與 max_tokens 皆未指定時使用 SNIPPET_MAX_CHARS
+        max_tokens  (int, optional): snippet 模式的 token 預算（估算值）
+    回傳:
+        dict: 檢索結果
+    """
+    if mode == "snippet":
+        if max_chars is None and max_tokens is None:
+            max_chars = SNIPPET_MAX_CHARS
+        snippets = build_snippets(
+            list(zip(result["parent_ids"], result["parent_documents"])),
+            result["child_documents"],
+            ParentRAG.engine.retriever.id_key,
+            context_chars=SNIPPET_CONTEXT_CHARS,
+            max_chars=max_chars,
+            max_tokens=max_tokens,
+        )
+        documents = snippets.pop("snippets")
+        count = sum(len(document["snippets"]) for document in documents)
+        return {"documents": documents, "count": count, **snippets}
+
+    response = {}
+    if mode in ("parent", "both"):
+        response["documents"] = result["parent_documents"]
+        response["count"] = len(result["parent_documents"])
+    if mode in ("child", "both"):
+        response["child_documents"] = result["child_documents"]
+        response["child_count"] = len(result["child_documents"])
+    return response
+
+@mcp.tool(description=(
+    "使用查詢語句從知識庫中檢索相關文件，mode 可選 parent（父文件）、child（子 chunk）、both 或 "
+    "snippet（只回傳命中段落前後的片段與偏移量，受 max_chars / max_tokens 預算限制，需要全文時再呼叫 get_parent_document）；"
+    "search 可選 vector（語意）、keyword（BM25 關鍵字，適合料號、識別碼與專有名詞）或 hybrid（兩者融合）"
+))
+async def retrieve(
+    query: str, mode: str = "parent", search: str = RETRIEVE_SEARCH, max_chars: int = None, max_tokens: int = None
+):
+    """
+    功能: 根據查詢字串從知識庫中檢索相關文件；同時到達的請求會被合併成一批處理
+    參數:
+        query      (str): 查詢字串
+        mode       (str): 'parent' 回傳父文件、'child' 回傳子 chunk 與分數、'both' 兩者皆回傳、
+                          'snippet' 回傳每個父文件中命中段落的視窗（重疊者合併）與來源路徑、偏移量
+        search     (str): 'vector'、'keyword' 或 'hybrid'
+        max_chars  (int, optional): snippet 模式的字元預算
+        max_tokens (int, optional): snippet 模式的 token 預算（估算值）
+    回傳:
+        dict: 包含檢索結果的字典
+    """
+    logger.info(f"Called retrieve with args: query={query}, mode={mode}, search={search}")
+    if not query or not query.strip():
+        return {"status": "error", "message": "查詢字串不能為空"}
+    if mode not in RETRIEVE_MODES:
+        return {"status": "error", "message": f"不支援的 mode: {mode}，請使用 parent、child、both 或 snippet"}
+    if search not in SEARCH_MODES:
+        return {"status": "error", "message": f"不支援的 search: {search}，請使用 vector、keyword 或 hybrid"}
+    
+    try:
+        engine = await ParentRAG.get()
+        result = await asyncio.wrap_future(ParentRAG.batcher.submit(query, search=search))
+        with engine.metrics.time("tool.format"):
+            return {"status": "success", **_format_retrieve_result(result, mode, max_chars, max_tokens)}
+    except Exception as e:
+        return {"status": "error", "message": f"檢索過程中發生錯誤: {str(e)}"}
+
+@mcp.tool(description="一次使用多個查詢語句從知識庫中檢索相關文件（批次嵌入與搜尋，比逐一呼叫 retrieve 更快）")
+async def retrieve_many(
+    queries: List[str],
+    k: int = None,
+    mode: str = "parent",
+    search: str = RETRIEVE_SEARCH,
+    max_chars: int = None,
+    max_tokens: int = None,
+):
+    """
+    功能: 批次檢索多個查詢字串
+    參數:
+        queries (List[str]): 查詢字串列表
+        k       (int, optional): 每個查詢的子 chunk 數量，默認使用環境變數TOP_K
+        mode    (str): 'parent'、'child'、'both' 或 'snippet'
+        search  (str): 'vector'、'keyword' 或 'hybrid'
+        max_chars  (int, optional): snippet 模式下每個查詢的字元預算
+        max_tokens (int, optional): snippet 模式下每個查詢的 token 預算（估算值）
+    回傳:
+        dict: results 為與 queries 順序對應的檢索結果列表
+    """
+    logger.info(f"Called retrieve_many with args: queries={queries}, k={k}, mode={mode}, search={search}")
+    queries = [query for query in queries if query and query.strip()]
+    if not queries:
+        return {"status": "error", "message": "查詢字串不能為空"}
+    if mode not in RETRIEVE_MODES:
+        return {"status": "error", "message": f"不支援的 mode: {mode}，請使用 parent、child、both 或 snippet"}
+    if search not in SEARCH_MODES:
+        return {"status": "error", "message": f"不支援的 search: {search}，請使用 vector、keyword 或 hybrid"}
+
+    try:
+        engine = await ParentRAG.get()
+        results = await Lanes.run(Lanes.query, engine.retrieve_many, queries, k, search)
+        with engine.metrics.time("tool.format", len(queries)):
+            return {
+                "status": "success",
+                "results": [
+                    {"query": query, **_format_retrieve_result(result, mode, max_chars, max_tokens)}
+                    for query, result in zip(queries, results)
+                ],
+            }
+    except Exception as e:
+        return {"status": "error", "message": f"檢索過程中發生錯誤: {str(e)}"}
+    
+@mcp.tool(description="依 retrieve snippet 模式回傳的 parent_id 取回父文件全文，可用 start / end 只讀取部分內容")
+async def get_parent_document(parent_id: str, start: int = 0, end: int = None):
+    """
+    功能: 取回父文件內容（可指定偏移量區間）
+    參數:
+        parent_id (str): 父文件 ID
+        start     (int): 起始偏移量，不可為負數
+        end       (int, optional): 結束偏移量（需大於 start），默認到文件結尾
+    回傳:
+        dict: 父文件內容、來源與總長度
+    """
+    logger.info(f"Called get_parent_document with args: parent_id={parent_id}, start={start}, end={end}")
+    if start < 0:
+        return {"status": "error", "message": f"start 不能為負數: {start}"}
+    if end is not None and end <= start:
+        return {"status": "error", "message": f"end 必須大於 start: start={start}, end={end}"}
+    try:
+        engine = await ParentRAG.get()
+        parent = await Lanes.run(Lanes.query, engine.get_parent, parent_id)
+    except Exception as e:
+        return {"status": "error", "message": f"讀取父文件時發生錯誤: {str(e)}"}
+    if parent is None:
+        return {"status": "error", "message": f"找不到父文件: {parent_id}"}
+    return {
+        "status": "success",
+        "parent_id": parent_id,
+        "source": parent.metadata.get("source"),
+        "length": len(parent.page_content),
+        "start": start,
+        "end": len(parent.page_content) if end is None else min(end, len(parent.page_content)),
+        "text": parent.page_content[start:end],
+    }
+
+@mcp.tool(description=(
+    "查看知識庫各階段（query.embed / query.search / query.mget / ingest.split / ingest.insert / ingest.persist 等）"
+    "的延遲分布、集合大小（含去重後的子 chunk 引用數）與檢索結果、父文件、embedding 快取的命中統計，"
+    "用於判斷檢索或匯入慢在哪個階段；reset=true 時讀取後清除延遲統計"
+))
+async def rag_stats(reset: bool = False):
+    """
+    功能: 回傳各階段的延遲直方圖（p50/p95/p99 與分桶）、集合大小、快取統計與背景工作數量；
+          有設定 RAG_STATS_FILE 時同時追加一行到該檔案
+    參數:
+        reset (bool): 讀取後清除延遲統計，方便量測下一段時間
+    回傳:
+        dict: 統計結果
+    """
+    logger.info(f"Called rag_stats with args: reset={reset}")
+    try:
+        engine = await ParentRAG.get()
+        stats = await Lanes.run(Lanes.query, engine.stats)
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+    jobs = Jobs.list()
+    stats["jobs"] = {state: sum(1 for job in jobs if job["state"] == state) for state in ("queued", "running", "failed")}
+    if ParentRAG.stats_dumper is not None:
+        ParentRAG.stats_dumper.dump()
+    if reset:
+        engine.metrics.reset()
+    return {"status": "success", **stats}
+
+@mcp.tool(description="查看知識庫引擎是否已載入完成（不會等待載入）")
+def rag_health():
+    """
+    功能: 回傳知識庫引擎的就緒狀態，供用戶端在檢索前確認
+    參數:
+        無
+    回傳:
+        dict: ready / loading / error / load_seconds
+    """
+    logger.info("Called rag_health")
+    return {"status": "success", **ParentRAG.status()}
+
+if __name__ == "__main__":
+    # 先在背景載入引擎，握手不必等待模型與向量資料庫
+    ParentRAG.start()
     mcp.run(transport="stdio")
\ No newline at end of file
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+import json
+import re
+import sqlite3
+import threading
+import unicodedata
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+_CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+_TOKEN_RE = re.compile(rf"[{_CJK}]+|[0-9a-z]+(?:[-_./:][0-9a-z]+)*")
+_CJK_RE = re.compile(rf"[{_CJK}]")
+_SEPARATOR_RE = re.compile(r"[-_./:]")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    功能: CJK 感知的斷詞：中日韓文字以重疊的二字詞（bigram）切分，與子文件分割器以「。」「，」斷句相容；
+          英數識別字（料號、型號）保留各段並額外產生去除分隔符號的完整形式，例如 AB-1234 -> ab, 1234, ab1234。
+    參數:
+        text (str): 原始文字。
+    回傳:
+        List[str]: 詞彙列表。
+    """
+    tokens = []
+    for match in _TOKEN_RE.finditer(unicodedata.normalize("NFKC", text).lower()):
+        run = match.group()
+        if _CJK_RE.match(run):
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            parts = _SEPARATOR_RE.split(run)
+            tokens.extend(parts)
+            if len(parts) > 1:
+                tokens.append("".join(parts))
+    return tokens
+
+
+# ---------- 子 chunk 的持久化倒排索引 ----------
+class BM25Index:
+    def __init__(self, db_path: str):
+        """
+        功能: 初始化以 SQLite FTS5 儲存的倒排索引，文字先經 tokenize 斷詞再寫入，排序使用 FTS5 內建的 BM25。
+        參數:
+            db_path (str): SQLite 檔案路徑。
+        回傳:
+            None
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS chunks (
+                child_id  INTEGER PRIMARY KEY,
+                parent_id TEXT NOT NULL,
+                text      TEXT NOT NULL,
+                metadata  TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS chunks_parent ON chunks(parent_id);
+            CREATE VIRTUAL TABLE IF NOT EXISTS chunk_terms USING fts5(tokens, tokenize = "unicode61 remove_diacritics 0");
+            """
+        )
+        self._conn.commit()
+
+    def add(self, child_ids: Sequence[int], docs: Sequence[Document], id_key: str) -> None:
+        """
+        功能: 將子 chunk 加入索引。
+        參數:
+            child_ids (Sequence[int]): 子 chunk 在向量資料庫中的主鍵。
+            docs (Sequence[Document]): 子 chunk。
+            id_key              (str): metadata 中父文件 ID 的欄位名稱。
+        回傳:
+            None
+        """
+        rows = [
+            (int(child_id), doc.metadata.get(id_key, ""), doc.page_content, json.dumps(doc.metadata, ensure_ascii=False))
+            for child_id, doc in zip(child_ids, docs)
+        ]
+        terms = [(row[0], " ".join(tokenize(row[2]))) for row in rows]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?)", rows)
+            self._conn.executemany("DELETE FROM chunk_terms WHERE rowid = ?", [(row[0],) for row in rows])
+            self._conn.executemany("INSERT INTO chunk_terms(rowid, tokens) VALUES (?, ?)", terms)
+            self._conn.commit()
+
+    def delete(self, child_ids: Iterable[int]) -> None:
+        """
+        功能: 從索引刪除子 chunk。
+        參數:
+            child_ids (Iterable[int]): 子 chunk 主鍵。
+        回傳:
+            None
+        """
+        rows = [(int(child_id),) for child_id in child_ids]
+        with self._lock:
+            self._conn.executemany("DELETE FROM chunks WHERE child_id = ?", rows)
+            self._conn.executemany("DELETE FROM chunk_terms WHERE rowid = ?", rows)
+            self._conn.commit()
+
+    def search(self, query: str, k: int) -> List[Document]:
+        """
+        功能: 以 BM25 搜尋子 chunk，任一詞彙命中即列為候選。
+        參數:
+            query (str): 查詢字串。
+            k     (int): 回傳數量。
+        回傳:
+            List[Document]: 子 chunk（metadata 含 pk 與 bm25_score，分數越高越相關）。
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        match = " OR ".join(f'"{term}"' for term in terms)
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT c.child_id, c.text, c.metadata, bm25(chunk_terms) AS score
+                FROM chunk_terms JOIN chunks c ON c.child_id = chunk_terms.rowid
+                WHERE chunk_terms MATCH ?
+                ORDER BY score LIMIT ?
+                """,
+                (match, k),
+            ).fetchall()
+        docs = []
+        for child_id, text, metadata, score in rows:
+            metadata = json.loads(metadata)
+            metadata.update({"pk": child_id, "bm25_score": -score})
+            docs.append(Document(page_content=text, metadata=metadata))
+        return docs
+
+    def get(self, child_ids: Sequence[int]) -> Dict[int, Document]:
+        """
+        功能: 依主鍵取回子 chunk 內容；向量改存於量化向量儲存時，以此表作為子 chunk 的文字來源。
+        參數:
+            child_ids (Sequence[int]): 子 chunk 主鍵。
+        回傳:
+            Dict[int, Document]: 主鍵 -> 子 chunk（metadata 含 pk），不存在的主鍵不會出現。
+        """
+        ids = [int(child_id) for child_id in child_ids]
+        rows = []
+        # 分批查詢，避免超過 SQLite 的參數數量上限
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            with self._lock:
+                rows.extend(self._conn.execute(
+                    f"SELECT child_id, text, metadata FROM chunks WHERE child_id IN ({placeholders})", batch
+                ).fetchall())
+        docs = {}
+        for child_id, text, metadata in rows:
+            metadata = json.loads(metadata)
+            metadata["pk"] = child_id
+            docs[child_id] = Document(page_content=text, metadata=metadata)
+        return docs
+
+    def child_ids(self) -> List[int]:
+        """
+        功能: 列出所有子 chunk 主鍵。
+        參數:
+            無
+        回傳:
+            List[int]: 子 chunk 主鍵。
+        """
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT child_id FROM chunks").fetchall()]
+
+    def children_of(self, parent_ids: Iterable[str]) -> List[int]:
+        """
+        功能: 列出指定父文件的所有子 chunk 主鍵。
+        參數:
+            parent_ids (Iterable[str]): 父文件 ID。
+        回傳:
+            List[int]: 子 chunk 主鍵。
+        """
+        with self._lock:
+            return [
+                row[0] for parent_id in parent_ids
+                for row in self._conn.execute("SELECT child_id FROM chunks WHERE parent_id = ?", (parent_id,)).fetchall()
+            ]
+
+    def optimize(self) -> None:
+        """
+        功能: 合併 FTS5 的索引區段並 VACUUM，回收刪除後留下的空間。
+        參數:
+            無
+        回傳:
+            None
+        """
+        with self._lock:
+            self._conn.execute("INSERT INTO chunk_terms(chunk_terms) VALUES ('optimize')")
+            self._conn.commit()
+            self._conn.execute("VACUUM")
+
+    def count(self) -> int:
+        """
+        功能: 回傳索引中的子 chunk 數量。
+        參數:
+            無
+        回傳:
+            int: 數量。
+        """
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+
+def reciprocal_rank_fusion(ranked_lists: Sequence[Sequence[Document]], k: int, rrf_k: int = 60) -> List[Document]:
+    """
+    功能: 以倒數排名融合（RRF）合併多個排序結果，同一子 chunk 以 metadata 的 pk 識別。
+    參數:
+        ranked_lists (Sequence[Sequence[Document]]): 各檢索方式的排序結果。
+        k     (int): 回傳數量。
+        rrf_k (int): RRF 平滑常數。
+    回傳:
+        List[Document]: 融合後的子 chunk（metadata 含 rrf_score）。
+    """
+    scores: Dict[int, float] = {}
+    docs: Dict[int, Document] = {}
+    for ranked in ranked_lists:
+        for rank, doc in enumerate(ranked):
+            key = doc.metadata["pk"]
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank + 1)
+            if key in docs:
+                docs[key].metadata.update({k_: v for k_, v in doc.metadata.items() if k_ not in docs[key].metadata})
+            else:
+                docs[key] = doc
+    fused: List[Tuple[int, float]] = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+    results = []
+    for key, score in fused:
+        docs[key].metadata["rrf_score"] = score
+        results.append(docs[key])
+    return results
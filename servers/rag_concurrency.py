@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+import asyncio
+import threading
+import time
+import uuid
+import logging
+from collections import OrderedDict
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+# ---------- 讀寫鎖 ----------
+class ReadWriteLock:
+    def __init__(self):
+        """
+        功能: 多個讀取者可同時持有、寫入者獨占的鎖；寫入者優先，避免持續的查詢讓寫入餓死。
+              寫入鎖可由同一執行緒重入（例如先刪除舊版本再寫入新版本的整段操作）。
+        參數:
+            無
+        回傳:
+            None
+        """
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer: Optional[int] = None
+        self._write_depth = 0
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        """
+        功能: 取得讀取鎖；持有寫入鎖的執行緒可直接讀取。
+        參數:
+            無
+        回傳:
+            ContextManager
+        """
+        if self._writer == threading.get_ident():
+            yield
+            return
+        with self._cond:
+            while self._writer is not None or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        """
+        功能: 取得寫入鎖，等待進行中的讀取結束。
+        參數:
+            無
+        回傳:
+            ContextManager
+        """
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._write_depth += 1
+            else:
+                self._waiting_writers += 1
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+                self._waiting_writers -= 1
+                self._writer = me
+                self._write_depth = 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._write_depth -= 1
+                if self._write_depth == 0:
+                    self._writer = None
+                    self._cond.notify_all()
+
+
+# ---------- 查詢優先 ----------
+class QueryGate:
+    def __init__(self, max_yield: float = 1.0):
+        """
+        功能: 記錄進行中的查詢數量；匯入在每批嵌入前先讓路給查詢，避免兩者搶 CPU 使查詢延遲不穩定。
+        參數:
+            max_yield (float): 匯入每次最多等待的秒數，避免持續查詢讓匯入完全停擺。
+        回傳:
+            None
+        """
+        self.max_yield = max_yield
+        self._cond = threading.Condition()
+        self._active = 0
+
+    @contextmanager
+    def active(self):
+        """
+        功能: 標記一個查詢進行中。
+        參數:
+            無
+        回傳:
+            ContextManager
+        """
+        with self._cond:
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                if self._active == 0:
+                    self._cond.notify_all()
+
+    def yield_to_queries(self) -> None:
+        """
+        功能: 有查詢進行中時等待其完成（最多 max_yield 秒）。
+        參數:
+            無
+        回傳:
+            None
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._active == 0, timeout=self.max_yield)
+
+
+# ---------- 執行緒池分道 ----------
+class ExecutorLanes:
+    def __init__(self, query_workers: int = 4, ingest_workers: int = 1):
+        """
+        功能: 查詢與匯入使用各自的執行緒池，長時間的匯入不會佔住查詢的執行緒。
+        參數:
+            query_workers  (int): 查詢執行緒數。
+            ingest_workers (int): 匯入執行緒數；為 1 時匯入工作依序執行。
+        回傳:
+            None
+        """
+        self.query = ThreadPoolExecutor(max_workers=query_workers, thread_name_prefix="rag-query")
+        self.ingest = ThreadPoolExecutor(max_workers=ingest_workers, thread_name_prefix="rag-ingest")
+
+    async def run(self, executor: Executor, fn: Callable, *args):
+        """
+        功能: 在指定的執行緒池執行同步函式並等待結果（不阻塞事件迴圈）。
+        參數:
+            executor (Executor): 執行緒池。
+            fn       (Callable): 同步函式。
+            *args:             位置參數。
+        回傳:
+            fn 的回傳值。
+        """
+        return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+
+    def share_query(self, executor: ThreadPoolExecutor) -> None:
+        """
+        功能: 改用外部共用的執行緒池處理查詢（例如多個伺服器掛在同一個行程時），原本的查詢執行緒池關閉；匯入仍使用自己的執行緒池。
+        參數:
+            executor (ThreadPoolExecutor): 共用執行緒池。
+        回傳:
+            None
+        """
+        previous, self.query = self.query, executor
+        if previous is not executor:
+            previous.shutdown(wait=False)
+
+
+# ---------- 背景工作 ----------
+class JobRegistry:
+    def __init__(self, max_finished: int = 100):
+        """
+        功能: 追蹤背景工作的狀態，供用戶端啟動後輪詢。
+        參數:
+            max_finished (int): 保留的已結束工作數量上限，超過時移除最舊者。
+        回傳:
+            None
+        """
+        self.max_finished = max_finished
+        self._lock = threading.Lock()
+        self._jobs: "OrderedDict[str, Dict]" = OrderedDict()
+
+    def submit(self, executor: Executor, kind: str, fn: Callable, *args) -> str:
+        """
+        功能: 在執行緒池中啟動工作；fn 的最後一個參數為進度回呼，以目前進度字典呼叫。
+        參數:
+            executor (Executor): 執行緒池。
+            kind          (str): 工作類型。
+            fn       (Callable): 工作函式。
+            *args:             fn 的位置參數（不含進度回呼）。
+        回傳:
+            str: 工作 ID。
+        """
+        job_id = uuid.uuid4().hex[:12]
+        job = {
+            "job_id": job_id,
+            "kind": kind,
+            "state": "queued",
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "progress": None,
+            "result": None,
+            "error": None,
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            self._prune()
+
+        def progress(value: Dict) -> None:
+            job["progress"] = value
+
+        def run() -> None:
+            job["state"] = "running"
+            job["started_at"] = time.time()
+            try:
+                job["result"] = fn(*args, progress)
+                job["state"] = "succeeded"
+            except Exception as e:
+                logger.exception(f"Background job {job_id} ({kind}) failed")
+                job["error"] = str(e)
+                job["state"] = "failed"
+            finally:
+                job["finished_at"] = time.time()
+
+        executor.submit(run)
+        return job_id
+
+    def _prune(self) -> None:
+        """
+        功能: 移除最舊的已結束工作。
+        參數:
+            無
+        回傳:
+            None
+        """
+        finished = [job_id for job_id, job in self._jobs.items() if job["finished_at"] is not None]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """
+        功能: 取得工作狀態。
+        參數:
+            job_id (str): 工作 ID。
+        回傳:
+            Optional[Dict]: 工作狀態的副本，不存在時為 None。
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def list(self) -> List[Dict]:
+        """
+        功能: 列出所有保留中的工作。
+        參數:
+            無
+        回傳:
+            List[Dict]: 工作狀態列表（由舊到新）。
+        """
+        with self._lock:
+            return [dict(job) for job in self._jobs.values()]
@@ -0,0 +1,432 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+import hashlib
+import sqlite3
+import threading
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+
+import re
+
+import numpy as np
+from langchain_core.documents import Document
+
+from rag_bm25 import tokenize
+from rag_embedding_cache import normalize_text
+
+_BANDS = 4
+_BAND_BITS = 64 // _BANDS
+_MIN_TOKENS = 8  # 相異詞彙太少時 SimHash 不可靠，只做完全相同的比對
+_SHINGLE = 3  # SimHash 以連續 3 個詞彙為一個特徵
+
+# (正規化文字的雜湊, SimHash 或 None, 相異詞彙集合)
+Signature = Tuple[str, Optional[int], FrozenSet[str]]
+
+_DIGIT_RE = re.compile(r"[0-9]")
+
+
+def _to_signed(value: int) -> int:
+    """
+    功能: 將 64 位元無號整數轉為 SQLite 可儲存的有號整數。
+    參數:
+        value (int): 無號整數。
+    回傳:
+        int: 有號整數。
+    """
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def shingles(tokens: Sequence[str]) -> FrozenSet[str]:
+    """
+    功能: 將詞彙列表轉成不重複的連續詞組（shingle），保留詞序資訊。
+    參數:
+        tokens (Sequence[str]): 詞彙列表。
+    回傳:
+        FrozenSet[str]: 不重複的詞組。
+    """
+    if len(tokens) <= _SHINGLE:
+        return frozenset([" ".join(tokens)]) if tokens else frozenset()
+    return frozenset(" ".join(tokens[i:i + _SHINGLE]) for i in range(len(tokens) - _SHINGLE + 1))
+
+
+def simhash(features: Iterable[str]) -> int:
+    """
+    功能: 計算 64 位元 SimHash：每個特徵雜湊後依位元投票，每個特徵只投一票。
+          特徵必須不重複，否則表格分隔線、重複的欄位名稱等大量重複的詞彙會主導投票，使內容不同的 chunk 雜湊相同。
+    參數:
+        features (Iterable[str]): 不重複的特徵（例如 shingles 的結果）。
+    回傳:
+        int: 64 位元無號整數。
+    """
+    hashes = np.frombuffer(
+        b"".join(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest() for feature in sorted(features)),
+        dtype=">u8",
+    )
+    if not len(hashes):
+        return 0
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1).astype(np.int32)
+    votes = (bits * 2 - 1).sum(axis=0)
+    return int.from_bytes(np.packbits(votes > 0).tobytes(), "big")
+
+
+def signature(text: str) -> Signature:
+    """
+    功能: 計算子 chunk 的簽章：正規化文字的雜湊（完全重複）、以不重複 shingle 計算的 SimHash（近似重複的候選，
+          相異詞彙太少時為 None），以及確認近似重複用的相異詞彙集合。
+    參數:
+        text (str): 子 chunk 文字。
+    回傳:
+        Signature: (digest, simhash, tokens)。
+    """
+    normalized = normalize_text(text)
+    digest = hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+    tokens = tokenize(normalized)
+    vocabulary = frozenset(tokens)
+    return digest, simhash(shingles(tokens)) if len(vocabulary) >= _MIN_TOKENS else None, vocabulary
+
+
+def same_content(a: FrozenSet[str], b: FrozenSet[str], min_jaccard: float) -> bool:
+    """
+    功能: 確認 SimHash 找到的候選確實是近似重複：相異詞彙的 Jaccard 相似度不低於門檻，
+          且含數字的詞彙（料號、型號、數值）完全相同，只差一個料號或數值的樣板文件不會被合併。
+    參數:
+        a (FrozenSet[str]): 相異詞彙集合。
+        b (FrozenSet[str]): 相異詞彙集合。
+        min_jaccard (float): Jaccard 相似度門檻。
+    回傳:
+        bool: 是否視為重複。
+    """
+    if not a or not b:
+        return False
+    if {token for token in a if _DIGIT_RE.search(token)} != {token for token in b if _DIGIT_RE.search(token)}:
+        return False
+    return len(a & b) / len(a | b) >= min_jaccard
+
+
+def _bands(value: int) -> List[int]:
+    """
+    功能: 將 SimHash 切成數段；漢明距離不超過段數減一時，至少有一段完全相同，可用索引找出候選。
+    參數:
+        value (int): SimHash。
+    回傳:
+        List[int]: 各段的值。
+    """
+    mask = (1 << _BAND_BITS) - 1
+    return [(value >> (i * _BAND_BITS)) & mask for i in range(_BANDS)]
+
+
+def _hamming(a: int, b: int) -> int:
+    """
+    功能: 計算兩個 64 位元雜湊的漢明距離（SQLite 取回的有號整數先遮罩成無號）。
+    參數:
+        a (int): 雜湊。
+        b (int): 雜湊。
+    回傳:
+        int: 相異位元數。
+    """
+    return bin((a ^ b) & ((1 << 64) - 1)).count("1")
+
+
+def is_near_duplicate(a: Signature, b: Signature, max_distance: Optional[int], min_jaccard: float = 0.9) -> bool:
+    """
+    功能: 判斷兩個簽章是否為完全或近似重複；近似重複須 SimHash 距離在上限內且通過 same_content 確認。
+    參數:
+        a (Signature): 簽章。
+        b (Signature): 簽章。
+        max_distance (Optional[int]): SimHash 漢明距離上限，None 表示只比對完全重複。
+        min_jaccard (float): 相異詞彙的 Jaccard 相似度門檻。
+    回傳:
+        bool: 是否重複。
+    """
+    if a[0] == b[0]:
+        return True
+    if max_distance is None or a[1] is None or b[1] is None:
+        return False
+    return _hamming(a[1], b[1]) <= max_distance and same_content(a[2], b[2], min_jaccard)
+
+
+def collapse(docs: Sequence[Document], max_distance: Optional[int], min_jaccard: float = 0.9) -> List[Document]:
+    """
+    功能: 查詢時合併結果中互為完全或近似重複的子 chunk，只保留排名最前者，並在其 metadata 記錄被合併的數量。
+    參數:
+        docs (Sequence[Document]): 依排名排序的子 chunk。
+        max_distance (Optional[int]): SimHash 漢明距離上限，None 表示只合併完全重複。
+        min_jaccard (float): 相異詞彙的 Jaccard 相似度門檻。
+    回傳:
+        List[Document]: 去除重複後的子 chunk。
+    """
+    kept: List[Tuple[Signature, Document]] = []
+    for doc in docs:
+        sig = signature(doc.page_content)
+        for kept_sig, kept_doc in kept:
+            if is_near_duplicate(sig, kept_sig, max_distance, min_jaccard):
+                kept_doc.metadata["duplicates"] = kept_doc.metadata.get("duplicates", 0) + 1
+                break
+        else:
+            kept.append((sig, doc))
+    return [doc for _, doc in kept]
+
+
+# ---------- 尚未寫入的簽章 ----------
+class SignatureSet:
+    def __init__(self, max_distance: Optional[int] = None, min_jaccard: float = 0.9):
+        """
+        功能: 記憶體中的簽章集合，供匯入管線比對同一次匯入中已切分、但尚未寫入的子 chunk。
+        參數:
+            max_distance (Optional[int]): SimHash 漢明距離上限，None 表示只比對完全重複。
+            min_jaccard (float): 確認近似重複的 Jaccard 相似度門檻。
+        回傳:
+            None
+        """
+        self.max_distance = max_distance
+        self.min_jaccard = min_jaccard
+        self._lock = threading.Lock()
+        self._digests: Dict[str, object] = {}
+        self._bands: Dict[Tuple[int, int], List[Tuple[int, FrozenSet[str], object]]] = {}
+
+    def add(self, sig: Signature, value: object) -> None:
+        """
+        功能: 加入簽章。
+        參數:
+            sig (Signature): 簽章。
+            value  (object): 對應的物件（例如子 chunk）。
+        回傳:
+            None
+        """
+        digest, hashed, tokens = sig
+        with self._lock:
+            self._digests.setdefault(digest, value)
+            if hashed is not None and self.max_distance is not None:
+                for i, band in enumerate(_bands(hashed)):
+                    self._bands.setdefault((i, band), []).append((hashed, tokens, value))
+
+    def find(self, sig: Signature) -> Optional[object]:
+        """
+        功能: 找出完全或近似重複的物件。
+        參數:
+            sig (Signature): 簽章。
+        回傳:
+            Optional[object]: 對應的物件，找不到時為 None。
+        """
+        digest, hashed, tokens = sig
+        with self._lock:
+            if digest in self._digests:
+                return self._digests[digest]
+            if hashed is None or self.max_distance is None:
+                return None
+            for i, band in enumerate(_bands(hashed)):
+                for other, other_tokens, value in self._bands.get((i, band), []):
+                    if _hamming(hashed, other) <= self.max_distance and same_content(tokens, other_tokens, self.min_jaccard):
+                        return value
+        return None
+
+    def remove(self, sig: Signature) -> None:
+        """
+        功能: 移除簽章（已寫入持久化索引後呼叫）。
+        參數:
+            sig (Signature): 簽章。
+        回傳:
+            None
+        """
+        digest, hashed, _ = sig
+        with self._lock:
+            self._digests.pop(digest, None)
+            if hashed is not None and self.max_distance is not None:
+                for i, band in enumerate(_bands(hashed)):
+                    entries = [entry for entry in self._bands.get((i, band), []) if entry[0] != hashed]
+                    if entries:
+                        self._bands[(i, band)] = entries
+                    else:
+                        self._bands.pop((i, band), None)
+
+
+# ---------- 子 chunk 簽章與父文件參照 ----------
+class ChildDeduplicator:
+    def __init__(self, db_path: str, max_distance: Optional[int] = None, min_jaccard: float = 0.9):
+        """
+        功能: 以 SQLite 保存每個唯一子 chunk 的簽章，以及引用它的所有父文件；重複的子 chunk 只存一份，
+              刪除父文件時只有在沒有任何父文件引用後才刪除子 chunk。
+        參數:
+            db_path      (str): SQLite 檔案路徑。
+            max_distance (Optional[int]): 近似重複的 SimHash 漢明距離上限（需小於 4 才能保證以分段索引找到），
+                                          None 表示只合併完全重複。
+            min_jaccard (float): 確認近似重複的 Jaccard 相似度門檻。
+        回傳:
+            None
+        """
+        self.db_path = db_path
+        self.max_distance = max_distance
+        self.min_jaccard = min_jaccard
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS signatures (
+                child_id INTEGER PRIMARY KEY,
+                digest   TEXT NOT NULL,
+                simhash  INTEGER,
+                b0 INTEGER, b1 INTEGER, b2 INTEGER, b3 INTEGER,
+                tokens   TEXT
+            );
+            CREATE INDEX IF NOT EXISTS signatures_digest ON signatures(digest);
+            CREATE INDEX IF NOT EXISTS signatures_b0 ON signatures(b0);
+            CREATE INDEX IF NOT EXISTS signatures_b1 ON signatures(b1);
+            CREATE INDEX IF NOT EXISTS signatures_b2 ON signatures(b2);
+            CREATE INDEX IF NOT EXISTS signatures_b3 ON signatures(b3);
+            CREATE TABLE IF NOT EXISTS refs (
+                child_id  INTEGER NOT NULL,
+                parent_id TEXT NOT NULL,
+                PRIMARY KEY (child_id, parent_id)
+            );
+            CREATE INDEX IF NOT EXISTS refs_parent ON refs(parent_id);
+            """
+        )
+        # 舊版資料表沒有詞彙欄位，其簽章無法確認近似重複，只會以完全重複比對
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(signatures)")}
+        if "tokens" not in columns:
+            self._conn.execute("ALTER TABLE signatures ADD COLUMN tokens TEXT")
+        self._conn.commit()
+
+    def find(self, sig: Signature) -> Optional[int]:
+        """
+        功能: 找出與簽章完全或近似重複的既有子 chunk。
+        參數:
+            sig (Signature): 簽章。
+        回傳:
+            Optional[int]: 子 chunk 主鍵，找不到時為 None。
+        """
+        digest, value, tokens = sig
+        with self._lock:
+            row = self._conn.execute("SELECT child_id FROM signatures WHERE digest = ? LIMIT 1", (digest,)).fetchone()
+            if row is not None:
+                return row[0]
+            if value is None or self.max_distance is None:
+                return None
+            bands = _bands(value)
+            rows = self._conn.execute(
+                "SELECT child_id, simhash, tokens FROM signatures WHERE b0 = ? OR b1 = ? OR b2 = ? OR b3 = ?", bands
+            ).fetchall()
+        for child_id, other, other_tokens in rows:
+            if other is None or other_tokens is None or _hamming(value, other) > self.max_distance:
+                continue
+            if same_content(tokens, frozenset(other_tokens.split(" ")), self.min_jaccard):
+                return child_id
+        return None
+
+    def add(self, child_ids: Sequence[int], signatures: Sequence[Signature], parent_ids: Sequence[str]) -> None:
+        """
+        功能: 登記新寫入的唯一子 chunk 及其所屬父文件。
+        參數:
+            child_ids    (Sequence[int]): 子 chunk 主鍵。
+            signatures (Sequence[Signature]): 對應的簽章。
+            parent_ids   (Sequence[str]): 對應的父文件 ID。
+        回傳:
+            None
+        """
+        rows = []
+        for child_id, (digest, value, tokens) in zip(child_ids, signatures):
+            bands = _bands(value) if value is not None else [None] * _BANDS
+            stored = " ".join(sorted(tokens)) if value is not None else None
+            rows.append((int(child_id), digest, _to_signed(value) if value is not None else None, *bands, stored))
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO signatures (child_id, digest, simhash, b0, b1, b2, b3, tokens) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO refs VALUES (?, ?)",
+                [(int(child_id), parent_id) for child_id, parent_id in zip(child_ids, parent_ids)],
+            )
+            self._conn.commit()
+
+    def add_refs(self, pairs: Iterable[Tuple[int, str]]) -> None:
+        """
+        功能: 登記父文件引用既有的子 chunk。
+        參數:
+            pairs (Iterable[Tuple[int, str]]): (子 chunk 主鍵, 父文件 ID)。
+        回傳:
+            None
+        """
+        with self._lock:
+            self._conn.executemany("INSERT OR IGNORE INTO refs VALUES (?, ?)", [(int(c), p) for c, p in pairs])
+            self._conn.commit()
+
+    def release(self, parent_ids: Sequence[str], child_ids: Sequence[int]) -> List[int]:
+        """
+        功能: 移除父文件的引用，回傳已無任何父文件引用、可實際刪除的子 chunk（並移除其簽章）。
+              未登記過引用的子 chunk（啟用去重前寫入者）視為可刪除；仍有引用者保留，
+              檢索時由 parents_of 中最早登記的父文件接手擁有者與 source。
+        參數:
+            parent_ids (Sequence[str]): 要刪除的父文件 ID。
+            child_ids  (Sequence[int]): 要刪除的父文件所擁有的子 chunk 主鍵。
+        回傳:
+            List[int]: 可刪除的子 chunk 主鍵。
+        """
+        with self._lock:
+            self._conn.executemany("DELETE FROM refs WHERE parent_id = ?", [(p,) for p in parent_ids])
+            orphans = [
+                child_id for child_id in child_ids
+                if self._conn.execute("SELECT 1 FROM refs WHERE child_id = ? LIMIT 1", (int(child_id),)).fetchone() is None
+            ]
+            self._conn.executemany("DELETE FROM signatures WHERE child_id = ?", [(int(c),) for c in orphans])
+            self._conn.commit()
+        return orphans
+
+    def known(self, child_ids: Iterable[int]) -> set:
+        """
+        功能: 篩選仍存在的子 chunk；匯入管線在寫入前確認比對到的既有子 chunk 未在期間被刪除。
+        參數:
+            child_ids (Iterable[int]): 子 chunk 主鍵。
+        回傳:
+            set: 仍存在的子 chunk 主鍵。
+        """
+        with self._lock:
+            return {
+                int(child_id) for child_id in child_ids
+                if self._conn.execute("SELECT 1 FROM signatures WHERE child_id = ?", (int(child_id),)).fetchone()
+            }
+
+    def parents_of(self, child_ids: Sequence[int]) -> Dict[int, List[str]]:
+        """
+        功能: 查詢引用各子 chunk 的父文件。
+        參數:
+            child_ids (Sequence[int]): 子 chunk 主鍵。
+        回傳:
+            Dict[int, List[str]]: 子 chunk 主鍵 -> 父文件 ID 列表（依登記順序）。
+        """
+        with self._lock:
+            return {
+                int(child_id): [
+                    row[0] for row in self._conn.execute(
+                        "SELECT parent_id FROM refs WHERE child_id = ? ORDER BY rowid", (int(child_id),)
+                    ).fetchall()
+                ]
+                for child_id in child_ids
+            }
+
+    def children_of(self, parent_ids: Iterable[str]) -> List[int]:
+        """
+        功能: 列出父文件引用的所有子 chunk（包含與其他父文件共用者）。
+        參數:
+            parent_ids (Iterable[str]): 父文件 ID。
+        回傳:
+            List[int]: 子 chunk 主鍵。
+        """
+        with self._lock:
+            return [
+                row[0] for parent_id in parent_ids
+                for row in self._conn.execute("SELECT child_id FROM refs WHERE parent_id = ?", (parent_id,)).fetchall()
+            ]
+
+    def stats(self) -> Dict[str, int]:
+        """
+        功能: 回傳唯一子 chunk 數與引用數；引用數減去唯一數即為省下的子 chunk 數。
+        參數:
+            無
+        回傳:
+            Dict[str, int]: unique / refs。
+        """
+        with self._lock:
+            unique = self._conn.execute("SELECT COUNT(*) FROM signatures").fetchone()[0]
+            refs = self._conn.execute("SELECT COUNT(*) FROM refs").fetchone()[0]
+        return {"unique": unique, "refs": refs}
@@ -0,0 +1,622 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+import mmap
+import os
+import re
+import struct
+import threading
+import zlib
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.stores import BaseStore, ByteStore
+
+logger = logging.getLogger(__name__)
+
+# 紀錄格式: crc32(4) | op(1) | key_len(4) | value_len(4) | key | value
+# crc32 涵蓋 op 之後的所有位元組，用於偵測寫到一半的紀錄
+_HEADER = struct.Struct("<IBII")
+_OP_PUT = 1
+_OP_DELETE = 2
+_OP_PUT_ZLIB = 3  # value 以 zlib 壓縮
+
+_SEGMENT_RE = re.compile(r"^(\d{8})\.(seg|base)$")
+
+
+# ---------- 附加寫入式（log-structured）docstore ----------
+class LogStructuredStore(ByteStore):
+    def __init__(
+        self,
+        directory: str,
+        *,
+        max_segment_bytes: int = 64 * 1024 * 1024,
+        compaction_ratio: float = 0.5,
+        compaction_min_bytes: int = 16 * 1024 * 1024,
+        fsync: bool = True,
+        compress_level: int = 0,
+    ):
+        """
+        功能: 初始化附加寫入式的鍵值儲存，每次寫入只追加紀錄，不重寫整個檔案；記憶體中只保留鍵與位移，
+              value 在讀取時才從檔案（已封存的 segment 以 mmap 映射）取出並解壓縮。
+        參數:
+            directory            (str): 存放 segment 檔案的目錄。
+            max_segment_bytes    (int): 單一 segment 的大小上限，超過即切換新 segment。
+            compaction_ratio   (float): 失效位元組比例超過此值時觸發背景壓縮。
+            compaction_min_bytes (int): 總位元組低於此值時不觸發壓縮。
+            fsync               (bool): 每批寫入後是否呼叫 fsync 以確保斷電後資料仍在。
+            compress_level       (int): 寫入時的 zlib 壓縮等級，0 表示不壓縮；既有的未壓縮紀錄仍可讀取。
+        回傳:
+            None
+        """
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.compaction_ratio = compaction_ratio
+        self.compaction_min_bytes = compaction_min_bytes
+        self.fsync = fsync
+        self.compress_level = compress_level
+
+        self._lock = threading.RLock()
+        # 同一時間只允許一個壓縮（背景觸發與明確呼叫的 compact 可能同時發生）
+        self._compaction_lock = threading.Lock()
+        self._compaction_thread: Optional[threading.Thread] = None
+        # key -> (segment 路徑, value 位移, value 長度, 是否壓縮)
+        self._index: Dict[str, Tuple[str, int, int, bool]] = {}
+        self._readers: Dict[str, object] = {}
+        self._live_bytes = 0
+        self._total_bytes = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._recover()
+
+    # ---------- private ----------
+    def _segment_path(self, segment_id: int, kind: str = "seg") -> str:
+        """
+        功能: 組出 segment 檔案路徑。
+        參數:
+            segment_id (int): segment 編號。
+            kind       (str): 'seg' 為一般 segment，'base' 為壓縮後的基底檔。
+        回傳:
+            str: 檔案路徑。
+        """
+        return os.path.join(self.directory, f"{segment_id:08d}.{kind}")
+
+    def _list_segments(self) -> List[Tuple[int, str]]:
+        """
+        功能: 列出目錄中的 segment 檔案並依編號排序。
+        參數:
+            無
+        回傳:
+            List[Tuple[int, str]]: (segment 編號, 種類) 列表。
+        """
+        segments = []
+        for name in os.listdir(self.directory):
+            match = _SEGMENT_RE.match(name)
+            if match:
+                segments.append((int(match.group(1)), match.group(2)))
+        return sorted(segments)
+
+    def _recover(self) -> None:
+        """
+        功能: 依序重播所有 segment 重建索引；最後一個 segment 尾端若有殘缺紀錄則截斷。
+        參數:
+            無
+        回傳:
+            None
+        """
+        # 上次壓縮中途中斷留下的暫存檔，直接捨棄（只在開啟時處理，執行中的壓縮可能正在寫入）
+        for name in os.listdir(self.directory):
+            if name.endswith(".tmp"):
+                os.remove(os.path.join(self.directory, name))
+        segments = self._list_segments()
+
+        # 最新的 base 檔已包含它之前所有 segment 的存活資料，較舊的檔案可直接刪除
+        base_ids = [seg_id for seg_id, kind in segments if kind == "base"]
+        if base_ids:
+            latest_base = max(base_ids)
+            for seg_id, kind in segments:
+                if seg_id < latest_base or (seg_id == latest_base and kind == "seg"):
+                    os.remove(self._segment_path(seg_id, kind))
+            segments = [(i, k) for i, k in segments if i > latest_base or (i == latest_base and k == "base")]
+
+        for position, (seg_id, kind) in enumerate(segments):
+            path = self._segment_path(seg_id, kind)
+            valid_end = self._replay(path)
+            size = os.path.getsize(path)
+            if valid_end < size:
+                if position == len(segments) - 1:
+                    logger.warning(f"Truncating torn tail of {path}: {size - valid_end} bytes")
+                    with open(path, "r+b") as f:
+                        f.truncate(valid_end)
+                else:
+                    logger.error(f"Corrupted record in sealed segment {path} at offset {valid_end}")
+
+        # 最後一個 segment 未滿時沿用為 active，避免每次啟動都產生新檔
+        if segments and segments[-1][1] == "seg" and \
+                os.path.getsize(self._segment_path(segments[-1][0])) < self.max_segment_bytes:
+            self._open_active(segments[-1][0])
+        else:
+            self._open_active(segments[-1][0] + 1 if segments else 1)
+
+    def _replay(self, path: str) -> int:
+        """
+        功能: 讀取單一 segment 並套用到索引。
+        參數:
+            path (str): segment 檔案路徑。
+        回傳:
+            int: 最後一筆完整紀錄的結束位移。
+        """
+        offset = 0
+        with open(path, "rb") as f:
+            while True:
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    break
+                crc, op, key_len, value_len = _HEADER.unpack(header)
+                body = f.read(key_len + value_len)
+                if len(body) < key_len + value_len:
+                    break
+                if zlib.crc32(header[4:] + body) != crc:
+                    break
+                key = body[:key_len].decode("utf-8")
+                record_len = _HEADER.size + key_len + value_len
+                if op in (_OP_PUT, _OP_PUT_ZLIB):
+                    self._apply_put(key, path, offset + _HEADER.size + key_len, value_len, record_len, op == _OP_PUT_ZLIB)
+                else:
+                    self._apply_delete(key, record_len)
+                offset += record_len
+        return offset
+
+    def _apply_put(
+        self, key: str, path: str, value_offset: int, value_len: int, record_len: int, compressed: bool = False
+    ) -> None:
+        """
+        功能: 更新索引並維護存活/總位元組統計。
+        參數:
+            key          (str): 鍵。
+            path         (str): 紀錄所在的 segment。
+            value_offset (int): value 在檔案中的位移。
+            value_len    (int): value 長度（壓縮後）。
+            record_len   (int): 整筆紀錄長度。
+            compressed  (bool): value 是否以 zlib 壓縮。
+        回傳:
+            None
+        """
+        old = self._index.get(key)
+        if old is not None:
+            self._live_bytes -= _HEADER.size + len(key.encode("utf-8")) + old[2]
+        self._index[key] = (path, value_offset, value_len, compressed)
+        self._live_bytes += record_len
+        self._total_bytes += record_len
+
+    def _apply_delete(self, key: str, record_len: int) -> None:
+        """
+        功能: 從索引移除鍵；刪除紀錄本身也計入總位元組（可被壓縮回收）。
+        參數:
+            key        (str): 鍵。
+            record_len (int): 刪除紀錄長度。
+        回傳:
+            None
+        """
+        old = self._index.pop(key, None)
+        if old is not None:
+            self._live_bytes -= _HEADER.size + len(key.encode("utf-8")) + old[2]
+        self._total_bytes += record_len
+
+    def _open_active(self, segment_id: int) -> None:
+        """
+        功能: 開啟（或建立）可寫入的 active segment。
+        參數:
+            segment_id (int): segment 編號。
+        回傳:
+            None
+        """
+        self._active_id = segment_id
+        self._active_path = self._segment_path(segment_id)
+        self._active = open(self._active_path, "ab")
+
+    def _rotate(self) -> None:
+        """
+        功能: 封存目前的 active segment 並開啟下一個。
+        參數:
+            無
+        回傳:
+            None
+        """
+        self._active.close()
+        # 舊 active 的讀取檔案改在下次讀取時以 mmap 重新開啟
+        self._close_readers([self._active_path])
+        self._open_active(self._active_id + 1)
+
+    def _append(self, op: int, key: str, value: bytes = b"") -> Tuple[int, int]:
+        """
+        功能: 在 active segment 尾端追加一筆紀錄（呼叫端需持有鎖）。
+        參數:
+            op      (int): 操作種類。
+            key     (str): 鍵。
+            value (bytes): 值，刪除紀錄為空。
+        回傳:
+            Tuple[int, int]: (value 位移, 紀錄長度)。
+        """
+        key_bytes = key.encode("utf-8")
+        body = _HEADER.pack(0, op, len(key_bytes), len(value))[4:] + key_bytes + value
+        record = struct.pack("<I", zlib.crc32(body)) + body
+        offset = self._active.tell()
+        self._active.write(record)
+        return offset + _HEADER.size + len(key_bytes), len(record)
+
+    def _flush(self) -> None:
+        """
+        功能: 將 active segment 的緩衝寫入磁碟，必要時 fsync 並切換 segment。
+        參數:
+            無
+        回傳:
+            None
+        """
+        self._active.flush()
+        if self.fsync:
+            os.fsync(self._active.fileno())
+        if self._active.tell() >= self.max_segment_bytes:
+            self._rotate()
+
+    def _read_raw(self, path: str, offset: int, length: int) -> bytes:
+        """
+        功能: 依位移讀取 value 的原始位元組（呼叫端需持有鎖）；已封存的 segment 不再變動，以 mmap 映射，
+              讀取只複製所需的位元組，未被讀取的頁面不佔常駐記憶體。
+        參數:
+            path   (str): segment 路徑。
+            offset (int): 位移。
+            length (int): 長度。
+        回傳:
+            bytes: value 原始位元組。
+        """
+        reader = self._readers.get(path)
+        if reader is None:
+            with open(path, "rb") as f:
+                if path != self._active_path and os.path.getsize(path) > 0:
+                    reader = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if reader is None:
+                reader = open(path, "rb")
+            self._readers[path] = reader
+        if isinstance(reader, mmap.mmap):
+            return reader[offset:offset + length]
+        reader.seek(offset)
+        return reader.read(length)
+
+    def _read_value(self, path: str, offset: int, length: int, compressed: bool) -> bytes:
+        """
+        功能: 讀取並視需要解壓縮 value（呼叫端需持有鎖）。
+        參數:
+            path        (str): segment 路徑。
+            offset      (int): 位移。
+            length      (int): 長度。
+            compressed (bool): 是否以 zlib 壓縮。
+        回傳:
+            bytes: value。
+        """
+        raw = self._read_raw(path, offset, length)
+        return zlib.decompress(raw) if compressed else raw
+
+    def _close_readers(self, paths: Sequence[str]) -> None:
+        """
+        功能: 關閉指定 segment 的讀取檔案。
+        參數:
+            paths (Sequence[str]): segment 路徑列表。
+        回傳:
+            None
+        """
+        for path in paths:
+            reader = self._readers.pop(path, None)
+            if reader is not None:
+                reader.close()
+
+    def _maybe_compact(self) -> None:
+        """
+        功能: 失效資料比例過高時，啟動背景執行緒進行壓縮。
+        參數:
+            無
+        回傳:
+            None
+        """
+        if self._total_bytes == 0 or self._total_bytes < self.compaction_min_bytes:
+            return
+        dead_ratio = 1 - self._live_bytes / self._total_bytes
+        if dead_ratio < self.compaction_ratio:
+            return
+        if self._compaction_lock.locked() or (self._compaction_thread is not None and self._compaction_thread.is_alive()):
+            return
+        self._compaction_thread = threading.Thread(target=self.compact, name="docstore-compaction", daemon=True)
+        self._compaction_thread.start()
+
+    # ---------- public ----------
+    def mget(self, keys: Sequence[str]) -> List[Optional[bytes]]:
+        """
+        功能: 批次讀取多個鍵的值。
+        參數:
+            keys (Sequence[str]): 鍵列表。
+        回傳:
+            List[Optional[bytes]]: 對應的值，不存在者為 None。
+        """
+        with self._lock:
+            self._active.flush()
+            values = []
+            for key in keys:
+                location = self._index.get(key)
+                values.append(self._read_value(*location) if location is not None else None)
+            return values
+
+    def mset(self, key_value_pairs: Sequence[Tuple[str, bytes]]) -> None:
+        """
+        功能: 批次寫入多組鍵值，只追加新紀錄。
+        參數:
+            key_value_pairs (Sequence[Tuple[str, bytes]]): 要寫入的鍵值對清單。
+        回傳:
+            None
+        """
+        with self._lock:
+            for key, value in key_value_pairs:
+                op = _OP_PUT
+                if self.compress_level > 0:
+                    packed = zlib.compress(value, self.compress_level)
+                    # 很短的 value 壓縮後可能反而變大，維持原樣
+                    if len(packed) < len(value):
+                        op, value = _OP_PUT_ZLIB, packed
+                value_offset, record_len = self._append(op, key, value)
+                self._apply_put(key, self._active_path, value_offset, len(value), record_len, op == _OP_PUT_ZLIB)
+            self._flush()
+            self._maybe_compact()
+
+    def mdelete(self, keys: Sequence[str]) -> None:
+        """
+        功能: 批次刪除多個鍵，以追加刪除紀錄（tombstone）的方式完成。
+        參數:
+            keys (Sequence[str]): 要刪除的鍵列表。
+        回傳:
+            None
+        """
+        with self._lock:
+            for key in keys:
+                if key in self._index:
+                    _, record_len = self._append(_OP_DELETE, key)
+                    self._apply_delete(key, record_len)
+            self._flush()
+            self._maybe_compact()
+
+    def yield_keys(self, *, prefix: Optional[str] = None) -> Iterator[str]:
+        """
+        功能: 逐一列出所有（或指定前綴的）鍵。
+        參數:
+            prefix (str, optional): 鍵前綴。
+        回傳:
+            Iterator[str]: 鍵的迭代器。
+        """
+        with self._lock:
+            keys = list(self._index)
+        for key in keys:
+            if prefix is None or key.startswith(prefix):
+                yield key
+
+    def count(self) -> int:
+        """
+        功能: 回傳目前的鍵數量；直接取自記憶體索引，不需逐一列舉。
+        參數:
+            無
+        回傳:
+            int: 鍵數量。
+        """
+        with self._lock:
+            return len(self._index)
+
+    def total_bytes(self) -> int:
+        """
+        功能: 回傳所有 segment 的總位元組數（含已失效的紀錄），供壓縮前後比較。
+        參數:
+            無
+        回傳:
+            int: 位元組數。
+        """
+        with self._lock:
+            return self._total_bytes
+
+    def compact(self) -> None:
+        """
+        功能: 將已封存 segment 中仍存活的紀錄改寫成單一 base 檔，回收失效空間。
+              寫入期間不阻塞讀寫；以 tmp 檔 + rename 確保任何時間點崩潰都可復原。
+              同時只執行一個壓縮，另一個呼叫會等待進行中的壓縮結束後再執行。
+        參數:
+            無
+        回傳:
+            None
+        """
+        with self._compaction_lock:
+            self._compact()
+
+    def _compact(self) -> None:
+        """
+        功能: compact 的實作（呼叫端需持有壓縮鎖）。
+        參數:
+            無
+        回傳:
+            None
+        """
+        with self._lock:
+            self._rotate()
+            sealed_id = self._active_id - 1
+            snapshot = {
+                key: location for key, location in self._index.items()
+                if location[0] != self._active_path
+            }
+            sealed_paths = [
+                self._segment_path(seg_id, kind) for seg_id, kind in self._list_segments()
+                if seg_id <= sealed_id
+            ]
+
+        base_path = self._segment_path(sealed_id, "base")
+        tmp_path = base_path + ".tmp"
+        relocated: Dict[str, Tuple[Tuple[str, int, int, bool], Tuple[str, int, int, bool]]] = {}
+        with open(tmp_path, "wb") as out:
+            for key, location in snapshot.items():
+                # 直接搬移原始位元組，壓縮過的紀錄不需解壓再壓縮
+                path, value_offset, value_len, compressed = location
+                with self._lock:
+                    value = self._read_raw(path, value_offset, value_len)
+                key_bytes = key.encode("utf-8")
+                op = _OP_PUT_ZLIB if compressed else _OP_PUT
+                body = _HEADER.pack(0, op, len(key_bytes), len(value))[4:] + key_bytes + value
+                offset = out.tell()
+                out.write(struct.pack("<I", zlib.crc32(body)) + body)
+                relocated[key] = (location, (base_path, offset + _HEADER.size + len(key_bytes), len(value), compressed))
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_path, base_path)
+
+        with self._lock:
+            for key, (old_location, new_location) in relocated.items():
+                # 壓縮期間被覆寫或刪除的鍵保留新狀態
+                if self._index.get(key) == old_location:
+                    self._index[key] = new_location
+            self._close_readers(sealed_paths)
+            for path in sealed_paths:
+                if path != base_path and os.path.exists(path):
+                    os.remove(path)
+            self._total_bytes = sum(
+                os.path.getsize(self._segment_path(seg_id, kind)) for seg_id, kind in self._list_segments()
+            )
+            self._live_bytes = sum(
+                _HEADER.size + len(key.encode("utf-8")) + location[2] for key, location in self._index.items()
+            )
+        logger.info(f"Compacted docstore {self.directory}: {len(relocated)} live records")
+
+    def import_items(self, items: Dict[str, bytes]) -> None:
+        """
+        功能: 匯入既有的鍵值（例如舊版 pickle docstore 的內容）。
+        參數:
+            items (Dict[str, bytes]): 鍵值字典。
+        回傳:
+            None
+        """
+        if items:
+            self.mset(list(items.items()))
+
+    def close(self) -> None:
+        """
+        功能: 關閉所有檔案。
+        參數:
+            無
+        回傳:
+            None
+        """
+        with self._lock:
+            self._active.close()
+            self._close_readers(list(self._readers))
+
+
+# ---------- 已解碼父文件的 LRU 快取 ----------
+class LRUDocumentCache(BaseStore[str, Any]):
+    def __init__(self, store: BaseStore[str, Any], max_size: int = 256):
+        """
+        功能: 包裝 docstore，保留最近讀取的少量已解碼父文件；熱門父文件不必每次都讀檔、解壓縮與反序列化，
+              其餘父文件只存在磁碟上。
+        參數:
+            store (BaseStore[str, Any]): 底層 docstore（例如 create_kv_docstore 的結果）。
+            max_size              (int): 快取的父文件數上限，0 表示停用。
+        回傳:
+            None
+        """
+        self.store = store
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def mget(self, keys: Sequence[str]) -> List[Optional[Any]]:
+        """
+        功能: 批次讀取，未命中的鍵以一次 mget 向底層讀取。
+        參數:
+            keys (Sequence[str]): 鍵列表。
+        回傳:
+            List[Optional[Any]]: 對應的值，不存在者為 None。
+        """
+        with self._lock:
+            values = [self._entries.get(key) for key in keys]
+            for key, value in zip(keys, values):
+                if value is not None:
+                    self._entries.move_to_end(key)
+        missing = list(dict.fromkeys(key for key, value in zip(keys, values) if value is None))
+        with self._lock:
+            self.hits += len(keys) - sum(1 for value in values if value is None)
+            self.misses += sum(1 for value in values if value is None)
+        if not missing:
+            return values
+
+        loaded = dict(zip(missing, self.store.mget(missing)))
+        if self.max_size > 0:
+            with self._lock:
+                for key, value in loaded.items():
+                    if value is not None:
+                        self._entries[key] = value
+                        self._entries.move_to_end(key)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return [value if value is not None else loaded[key] for key, value in zip(keys, values)]
+
+    def mset(self, key_value_pairs: Sequence[Tuple[str, Any]]) -> None:
+        """
+        功能: 寫入底層並使快取中的舊值失效。
+        參數:
+            key_value_pairs (Sequence[Tuple[str, Any]]): 鍵值對。
+        回傳:
+            None
+        """
+        self.store.mset(key_value_pairs)
+        self._invalidate(key for key, _ in key_value_pairs)
+
+    def mdelete(self, keys: Sequence[str]) -> None:
+        """
+        功能: 從底層刪除並使快取失效。
+        參數:
+            keys (Sequence[str]): 鍵列表。
+        回傳:
+            None
+        """
+        self.store.mdelete(keys)
+        self._invalidate(keys)
+
+    def yield_keys(self, *, prefix: Optional[str] = None) -> Iterator[str]:
+        """
+        功能: 列出底層的鍵。
+        參數:
+            prefix (str, optional): 鍵前綴。
+        回傳:
+            Iterator[str]: 鍵的迭代器。
+        """
+        return self.store.yield_keys(prefix=prefix)
+
+    def _invalidate(self, keys) -> None:
+        """
+        功能: 移除快取中的鍵。
+        參數:
+            keys (Iterable[str]): 鍵。
+        回傳:
+            None
+        """
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        功能: 回傳命中統計。
+        參數:
+            無
+        回傳:
+            Dict[str, float]: hits / misses / hit_rate / size。
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "size": len(self._entries),
+        }
@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+import hashlib
+import json
+import os
+import re
+import threading
+import unicodedata
+import logging
+from typing import Dict, List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+_DIGEST_SIZE = 20
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """
+    功能: 正規化文字（NFKC、合併連續空白、去除頭尾空白），作為快取鍵的基礎。
+    參數:
+        text (str): 原始文字。
+    回傳:
+        str: 正規化後的文字。
+    """
+    return _WHITESPACE_RE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+# ---------- 以內容定址的持久化 embedding 快取 ----------
+class CachedEmbeddings(Embeddings):
+    def __init__(
+        self,
+        inner: Embeddings,
+        *,
+        model_id: str,
+        cache_dir: str,
+        dtype: str = "float16",
+        initial_capacity: int = 4096,
+    ):
+        """
+        功能: 包裝既有的 Embeddings，以 (模型 ID, 正規化文字雜湊) 為鍵，將向量存於記憶體映射矩陣，
+              命中時不必再跑模型前向運算。
+        參數:
+            inner        (Embeddings): 實際計算向量的 Embeddings。
+            model_id            (str): 模型識別字串（路徑或名稱），不同模型使用不同快取目錄。
+            cache_dir           (str): 快取根目錄。
+            dtype               (str): 儲存精度，'float16' 或 'float32'。
+            initial_capacity    (int): 初始矩陣列數，不足時自動倍增。
+        回傳:
+            None
+        """
+        self.inner = inner
+        self.model_id = model_id
+        self.dtype = np.dtype(dtype)
+        self.initial_capacity = initial_capacity
+        self.directory = os.path.join(cache_dir, hashlib.sha1(model_id.encode("utf-8")).hexdigest()[:16])
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._rows: Dict[bytes, int] = {}
+        self._matrix = None
+        self._dim = None
+        self._capacity = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._meta_path = os.path.join(self.directory, "meta.json")
+        self._vectors_path = os.path.join(self.directory, "vectors.bin")
+        self._index_path = os.path.join(self.directory, "index.bin")
+        self._load()
+
+    # ---------- private ----------
+    def _load(self) -> None:
+        """
+        功能: 載入既有快取；索引檔只在向量寫入後才追加，因此以索引筆數為準即可忽略殘缺的尾端。
+              索引筆數超過向量檔的列數（崩潰時向量檔未完整寫入）時只保留有向量的索引；
+              設定檔無法讀取或儲存精度改變時清空快取。
+        參數:
+            無
+        回傳:
+            None
+        """
+        if not os.path.exists(self._meta_path):
+            return
+        try:
+            with open(self._meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            dim = int(meta["dim"])
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Embedding cache metadata unreadable ({e}), resetting cache")
+            self._reset()
+            return
+        if meta.get("dtype") != self.dtype.name:
+            logger.warning(f"Embedding cache dtype changed ({meta.get('dtype')} -> {self.dtype.name}), resetting cache")
+            self._reset()
+            return
+
+        self._dim = dim
+        data = b""
+        if os.path.exists(self._index_path):
+            with open(self._index_path, "rb") as f:
+                data = f.read()
+        row_bytes = self._dim * self.dtype.itemsize
+        rows_on_disk = os.path.getsize(self._vectors_path) // row_bytes if os.path.exists(self._vectors_path) else 0
+        count = min(len(data) // _DIGEST_SIZE, rows_on_disk)
+        for row in range(count):
+            self._rows[data[row * _DIGEST_SIZE:(row + 1) * _DIGEST_SIZE]] = row
+        # 截掉寫到一半或沒有對應向量的索引紀錄
+        if len(data) != count * _DIGEST_SIZE:
+            logger.warning(f"Embedding cache index has {len(data) - count * _DIGEST_SIZE} extra bytes, truncating")
+            with open(self._index_path, "ab") as f:
+                f.truncate(count * _DIGEST_SIZE)
+        self._capacity = max(rows_on_disk, self.initial_capacity)
+        with open(self._vectors_path, "ab") as f:
+            if f.tell() < self._capacity * row_bytes:
+                f.truncate(self._capacity * row_bytes)
+        self._open_matrix()
+        logger.info(f"Loaded embedding cache {self.directory}: {count} vectors")
+
+    def _reset(self) -> None:
+        """
+        功能: 刪除快取檔案並清空記憶體中的索引（呼叫端需持有鎖或在初始化時呼叫）。
+        參數:
+            無
+        回傳:
+            None
+        """
+        self._matrix = None
+        self._rows = {}
+        self._dim = None
+        self._capacity = 0
+        for path in (self._meta_path, self._vectors_path, self._index_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _open_matrix(self) -> None:
+        """
+        功能: 以目前容量重新映射向量檔。
+        參數:
+            無
+        回傳:
+            None
+        """
+        self._matrix = np.memmap(self._vectors_path, dtype=self.dtype, mode="r+", shape=(self._capacity, self._dim))
+
+    def _init_storage(self, dim: int) -> None:
+        """
+        功能: 第一次寫入時依向量維度建立快取檔案。
+        參數:
+            dim (int): 向量維度。
+        回傳:
+            None
+        """
+        self._dim = dim
+        self._capacity = self.initial_capacity
+        with open(self._vectors_path, "wb") as f:
+            f.truncate(self._capacity * dim * self.dtype.itemsize)
+        open(self._index_path, "wb").close()
+        # 設定檔最後以 tmp + rename 寫入，存在即表示其他檔案已建立
+        tmp_path = self._meta_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"model_id": self.model_id, "dim": dim, "dtype": self.dtype.name}, f)
+        os.replace(tmp_path, self._meta_path)
+        self._open_matrix()
+
+    def _grow(self, needed: int) -> None:
+        """
+        功能: 容量不足時將向量檔倍增。
+        參數:
+            needed (int): 需要的總列數。
+        回傳:
+            None
+        """
+        if needed <= self._capacity:
+            return
+        while self._capacity < needed:
+            self._capacity *= 2
+        self._matrix.flush()
+        self._matrix = None
+        with open(self._vectors_path, "r+b") as f:
+            f.truncate(self._capacity * self._dim * self.dtype.itemsize)
+        self._open_matrix()
+
+    def _key(self, kind: str, text: str) -> bytes:
+        """
+        功能: 計算快取鍵；文件與查詢分開存放，因部分模型對查詢會加上不同前綴。
+        參數:
+            kind (str): 'd' 表示文件，'q' 表示查詢。
+            text (str): 原始文字。
+        回傳:
+            bytes: 20 位元組的雜湊值。
+        """
+        normalized = normalize_text(text)
+        return hashlib.sha1(f"{self.model_id}\0{kind}\0{normalized}".encode("utf-8")).digest()
+
+    def _lookup(self, keys: List[bytes]) -> List:
+        """
+        功能: 依鍵讀取快取向量。
+        參數:
+            keys (List[bytes]): 快取鍵列表。
+        回傳:
+            List: 對應的向量（list[float]），未命中者為 None。
+        """
+        with self._lock:
+            found = []
+            for key in keys:
+                row = self._rows.get(key)
+                found.append(self._matrix[row].astype(np.float32).tolist() if row is not None else None)
+            return found
+
+    def _store(self, keys: List[bytes], vectors: List[List[float]]) -> None:
+        """
+        功能: 寫入新向量：先寫矩陣再追加索引，確保索引中的每一列都已完整寫入。
+        參數:
+            keys    (List[bytes]): 快取鍵列表。
+            vectors (List[List[float]]): 對應的向量。
+        回傳:
+            None
+        """
+        if not keys:
+            return
+        with self._lock:
+            if self._matrix is not None and len(vectors[0]) != self._dim:
+                # 同一個模型路徑換成不同維度的模型，舊向量已不適用
+                logger.warning(f"Embedding dimension changed ({self._dim} -> {len(vectors[0])}), resetting cache")
+                self._reset()
+            if self._matrix is None:
+                self._init_storage(len(vectors[0]))
+            new = [(key, vector) for key, vector in zip(keys, vectors) if key not in self._rows]
+            if not new:
+                return
+            start = len(self._rows)
+            self._grow(start + len(new))
+            self._matrix[start:start + len(new)] = np.asarray([vector for _, vector in new], dtype=self.dtype)
+            self._matrix.flush()
+            with open(self._index_path, "ab") as f:
+                f.write(b"".join(key for key, _ in new))
+            for offset, (key, _) in enumerate(new):
+                self._rows[key] = start + offset
+
+    def _embed(self, kind: str, texts: List[str]) -> List[List[float]]:
+        """
+        功能: 先查快取，只對未命中且去重後的文字呼叫模型。
+        參數:
+            kind        (str): 'd' 或 'q'。
+            texts (List[str]): 文字列表。
+        回傳:
+            List[List[float]]: 向量列表。
+        """
+        keys = [self._key(kind, text) for text in texts]
+        vectors = self._lookup(keys)
+
+        missing: Dict[bytes, str] = {}
+        for key, text, vector in zip(keys, texts, vectors):
+            if vector is None:
+                missing.setdefault(key, text)
+        self.hits += len(texts) - sum(1 for v in vectors if v is None)
+        self.misses += len(missing)
+        if not missing:
+            return vectors
+
+        missing_keys = list(missing)
+        computed = self._compute(kind, [missing[key] for key in missing_keys])
+        if computed and any(vector is not None and len(vector) != len(computed[0]) for vector in vectors):
+            # 模型維度改變：快取命中的是舊模型的向量，整批重新計算
+            vectors = [None] * len(texts)
+            missing = dict(zip(keys, texts))
+            missing_keys = list(missing)
+            computed = self._compute(kind, [missing[key] for key in missing_keys])
+        self._store(missing_keys, computed)
+
+        by_key = dict(zip(missing_keys, computed))
+        return [vector if vector is not None else list(by_key[key]) for key, vector in zip(keys, vectors)]
+
+    def _compute(self, kind: str, texts: List[str]) -> List[List[float]]:
+        """
+        功能: 以實際的模型計算向量。
+        參數:
+            kind        (str): 'd' 或 'q'。
+            texts (List[str]): 文字列表。
+        回傳:
+            List[List[float]]: 向量列表。
+        """
+        if kind == "q":
+            return embed_query_batch(self.inner, texts)
+        return self.inner.embed_documents(texts)
+
+    # ---------- public ----------
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        功能: 取得文件向量，優先使用快取。
+        參數:
+            texts (List[str]): 文件文字列表。
+        回傳:
+            List[List[float]]: 向量列表。
+        """
+        return self._embed("d", texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        """
+        功能: 取得查詢向量，重複的查詢直接由快取回傳。
+        參數:
+            text (str): 查詢字串。
+        回傳:
+            List[float]: 向量。
+        """
+        return self._embed("q", [text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """
+        功能: 批次取得多個查詢向量，未命中的查詢以一次前向運算計算。
+        參數:
+            texts (List[str]): 查詢字串列表。
+        回傳:
+            List[List[float]]: 向量列表。
+        """
+        return self._embed("q", texts)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        功能: 回傳快取命中統計。
+        參數:
+            無
+        回傳:
+            Dict[str, int]: hits / misses / size。
+        """
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._rows)}
+
+
+def embed_query_batch(embeddings: Embeddings, texts: List[str]) -> List[List[float]]:
+    """
+    功能: 以批次方式計算多個查詢向量。
+    參數:
+        embeddings (Embeddings): Embeddings 實例。
+        texts       (List[str]): 查詢字串列表。
+    回傳:
+        List[List[float]]: 向量列表。
+    """
+    if isinstance(embeddings, CachedEmbeddings):
+        return embeddings.embed_queries(texts)
+    # HuggingFaceEmbeddings 未設定 query_encode_kwargs 時，查詢與文件的編碼方式相同，可一次批次前向運算
+    if hasattr(embeddings, "query_encode_kwargs") and not embeddings.query_encode_kwargs:
+        return embeddings.embed_documents(texts)
+    return [embeddings.embed_query(text) for text in texts]
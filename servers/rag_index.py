@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+import json
+import logging
+from typing import Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 各索引類型的預設建置參數與搜尋參數
+VECTOR_INDEX_DEFAULTS: Dict[str, Tuple[dict, dict]] = {
+    "FLAT": ({}, {}),
+    "IVF_FLAT": ({"nlist": 1024}, {"nprobe": 16}),
+    "IVF_SQ8": ({"nlist": 1024}, {"nprobe": 16}),
+    "HNSW": ({"M": 16, "efConstruction": 200}, {"ef": 64}),
+    "AUTOINDEX": ({}, {}),
+}
+
+# Milvus Lite（本機 .db 檔）只支援這些索引類型
+LOCAL_INDEX_TYPES = ("FLAT", "IVF_FLAT", "AUTOINDEX")
+
+VECTOR_METRICS = ("L2", "IP", "COSINE")
+
+
+def is_local_uri(uri: str) -> bool:
+    """
+    功能: 判斷 Milvus 連線位址是否為 Milvus Lite 的本機檔案。
+    參數:
+        uri (str): 連線位址。
+    回傳:
+        bool: 是否為本機檔案。
+    """
+    return not uri.startswith(("http://", "https://", "tcp://", "unix:"))
+
+
+def build_index_config(
+    index_type: str,
+    metric: str,
+    index_params_json: str = "",
+    search_params_json: str = "",
+    *,
+    local: bool = True,
+) -> Tuple[dict, dict]:
+    """
+    功能: 依設定組出 Milvus 的 index_params 與 search_params；Milvus Lite 不支援的索引類型退回 FLAT。
+    參數:
+        index_type         (str): 索引類型，如 FLAT、HNSW、IVF_FLAT、IVF_SQ8。
+        metric             (str): 距離度量，L2、IP 或 COSINE（向量已正規化時 IP 與 COSINE 等價且較快）。
+        index_params_json  (str): 覆寫建置參數的 JSON 字串，如 '{"M": 32}'。
+        search_params_json (str): 覆寫搜尋參數的 JSON 字串，如 '{"ef": 128}'。
+        local             (bool): 是否為 Milvus Lite。
+    回傳:
+        Tuple[dict, dict]: (index_params, search_params)。
+    """
+    index_type = index_type.upper()
+    metric = metric.upper()
+    if index_type not in VECTOR_INDEX_DEFAULTS:
+        raise ValueError(f"不支援的索引類型: {index_type}，可選 {', '.join(VECTOR_INDEX_DEFAULTS)}")
+    if metric not in VECTOR_METRICS:
+        raise ValueError(f"不支援的距離度量: {metric}，可選 {', '.join(VECTOR_METRICS)}")
+    if local and index_type not in LOCAL_INDEX_TYPES:
+        logger.warning(f"Milvus Lite does not support {index_type}, falling back to FLAT")
+        index_type = "FLAT"
+
+    build_defaults, search_defaults = VECTOR_INDEX_DEFAULTS[index_type]
+    build = {**build_defaults, **(json.loads(index_params_json) if index_params_json else {})}
+    search = {**search_defaults, **(json.loads(search_params_json) if search_params_json else {})}
+    return (
+        {"index_type": index_type, "metric_type": metric, "params": build},
+        {"metric_type": metric, "params": search},
+    )
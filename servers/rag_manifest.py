@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional
+
+
+# ---------- 匯入清單（manifest） ----------
+class IngestManifest:
+    def __init__(self, db_path: str):
+        """
+        功能: 初始化匯入清單，記錄每個來源檔案的 (大小, mtime, 內容雜湊) 與對應的父/子文件 ID。
+        參數:
+            db_path (str): SQLite 檔案路徑。
+        回傳:
+            None
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                path      TEXT PRIMARY KEY,
+                size      INTEGER NOT NULL,
+                mtime_ns  INTEGER NOT NULL,
+                sha256    TEXT NOT NULL,
+                parent_id TEXT NOT NULL,
+                child_ids TEXT NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def get(self, path: str) -> Optional[Dict]:
+        """
+        功能: 取得單一檔案的紀錄。
+        參數:
+            path (str): 檔案絕對路徑。
+        回傳:
+            Optional[Dict]: 紀錄內容，不存在則為 None。
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM files WHERE path = ?", (path,)).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def paths_under(self, directory: str) -> List[str]:
+        """
+        功能: 列出位於指定目錄底下的所有已匯入檔案。
+        參數:
+            directory (str): 目錄絕對路徑。
+        回傳:
+            List[str]: 檔案路徑列表。
+        """
+        prefix = os.path.join(directory, "")
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path FROM files WHERE substr(path, 1, ?) = ?", (len(prefix), prefix)
+            ).fetchall()
+        return [row["path"] for row in rows]
+
+    def paths_for_parents(self, parent_ids: Iterable[str]) -> List[str]:
+        """
+        功能: 找出對應指定父文件 ID 的檔案。
+        參數:
+            parent_ids (Iterable[str]): 父文件 ID。
+        回傳:
+            List[str]: 檔案路徑列表。
+        """
+        with self._lock:
+            rows = [
+                row for parent_id in parent_ids
+                for row in self._conn.execute("SELECT path FROM files WHERE parent_id = ?", (parent_id,)).fetchall()
+            ]
+        return [row["path"] for row in rows]
+
+    def upsert(self, records: Iterable[Dict]) -> None:
+        """
+        功能: 批次新增或更新紀錄。
+        參數:
+            records (Iterable[Dict]): 含 path/size/mtime_ns/sha256/parent_id/child_ids 的紀錄。
+        回傳:
+            None
+        """
+        rows = [
+            (r["path"], r["size"], r["mtime_ns"], r["sha256"], r["parent_id"], json.dumps(r["child_ids"]))
+            for r in records
+        ]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._conn.commit()
+
+    def touch(self, path: str, size: int, mtime_ns: int) -> None:
+        """
+        功能: 內容未變但 mtime 改變時，只更新檔案狀態，下次即可免雜湊略過。
+        參數:
+            path     (str): 檔案路徑。
+            size     (int): 檔案大小。
+            mtime_ns (int): 修改時間（奈秒）。
+        回傳:
+            None
+        """
+        with self._lock:
+            self._conn.execute("UPDATE files SET size = ?, mtime_ns = ? WHERE path = ?", (size, mtime_ns, path))
+            self._conn.commit()
+
+    def remove(self, paths: Iterable[str]) -> None:
+        """
+        功能: 批次刪除紀錄。
+        參數:
+            paths (Iterable[str]): 檔案路徑列表。
+        回傳:
+            None
+        """
+        with self._lock:
+            self._conn.executemany("DELETE FROM files WHERE path = ?", [(p,) for p in paths])
+            self._conn.commit()
+
+    def count(self) -> int:
+        """
+        功能: 回傳已匯入的檔案數。
+        參數:
+            無
+        回傳:
+            int: 數量。
+        """
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    @staticmethod
+    def _row_to_dict(row: sqlite3.Row) -> Dict:
+        """
+        功能: 將資料列轉為字典並解析子文件 ID 列表。
+        參數:
+            row (sqlite3.Row): 資料列。
+        回傳:
+            Dict: 紀錄內容。
+        """
+        record = dict(row)
+        record["child_ids"] = json.loads(record["child_ids"])
+        return record
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+import bisect
+import json
+import threading
+import time
+import logging
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 直方圖的桶上限（毫秒），最後一桶為無上限
+BUCKET_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+# ---------- 滾動延遲直方圖 ----------
+class LatencyHistogram:
+    def __init__(self, window: int = 1024):
+        """
+        功能: 保留最近 window 筆延遲的滾動直方圖，另累計全部的次數、處理項目數與總秒數。
+        參數:
+            window (int): 計算百分位數與分桶的樣本數上限。
+        回傳:
+            None
+        """
+        self.count = 0
+        self.items = 0
+        self.total_seconds = 0.0
+        self._samples: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, items: int = 1) -> None:
+        """
+        功能: 記錄一次執行。
+        參數:
+            seconds (float): 耗時秒數。
+            items     (int): 這次處理的項目數（例如查詢數、子 chunk 數）。
+        回傳:
+            None
+        """
+        with self._lock:
+            self.count += 1
+            self.items += items
+            self.total_seconds += seconds
+            self._samples.append(seconds)
+
+    def snapshot(self) -> Dict:
+        """
+        功能: 回傳累計值與滾動視窗內的 p50/p95/p99/max 與分桶計數（毫秒）。
+        參數:
+            無
+        回傳:
+            Dict: 統計結果。
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+            count, items, total = self.count, self.items, self.total_seconds
+        report = {"count": count, "items": items, "total_seconds": round(total, 4)}
+        if not samples:
+            return report
+
+        def percentile(q: float) -> float:
+            return round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1000, 3)
+
+        buckets = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        for seconds in samples:
+            buckets[bisect.bisect_left(BUCKET_BOUNDS_MS, seconds * 1000)] += 1
+        report.update({
+            "window": len(samples),
+            "mean_ms": round(sum(samples) / len(samples) * 1000, 3),
+            "p50_ms": percentile(0.50),
+            "p95_ms": percentile(0.95),
+            "p99_ms": percentile(0.99),
+            "max_ms": round(samples[-1] * 1000, 3),
+            "buckets_ms": {
+                **{f"le_{bound}": n for bound, n in zip(BUCKET_BOUNDS_MS, buckets)},
+                "inf": buckets[-1],
+            },
+        })
+        return report
+
+
+# ---------- 各階段的計時 ----------
+class StageMetrics:
+    def __init__(self, window: int = 1024):
+        """
+        功能: 以階段名稱（例如 query.embed、ingest.insert）區分的延遲直方圖集合。
+        參數:
+            window (int): 每個直方圖的滾動視窗大小。
+        回傳:
+            None
+        """
+        self.window = window
+        self.started_at = time.time()
+        self._stages: Dict[str, LatencyHistogram] = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float, items: int = 1) -> None:
+        """
+        功能: 記錄一個階段的一次執行。
+        參數:
+            stage     (str): 階段名稱。
+            seconds (float): 耗時秒數。
+            items     (int): 處理的項目數。
+        回傳:
+            None
+        """
+        histogram = self._stages.get(stage)
+        if histogram is None:
+            with self._lock:
+                histogram = self._stages.setdefault(stage, LatencyHistogram(self.window))
+        histogram.record(seconds, items)
+
+    @contextmanager
+    def time(self, stage: str, items: int = 1):
+        """
+        功能: 計時區塊並記錄到指定階段（區塊拋出例外時仍會記錄）。
+        參數:
+            stage (str): 階段名稱。
+            items (int): 處理的項目數。
+        回傳:
+            ContextManager
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start, items)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """
+        功能: 回傳所有階段的統計。
+        參數:
+            無
+        回傳:
+            Dict[str, Dict]: 階段名稱 -> 統計結果。
+        """
+        with self._lock:
+            stages = dict(self._stages)
+        return {stage: stages[stage].snapshot() for stage in sorted(stages)}
+
+    def reset(self) -> None:
+        """
+        功能: 清除所有統計。
+        參數:
+            無
+        回傳:
+            None
+        """
+        with self._lock:
+            self._stages = {}
+            self.started_at = time.time()
+
+
+# ---------- JSON lines 定期輸出 ----------
+class JsonlDumper:
+    def __init__(self, path: str, interval: float, collect: Callable[[], Dict]):
+        """
+        功能: 在背景執行緒每 interval 秒呼叫 collect 並以一行 JSON 追加到檔案，供長期追蹤與比較回歸。
+        參數:
+            path          (str): 輸出檔案路徑。
+            interval    (float): 輸出間隔秒數。
+            collect  (Callable): 回傳要輸出的字典。
+        回傳:
+            None
+        """
+        self.path = path
+        self.interval = interval
+        self.collect = collect
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """
+        功能: 啟動背景輸出執行緒。
+        參數:
+            無
+        回傳:
+            None
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="rag-stats-dump", daemon=True)
+            self._thread.start()
+
+    def dump(self) -> None:
+        """
+        功能: 立即輸出一行。
+        參數:
+            無
+        回傳:
+            None
+        """
+        line = json.dumps({"timestamp": time.time(), **self.collect()}, ensure_ascii=False)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    def _loop(self) -> None:
+        """
+        功能: 定期輸出直到停止；輸出失敗只記錄日誌，不影響伺服器。
+        參數:
+            無
+        回傳:
+            None
+        """
+        while not self._stop.wait(self.interval):
+            try:
+                self.dump()
+            except Exception:
+                logger.exception(f"Failed to write RAG stats to {self.path}")
+
+    def stop(self) -> None:
+        """
+        功能: 停止背景輸出。
+        參數:
+            無
+        回傳:
+            None
+        """
+        self._stop.set()
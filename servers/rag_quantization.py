@@ -0,0 +1,441 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+import json
+import os
+import threading
+import logging
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+QUANTIZATION_MODES = ("int8", "binary")
+_SCAN_CHUNK = 65536
+# 各世代的資料檔；世代 0 沿用原檔名，compact 產生的世代 n 以 "n." 為前綴
+_DATA_FILES = ("codes.bin", "scales.f32", "vectors.f32", "ids.i64", "deleted.u8")
+
+if hasattr(np, "bitwise_count"):
+    _popcount = np.bitwise_count
+else:
+    _POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def _popcount(values: np.ndarray) -> np.ndarray:
+        return _POPCOUNT_TABLE[values]
+
+
+def quantize(vectors: np.ndarray, mode: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    功能: 將 float32 向量量化；int8 以各向量的最大絕對值對稱縮放到 [-127, 127]，binary 只保留正負號並打包成位元。
+    參數:
+        vectors (np.ndarray): (n, dim) float32 向量。
+        mode           (str): 'int8' 或 'binary'。
+    回傳:
+        Tuple[np.ndarray, np.ndarray]: (量化碼, 每個向量的縮放係數)；int8 碼為 (n, dim)，
+                                       binary 碼為 (n, ceil(dim / 8)) 的 uint8，縮放係數固定為 1。
+    """
+    if mode == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    return np.packbits(vectors > 0, axis=1), np.ones(len(vectors), dtype=np.float32)
+
+
+# ---------- 量化向量儲存（第一階段搜尋 + 全精度重新評分） ----------
+class QuantizedVectorStore:
+    def __init__(
+        self,
+        directory: str,
+        *,
+        mode: str = "int8",
+        metric: str = "IP",
+        rescore_factor: int = 4,
+        initial_capacity: int = 4096,
+    ):
+        """
+        功能: 以量化碼（常駐記憶體）做第一階段暴力搜尋，再以記憶體映射的全精度向量對前幾名重新評分。
+        參數:
+            directory        (str): 存放檔案的目錄。
+            mode             (str): 'int8'（4 倍壓縮）或 'binary'（32 倍壓縮）。
+            metric           (str): 重新評分的度量，'IP'/'COSINE'（越大越相似）或 'L2'（越小越相似）。
+            rescore_factor   (int): 第一階段取 k * rescore_factor 個候選重新評分。
+            initial_capacity (int): 初始容量，不足時自動倍增。
+        回傳:
+            None
+        """
+        if mode not in QUANTIZATION_MODES:
+            raise ValueError(f"不支援的量化方式: {mode}，可選 {', '.join(QUANTIZATION_MODES)}")
+        self.directory = directory
+        self.mode = mode
+        self.metric = metric.upper()
+        self.rescore_factor = rescore_factor
+        self.initial_capacity = initial_capacity
+
+        self._lock = threading.RLock()
+        self._dim: Optional[int] = None
+        self._count = 0
+        self._capacity = 0
+        # 下一個自動配發的 ID：只增不減，compact 移除最大的 ID 後也不會重複配發給新向量
+        self._next_id = 1
+        # 目前資料檔的世代，由 meta.json 決定；compact 寫出新世代後以一次 meta.json 原子寫入切換
+        self._generation = 0
+        self._codes: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+        self._vectors: Optional[np.memmap] = None
+        self._ids: Optional[np.memmap] = None
+        self._deleted: Optional[np.memmap] = None
+
+        os.makedirs(directory, exist_ok=True)
+        self._meta_path = os.path.join(directory, "meta.json")
+        self._load()
+
+    # ---------- private ----------
+    def _path(self, name: str, generation: Optional[int] = None) -> str:
+        """
+        功能: 組出資料檔路徑。
+        參數:
+            name       (str): 檔名。
+            generation (int, optional): 資料檔世代，預設為目前世代。
+        回傳:
+            str: 路徑。
+        """
+        generation = self._generation if generation is None else generation
+        return os.path.join(self.directory, name if generation == 0 else f"{generation}.{name}")
+
+    def _remove_stale_files(self) -> None:
+        """
+        功能: 刪除不屬於目前世代的資料檔與 tmp 檔：compact 在 meta.json 切換前中斷時留下的新世代，
+              或切換後尚未刪除的舊世代。
+        參數:
+            無
+        回傳:
+            None
+        """
+        current = {os.path.basename(self._path(name)) for name in _DATA_FILES}
+        for entry in os.listdir(self.directory):
+            prefix, _, rest = entry.partition(".")
+            name = rest if prefix.isdigit() else entry
+            if entry.endswith(".tmp") or (name in _DATA_FILES and entry not in current):
+                os.remove(os.path.join(self.directory, entry))
+
+    def _code_width(self) -> int:
+        """
+        功能: 每筆量化碼的位元組數。
+        參數:
+            無
+        回傳:
+            int: 位元組數。
+        """
+        return self._dim if self.mode == "int8" else (self._dim + 7) // 8
+
+    def _load(self) -> None:
+        """
+        功能: 載入既有資料；筆數以 meta.json 為準，寫到一半的尾端資料會被忽略。
+        參數:
+            無
+        回傳:
+            None
+        """
+        if not os.path.exists(self._meta_path):
+            return
+        with open(self._meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["mode"] != self.mode:
+            raise ValueError(f"{self.directory} 以 {meta['mode']} 量化建立，與目前設定 {self.mode} 不符，請重建")
+        self._dim = meta["dim"]
+        self._count = meta["count"]
+        self._capacity = max(meta["capacity"], self._count)
+        self._generation = meta.get("generation", 0)
+        self._remove_stale_files()
+        self._open()
+        # 舊版 meta.json 沒有 next_id，以現有的最大 ID 推算
+        self._next_id = meta.get("next_id") or (int(self._ids[:self._count].max()) + 1 if self._count else 1)
+        logger.info(f"Loaded quantized vector store {self.directory}: {self._count} vectors ({self.mode})")
+
+    def _open(self) -> None:
+        """
+        功能: 以目前容量映射各資料檔；量化碼複製到記憶體中以加速掃描，全精度向量維持映射在磁碟上。
+        參數:
+            無
+        回傳:
+            None
+        """
+        code_dtype = np.int8 if self.mode == "int8" else np.uint8
+        shapes = {
+            "codes.bin": (code_dtype, (self._capacity, self._code_width())),
+            "scales.f32": (np.float32, (self._capacity,)),
+            "vectors.f32": (np.float32, (self._capacity, self._dim)),
+            "ids.i64": (np.int64, (self._capacity,)),
+            "deleted.u8": (np.uint8, (self._capacity,)),
+        }
+        for name, (dtype, shape) in shapes.items():
+            path = self._path(name)
+            size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            with open(path, "ab") as f:
+                if f.tell() < size:
+                    f.truncate(size)
+        self._codes = np.array(np.memmap(self._path("codes.bin"), dtype=code_dtype, mode="r", shape=shapes["codes.bin"][1]))
+        self._scales = np.array(np.memmap(self._path("scales.f32"), dtype=np.float32, mode="r", shape=(self._capacity,)))
+        self._vectors = np.memmap(self._path("vectors.f32"), dtype=np.float32, mode="r+", shape=shapes["vectors.f32"][1])
+        self._ids = np.memmap(self._path("ids.i64"), dtype=np.int64, mode="r+", shape=(self._capacity,))
+        self._deleted = np.memmap(self._path("deleted.u8"), dtype=np.uint8, mode="r+", shape=(self._capacity,))
+
+    def _save_meta(self) -> None:
+        """
+        功能: 以 tmp + rename 原子寫入 meta.json。
+        參數:
+            無
+        回傳:
+            None
+        """
+        tmp_path = self._meta_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "mode": self.mode,
+                    "dim": self._dim,
+                    "count": self._count,
+                    "capacity": self._capacity,
+                    "next_id": self._next_id,
+                    "generation": self._generation,
+                },
+                f,
+            )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._meta_path)
+
+    def _flush(self) -> None:
+        """
+        功能: 將映射檔寫回磁碟。
+        參數:
+            無
+        回傳:
+            None
+        """
+        for array in (self._vectors, self._ids, self._deleted):
+            array.flush()
+
+    def _grow(self, needed: int) -> None:
+        """
+        功能: 容量不足時倍增並重新映射。
+        參數:
+            needed (int): 需要的總筆數。
+        回傳:
+            None
+        """
+        if needed <= self._capacity:
+            return
+        self._flush()
+        while self._capacity < needed:
+            self._capacity *= 2
+        self._open()
+
+    def _first_stage(self, queries: np.ndarray, candidates: int) -> List[np.ndarray]:
+        """
+        功能: 以量化碼分塊掃描所有向量，取出每個查詢的候選列號。
+        參數:
+            queries (np.ndarray): (b, dim) float32 查詢向量。
+            candidates     (int): 候選數量。
+        回傳:
+            List[np.ndarray]: 每個查詢的候選列號。
+        """
+        query_codes, _ = quantize(queries, self.mode)
+        best_rows = [np.empty(0, dtype=np.int64) for _ in queries]
+        best_scores = [np.empty(0, dtype=np.float32) for _ in queries]
+
+        for start in range(0, self._count, _SCAN_CHUNK):
+            end = min(start + _SCAN_CHUNK, self._count)
+            codes = self._codes[start:end]
+            if self.mode == "int8":
+                # 乘回各向量的縮放係數即為內積的近似值（查詢的縮放係數對排序無影響），分數越大越相似
+                scores = codes.astype(np.float32) @ query_codes.astype(np.float32).T
+                scores *= self._scales[start:end, None]
+            else:
+                # 漢明距離取負號，同樣越大越相似
+                scores = np.stack(
+                    [-_popcount(np.bitwise_xor(codes, code)).sum(axis=1, dtype=np.int32) for code in query_codes],
+                    axis=1,
+                ).astype(np.float32)
+            scores[self._deleted[start:end].astype(bool)] = -np.inf
+
+            for i in range(len(queries)):
+                rows = np.concatenate([best_rows[i], np.arange(start, end)])
+                merged = np.concatenate([best_scores[i], scores[:, i]])
+                if len(merged) > candidates:
+                    keep = np.argpartition(-merged, candidates)[:candidates]
+                    rows, merged = rows[keep], merged[keep]
+                best_rows[i], best_scores[i] = rows, merged
+        return [rows[np.isfinite(scores)] for rows, scores in zip(best_rows, best_scores)]
+
+    # ---------- public ----------
+    def add(self, vectors: Sequence[Sequence[float]], ids: Optional[Sequence[int]] = None) -> List[int]:
+        """
+        功能: 新增向量，同時寫入量化碼與全精度向量。
+        參數:
+            vectors (Sequence[Sequence[float]]): 向量列表。
+            ids          (Sequence[int], optional): 指定 ID（例如從 Milvus 回填時沿用主鍵），未提供則自動遞增（不重複使用已刪除的 ID）。
+        回傳:
+            List[int]: 向量 ID。
+        """
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if len(matrix) == 0:
+            return []
+        with self._lock:
+            if self._dim is None:
+                self._dim = matrix.shape[1]
+                self._capacity = self.initial_capacity
+                self._open()
+            if ids is None:
+                ids = list(range(self._next_id, self._next_id + len(matrix)))
+            self._next_id = max(self._next_id, int(max(ids)) + 1)
+            start, end = self._count, self._count + len(matrix)
+            self._grow(end)
+            self._codes[start:end], self._scales[start:end] = quantize(matrix, self.mode)
+            self._vectors[start:end] = matrix
+            self._ids[start:end] = ids
+            self._deleted[start:end] = 0
+            # 量化碼與縮放係數的副本在記憶體中，另寫回檔案以便重啟時載入
+            for name, array in (("codes.bin", self._codes), ("scales.f32", self._scales)):
+                with open(self._path(name), "r+b") as f:
+                    f.seek(start * array[0].nbytes)
+                    f.write(array[start:end].tobytes())
+            self._flush()
+            self._count = end
+            self._save_meta()
+            return [int(i) for i in ids]
+
+    def delete(self, ids: Sequence[int]) -> int:
+        """
+        功能: 標記刪除向量。
+        參數:
+            ids (Sequence[int]): 向量 ID。
+        回傳:
+            int: 實際刪除的筆數。
+        """
+        with self._lock:
+            if not self._count or not len(ids):
+                return 0
+            mask = np.isin(self._ids[:self._count], np.asarray(ids, dtype=np.int64)) & (self._deleted[:self._count] == 0)
+            self._deleted[:self._count][mask] = 1
+            self._deleted.flush()
+            return int(mask.sum())
+
+    def search(self, queries: Sequence[Sequence[float]], k: int) -> List[List[Tuple[int, float]]]:
+        """
+        功能: 兩階段搜尋：量化碼取 k * rescore_factor 個候選，再以全精度向量重新評分。
+        參數:
+            queries (Sequence[Sequence[float]]): 查詢向量。
+            k                            (int): 每個查詢的回傳數量。
+        回傳:
+            List[List[Tuple[int, float]]]: 每個查詢的 (向量 ID, 分數)，分數定義與 metric 一致。
+        """
+        matrix = np.asarray(queries, dtype=np.float32)
+        with self._lock:
+            if not self._count:
+                return [[] for _ in matrix]
+            candidate_rows = self._first_stage(matrix, k * self.rescore_factor)
+            results = []
+            for query, rows in zip(matrix, candidate_rows):
+                rows = np.sort(rows)
+                full = np.asarray(self._vectors[rows])
+                if self.metric == "L2":
+                    scores = ((full - query) ** 2).sum(axis=1)
+                    order = np.argsort(scores)[:k]
+                else:
+                    scores = full @ query
+                    order = np.argsort(-scores)[:k]
+                results.append([(int(self._ids[rows[i]]), float(scores[i])) for i in order])
+            return results
+
+    def compact(self) -> int:
+        """
+        功能: 改寫資料檔只保留未刪除的向量，回收標記刪除所佔的磁碟與記憶體。
+              新資料寫入下一世代的檔案並 fsync，再以一次 meta.json 原子寫入切換世代，最後刪除舊世代；
+              任一步驟中斷時，重新開啟只會看到完整的舊世代或完整的新世代。
+        參數:
+            無
+        回傳:
+            int: 移除的筆數。
+        """
+        with self._lock:
+            if not self._count:
+                return 0
+            keep = np.flatnonzero(self._deleted[:self._count] == 0)
+            removed = self._count - len(keep)
+            if removed == 0:
+                return 0
+            self._flush()
+            count = len(keep)
+            capacity = max(self.initial_capacity, 1 << max(0, count - 1).bit_length())
+            old_generation, generation = self._generation, self._generation + 1
+            arrays = {
+                "codes.bin": self._codes,
+                "scales.f32": self._scales,
+                "vectors.f32": self._vectors,
+                "ids.i64": self._ids,
+            }
+            for name, array in arrays.items():
+                data = np.asarray(array[keep])
+                with open(self._path(name, generation), "wb") as f:
+                    f.write(data.tobytes())
+                    f.truncate(capacity * array[0].nbytes)
+                    f.flush()
+                    os.fsync(f.fileno())
+            with open(self._path("deleted.u8", generation), "wb") as f:
+                f.truncate(capacity)
+                os.fsync(f.fileno())
+
+            state = (self._count, self._capacity)
+            self._count, self._capacity, self._generation = count, capacity, generation
+            try:
+                self._save_meta()
+            except BaseException:
+                self._count, self._capacity = state
+                self._generation = old_generation
+                raise
+            self._codes = self._scales = self._vectors = self._ids = self._deleted = None
+            self._open()
+            # 新世代已生效；舊檔刪除失敗時留待下次開啟時清除
+            try:
+                for name in _DATA_FILES:
+                    os.remove(self._path(name, old_generation))
+            except OSError as e:
+                logger.warning(f"Failed to remove old quantized files in {self.directory}: {e}")
+            return removed
+
+    def fragmentation(self) -> float:
+        """
+        功能: 回傳標記刪除的列所佔比例。
+        參數:
+            無
+        回傳:
+            float: 0 到 1 之間的比例。
+        """
+        with self._lock:
+            return float(self._deleted[:self._count].mean()) if self._count else 0.0
+
+    def count(self) -> int:
+        """
+        功能: 回傳未刪除的向量數量。
+        參數:
+            無
+        回傳:
+            int: 數量。
+        """
+        with self._lock:
+            return int(self._count - self._deleted[:self._count].sum()) if self._count else 0
+
+    def memory_bytes(self) -> int:
+        """
+        功能: 回傳常駐記憶體的量化碼與縮放係數大小（全精度向量在磁碟映射上，不計入）。
+        參數:
+            無
+        回傳:
+            int: 位元組數。
+        """
+        if self._codes is None:
+            return 0
+        scale_bytes = self._scales.itemsize if self.mode == "int8" else 0
+        return self._count * (self._codes[0].nbytes + scale_bytes)
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+_CJK_CHAR_RE = re.compile("[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    功能: 估算文字的 token 數：中日韓文字每字約 1 個 token，其餘約每 4 個字元 1 個 token。
+          伺服器端不載入 LLM 的 tokenizer，用於預算控制已足夠；client_memory.py 在沒有 tokenizer 時也使用這份估算。
+    參數:
+        text (str): 文字。
+    回傳:
+        int: 估計的 token 數。
+    """
+    cjk = len(_CJK_CHAR_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def locate_child(parent_text: str, child: Document) -> Optional[Tuple[int, int]]:
+    """
+    功能: 找出子 chunk 在父文件中的位置。
+    參數:
+        parent_text (str): 父文件內容。
+        child  (Document): 子 chunk。
+    回傳:
+        Optional[Tuple[int, int]]: (起始, 結束) 偏移量，找不到時為 None。
+    """
+    start = parent_text.find(child.page_content)
+    if start < 0:
+        return None
+    return start, start + len(child.page_content)
+
+
+def _merge(spans: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """
+    功能: 合併重疊或相鄰的區間。
+    參數:
+        spans (List[Tuple[int, int]]): 區間列表。
+    回傳:
+        List[Tuple[int, int]]: 依起始位置排序、互不重疊的區間。
+    """
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def build_snippets(
+    parents: Sequence[Tuple[str, Document]],
+    child_docs: Sequence[Document],
+    id_key: str,
+    *,
+    context_chars: int = 200,
+    max_chars: Optional[int] = None,
+    max_tokens: Optional[int] = None,
+) -> Dict:
+    """
+    功能: 依子 chunk 的排名，逐一取出其在父文件中前後各 context_chars 個字元的視窗，同一父文件重疊的視窗合併，
+          總量超過字元或 token 預算時截斷並停止。
+    參數:
+        parents (Sequence[Tuple[str, Document]]): 依排名排序的 (父文件 ID, 父文件)。
+        child_docs     (Sequence[Document]): 依排名排序的子 chunk。
+        id_key                        (str): metadata 中父文件 ID 的欄位名稱。
+        context_chars                 (int): 子 chunk 前後保留的字元數。
+        max_chars           (int, optional): 字元預算。
+        max_tokens          (int, optional): token 預算（以 estimate_tokens 估算）。
+    回傳:
+        Dict: snippets（每個父文件的 parent_id、source、length 與 [{start, end, text}]）、
+              chars、tokens、truncated。
+    """
+    texts = {parent_id: parent.page_content for parent_id, parent in parents}
+    spans: Dict[str, List[Tuple[int, int]]] = {parent_id: [] for parent_id, _ in parents}
+
+    def cost(parent_spans: Dict[str, List[Tuple[int, int]]]) -> Tuple[int, int]:
+        pieces = [texts[pid][s:e] for pid, items in parent_spans.items() for s, e in items]
+        return sum(len(p) for p in pieces), sum(estimate_tokens(p) for p in pieces)
+
+    def fits(chars: int, tokens: int) -> bool:
+        return (max_chars is None or chars <= max_chars) and (max_tokens is None or tokens <= max_tokens)
+
+    truncated = False
+    for child in child_docs:
+        # 去重後共用的子 chunk 也可能只出現在其他引用它的父文件中
+        parent_id = next(
+            (pid for pid in [child.metadata.get(id_key), *child.metadata.get("shared_parents", [])] if pid in texts), None
+        )
+        if parent_id is None:
+            continue
+        located = locate_child(texts[parent_id], child)
+        if located is None:
+            continue
+        start = max(0, located[0] - context_chars)
+        end = min(len(texts[parent_id]), located[1] + context_chars)
+
+        candidate = {**spans, parent_id: _merge(spans[parent_id] + [(start, end)])}
+        if fits(*cost(candidate)):
+            spans = candidate
+            continue
+
+        # 放不下整個視窗時，以子 chunk 為中心縮小視窗直到符合預算
+        truncated = True
+        mid = (located[0] + located[1]) // 2
+
+        def shrink(size: int) -> Dict[str, List[Tuple[int, int]]]:
+            s = max(0, min(mid - size // 2, len(texts[parent_id]) - size))
+            return {**spans, parent_id: _merge(spans[parent_id] + [(s, s + size)])}
+
+        low, high = 0, end - start
+        while low < high:
+            size = (low + high + 1) // 2
+            if fits(*cost(shrink(size))):
+                low = size
+            else:
+                high = size - 1
+        if low > 0:
+            spans = shrink(low)
+        break
+
+    snippets = []
+    for parent_id, parent in parents:
+        if not spans[parent_id]:
+            continue
+        snippets.append({
+            "parent_id": parent_id,
+            "source": parent.metadata.get("source"),
+            "length": len(parent.page_content),
+            "snippets": [
+                {"start": s, "end": e, "text": parent.page_content[s:e]} for s, e in spans[parent_id]
+            ],
+        })
+    chars, tokens = cost(spans)
+    return {"snippets": snippets, "chars": chars, "tokens": tokens, "truncated": truncated}
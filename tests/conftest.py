@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+import pytest
+
+# 伺服器模組以 servers/ 為工作目錄互相匯入
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "servers"))
+
+# parent_rag_server 匯入時即讀取這些設定（.env 通常會提供）
+for name, value in {"CHILD_CHUNK_SIZE": "200", "CHILD_CHUNK_OVERLAP": "0", "TOP_K": "3", "DEVICE": "cpu"}.items():
+    os.environ.setdefault(name, value)
+
+
+@pytest.fixture
+def make_engine(tmp_path):
+    """
+    功能: 建立使用暫存目錄與假 embedding 的 ParentRAGEngine，不需下載模型。
+    參數:
+        tmp_path: pytest 暫存目錄。
+    回傳:
+        Callable: 以關鍵字參數覆寫 ParentRAGEngine 設定的工廠函式。
+    """
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+    from parent_rag_server import ParentRAGEngine
+
+    engines = []
+
+    def factory(**overrides):
+        options = {
+            "database_dir": str(tmp_path / "db"),
+            "collection_name": "test",
+            "child_chunk_size": 200,
+            "child_chunk_overlap": 0,
+            "embeddings": DeterministicFakeEmbedding(size=32),
+        }
+        options.update(overrides)
+        os.makedirs(options["database_dir"], exist_ok=True)
+        engine = ParentRAGEngine(**options)
+        engines.append(engine)
+        return engine
+
+    yield factory
+    for engine in engines:
+        engine.vector_store.client.close()
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from langchain_core.tools import StructuredTool
+
+import client_cache
+from client_cache import ToolResultCache
+
+
+def make_tool(name, server, calls, delay=0.0):
+    """
+    功能: 建立記錄呼叫次數的假 MCP 工具。
+    參數:
+        name    (str): 工具名稱。
+        server  (str): 所屬伺服器。
+        calls  (list): 呼叫紀錄。
+        delay (float): 模擬的耗時秒數。
+    回傳:
+        StructuredTool: 工具。
+    """
+    async def call(**arguments):
+        calls.append((name, arguments))
+        await asyncio.sleep(delay)
+        return f"{name}:{len(calls)}"
+
+    return StructuredTool(
+        name=name,
+        description=name,
+        args_schema={"type": "object", "properties": {"x": {"type": "string"}}},
+        coroutine=call,
+        metadata={"mcp_server": server},
+    )
+
+
+def wrap(cache, *specs):
+    calls = []
+    tools = cache.wrap([make_tool(name, server, calls, *extra) for name, server, *extra in specs])
+    return {tool.name: tool for tool in tools}, calls
+
+
+def test_ttl_expiry(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(client_cache.time, "monotonic", lambda: now[0])
+    cache = ToolResultCache()
+    tools, calls = wrap(cache, ("list_directory", "filesystem"), ("add", "math"))
+
+    async def main():
+        first = await tools["list_directory"].ainvoke({"x": "/tmp"})
+        assert await tools["list_directory"].ainvoke({"x": "/tmp"}) == first
+        now[0] += 31
+        assert await tools["list_directory"].ainvoke({"x": "/tmp"}) != first
+        # 純函式不過期
+        total = await tools["add"].ainvoke({"x": "1"})
+        now[0] += 10 ** 6
+        assert await tools["add"].ainvoke({"x": "1"}) == total
+
+    asyncio.run(main())
+    assert [name for name, _ in calls] == ["list_directory", "list_directory", "add"]
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (2, 3)
+
+
+def test_write_tool_invalidates_its_server():
+    cache = ToolResultCache()
+    tools, calls = wrap(
+        cache, ("list_tables", "database"), ("insert_data", "database"), ("list_directory", "filesystem"),
+        ("convert_to_markdown", "markitdown"),
+    )
+
+    async def main():
+        await tools["list_tables"].ainvoke({})
+        await tools["list_directory"].ainvoke({"x": "."})
+        await tools["insert_data"].ainvoke({"x": "row"})
+        await tools["list_tables"].ainvoke({})
+        await tools["list_directory"].ainvoke({"x": "."})
+        # markitdown 寫出檔案，一併清除檔案系統的快取
+        await tools["convert_to_markdown"].ainvoke({"x": "a.pdf"})
+        await tools["list_directory"].ainvoke({"x": "."})
+
+    asyncio.run(main())
+    assert [name for name, _ in calls] == [
+        "list_tables", "list_directory", "insert_data", "list_tables", "convert_to_markdown", "list_directory",
+    ]
+
+
+def test_read_during_write_is_not_stored():
+    cache = ToolResultCache()
+    tools, calls = wrap(cache, ("list_tables", "database", 0.05), ("insert_data", "database", 0.01))
+
+    async def main():
+        read = asyncio.create_task(tools["list_tables"].ainvoke({}))
+        await asyncio.sleep(0)
+        await tools["insert_data"].ainvoke({"x": "row"})
+        await read
+        await tools["list_tables"].ainvoke({})
+
+    asyncio.run(main())
+    assert [name for name, _ in calls] == ["list_tables", "insert_data", "list_tables"]
+
+
+def test_concurrent_identical_calls_are_sent_once():
+    cache = ToolResultCache()
+    tools, calls = wrap(cache, ("get_table_schema", "database", 0.05))
+
+    async def main():
+        return await asyncio.gather(*[tools["get_table_schema"].ainvoke({"x": "users"}) for _ in range(5)])
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert len(set(results)) == 1
+    assert cache.stats()["hits"] == 4
+
+
+def test_failed_call_is_not_cached():
+    cache = ToolResultCache()
+    attempts = []
+
+    async def flaky(**arguments):
+        attempts.append(arguments)
+        if len(attempts) == 1:
+            raise ConnectionError("server restarting")
+        return "ok"
+
+    tool = StructuredTool(
+        name="list_tables", description="", args_schema={"type": "object", "properties": {}},
+        coroutine=flaky, metadata={"mcp_server": "database"},
+    )
+    wrapped = cache.wrap([tool])[0]
+
+    async def main():
+        try:
+            await wrapped.ainvoke({})
+        except ConnectionError:
+            pass
+        return await wrapped.ainvoke({}), await wrapped.ainvoke({})
+
+    assert asyncio.run(main()) == ("ok", "ok")
+    assert len(attempts) == 2
+
+
+def test_rag_and_query_tools_bypass_the_cache():
+    cache = ToolResultCache()
+    names = ("retrieve", "retrieve_many", "get_parent_document", "query_data")
+    tools, calls = wrap(cache, ("list_tables", "database"), *[(name, "parentrag") for name in names])
+
+    async def main():
+        await tools["list_tables"].ainvoke({})
+        for name in names:
+            await tools[name].ainvoke({"x": "q"})
+            await tools[name].ainvoke({"x": "q"})
+        await tools["list_tables"].ainvoke({})
+
+    asyncio.run(main())
+    # 每次都送到伺服器，且不會清除其他工具的快取
+    assert [name for name, _ in calls] == ["list_tables"] + [name for name in names for _ in range(2)]
+    assert cache.stats()["hits"] == 1
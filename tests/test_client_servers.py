@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+
+import pytest
+from mcp.types import CallToolResult, TextContent
+
+import client_servers
+from client_servers import LazyServer, LazyServerPool, describe_error
+
+
+class FakeSession:
+    def __init__(self, name, events):
+        self.name = name
+        self.events = events
+
+    async def list_tools(self):
+        tool = type("Tool", (), {
+            "name": f"{self.name}_echo",
+            "description": "echo",
+            "inputSchema": {"type": "object", "properties": {"text": {"type": "string"}}},
+        })
+        return type("Result", (), {"tools": [tool]})
+
+    async def call_tool(self, tool_name, arguments):
+        self.events.append(("call", self.name, tool_name))
+        return CallToolResult(content=[TextContent(type="text", text=arguments["text"])], isError=False)
+
+
+@pytest.fixture
+def events(monkeypatch):
+    """
+    功能: 以假 session 取代實際連線，記錄每個伺服器的啟動、呼叫與關閉。
+    參數:
+        monkeypatch: pytest monkeypatch。
+    回傳:
+        list: (事件, 伺服器名稱, ...) 紀錄。
+    """
+    log = []
+
+    async def fake_open(self, stack):
+        if self.connection.get("fail"):
+            raise ConnectionError(f"{self.name} refused")
+        log.append(("open", self.name))
+        stack.callback(log.append, ("close", self.name))
+        return FakeSession(self.name, log)
+
+    monkeypatch.setattr(LazyServer, "_open", fake_open)
+    return log
+
+
+def connections(**extra):
+    servers = {
+        "math": {"transport": "sse", "url": "http://127.0.0.1:1/math"},
+        "files": {"transport": "sse", "url": "http://127.0.0.1:1/files"},
+    }
+    servers.update(extra)
+    return servers
+
+
+def test_manifest_is_reused_without_starting_servers(tmp_path, events):
+    manifest = str(tmp_path / "manifest.json")
+
+    async def load(servers):
+        async with LazyServerPool(servers, manifest, idle_timeout=0) as pool:
+            tools = await pool.get_tools()
+            return sorted(tool.name for tool in tools), pool.stats()
+
+    names, stats = asyncio.run(load(connections()))
+    assert names == ["files_echo", "math_echo"]
+    assert stats["manifest_misses"] == 2
+    assert [event for event in events if event[0] == "open"] == [("open", "math"), ("open", "files")]
+
+    events.clear()
+    names, stats = asyncio.run(load(connections()))
+    assert names == ["files_echo", "math_echo"]
+    assert (stats["manifest_hits"], stats["manifest_misses"]) == (2, 0)
+    assert events == []
+
+    # 設定改變的伺服器重新取得清單，其餘沿用快取
+    changed = connections(files={"transport": "sse", "url": "http://127.0.0.1:2/files"})
+    names, stats = asyncio.run(load(changed))
+    assert (stats["manifest_hits"], stats["manifest_misses"]) == (1, 1)
+    assert [event for event in events if event[0] == "open"] == [("open", "files")]
+    with open(manifest, encoding="utf-8") as f:
+        assert json.load(f)["servers"]["files"]["fingerprint"] == client_servers.connection_fingerprint(changed["files"])
+
+
+def test_failed_server_is_skipped(tmp_path, events):
+    async def main():
+        async with LazyServerPool(connections(broken={"transport": "sse", "url": "x", "fail": True}),
+                                  str(tmp_path / "manifest.json"), idle_timeout=0) as pool:
+            tools = await pool.get_tools()
+            return [tool.name for tool in tools], pool.stats()
+
+    names, stats = asyncio.run(main())
+    assert sorted(names) == ["files_echo", "math_echo"]
+    assert stats["failed"] == {"broken": "ConnectionError: broken refused"}
+
+
+def test_idle_server_is_reaped_and_restarted_on_next_call(tmp_path, events):
+    async def main():
+        async with LazyServerPool(connections(), str(tmp_path / "manifest.json"), idle_timeout=0.2) as pool:
+            tools = {tool.name: tool for tool in await pool.get_tools()}
+            await pool.servers["files"].shutdown()
+            assert await tools["math_echo"].ainvoke({"text": "一"}) == "一"
+            # 閒置檢查至少每秒一次
+            await asyncio.sleep(1.5)
+            stopped = not pool.servers["math"].running
+            assert await tools["math_echo"].ainvoke({"text": "二"}) == "二"
+            return stopped, pool.stats()
+
+    stopped, stats = asyncio.run(main())
+    assert stopped
+    assert stats["servers"]["math"]["spawns"] == 2
+    assert stats["servers"]["math"]["calls"] == 2
+    assert stats["servers"]["files"]["spawns"] == 1
+    math_events = [event[0] for event in events if event[1] == "math"]
+    assert math_events == ["open", "call", "close", "open", "call", "close"]
+
+
+def test_busy_server_is_not_reaped(tmp_path, events, monkeypatch):
+    async def main():
+        gate = asyncio.Event()
+
+        async def slow_call(self, tool_name, arguments):
+            await gate.wait()
+            return CallToolResult(content=[TextContent(type="text", text="done")], isError=False)
+
+        monkeypatch.setattr(FakeSession, "call_tool", slow_call)
+        async with LazyServerPool(connections(), str(tmp_path / "manifest.json"), idle_timeout=0.2) as pool:
+            tools = {tool.name: tool for tool in await pool.get_tools()}
+            call = asyncio.create_task(tools["math_echo"].ainvoke({"text": "x"}))
+            await asyncio.sleep(1.5)
+            running = pool.servers["math"].running
+            gate.set()
+            return running, await call
+
+    assert asyncio.run(main()) == (True, "done")
+
+
+def test_describe_error_unwraps_exception_groups():
+    # Python 3.10 沒有內建的 ExceptionGroup，改用模組選定的類別（內建或 exceptiongroup 套件）
+    error = client_servers._ExceptionGroup("task group", [ConnectionError("refused")])
+    assert describe_error(error) == "ConnectionError: refused"
+    assert describe_error(ValueError("bad")) == "ValueError: bad"
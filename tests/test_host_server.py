@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from starlette.testclient import TestClient
+
+from host_server import create_host_app, load_servers
+
+INITIALIZE = {
+    "jsonrpc": "2.0",
+    "id": 1,
+    "method": "initialize",
+    "params": {"protocolVersion": "2025-03-26", "capabilities": {}, "clientInfo": {"name": "test", "version": "0"}},
+}
+
+
+@pytest.fixture
+def host_client():
+    """
+    功能: 以 math 伺服器建立主機應用並回傳送出 initialize 請求的函式。
+    參數:
+        無
+    回傳:
+        Callable: 以主機設定建立應用，回傳 post(Host, Origin) -> HTTP 狀態碼。
+    """
+    executor = ThreadPoolExecutor(max_workers=2)
+    clients = []
+
+    def factory(**options):
+        servers = load_servers(["math"])
+        # session manager 在第一次建立應用時產生且只能執行一次，每個測試重新建立
+        servers["math"][1]._session_manager = None
+        client = TestClient(create_host_app(servers, executor, **options)).__enter__()
+        clients.append(client)
+
+        def post(host, origin=None):
+            headers = {"Accept": "application/json, text/event-stream", "Host": host}
+            if origin:
+                headers["Origin"] = origin
+            return client.post("/math/mcp/", json=INITIALIZE, headers=headers).status_code
+
+        return post
+
+    yield factory
+    for client in clients:
+        client.__exit__(None, None, None)
+    executor.shutdown(wait=False)
+
+
+def test_non_loopback_bind_keeps_dns_rebinding_protection(host_client):
+    post = host_client(host="0.0.0.0")
+    assert post("127.0.0.1:3000") == 200
+    assert post("attacker.example:3000") == 421
+    assert post("127.0.0.1:3000", origin="http://attacker.example") == 403
+
+
+def test_allowed_hosts_are_an_explicit_opt_in(host_client):
+    post = host_client(host="0.0.0.0", allowed_hosts=["10.0.0.5:*"], allowed_origins=["http://10.0.0.5:8080"])
+    assert post("10.0.0.5:3000") == 200
+    assert post("10.0.0.5:3000", origin="http://10.0.0.5:8080") == 200
+    assert post("10.0.0.6:3000") == 421
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import parent_rag_server
+from parent_rag_server import LazyParentRAG
+
+
+def test_waiting_for_warmup_does_not_hold_pool_threads(monkeypatch):
+    release = threading.Event()
+
+    class SlowEngine:
+        def __init__(self):
+            release.wait(5)
+
+    monkeypatch.setattr(parent_rag_server, "ParentRAGEngine", SlowEngine)
+    monkeypatch.setattr(parent_rag_server, "RetrieveBatcher", lambda engine, executor: None)
+    lazy = LazyParentRAG(timeout=5)
+
+    async def main():
+        # 只有一個執行緒的預設池：若等待暖機佔用執行緒，其他 to_thread 工作會卡到暖機結束
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=1))
+        waiters = [asyncio.create_task(lazy.get()) for _ in range(8)]
+        await asyncio.sleep(0.05)
+        assert await asyncio.wait_for(asyncio.to_thread(lambda: "other tool"), 1) == "other tool"
+        assert not any(waiter.done() for waiter in waiters)
+        release.set()
+        engines = await asyncio.wait_for(asyncio.gather(*waiters), 5)
+        assert all(engine is lazy.engine for engine in engines)
+
+    asyncio.run(main())
+    assert lazy.status()["ready"]
+
+
+def test_warmup_failure_is_reported_to_waiters(monkeypatch):
+    class BrokenEngine:
+        def __init__(self):
+            raise OSError("model not found")
+
+    monkeypatch.setattr(parent_rag_server, "ParentRAGEngine", BrokenEngine)
+    lazy = LazyParentRAG(timeout=5)
+
+    async def main():
+        try:
+            await lazy.get()
+        except RuntimeError as e:
+            return str(e)
+
+    assert "model not found" in asyncio.run(main())
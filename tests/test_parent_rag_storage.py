@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import time
+
+import pytest
+
+import parent_rag_server
+import rag_docstore
+
+FILES = {
+    "alpha.txt": "甲類文件說明料號 AA-1001 的電氣特性與測試流程。",
+    "beta.txt": "乙類文件說明料號 BB-2002 的包裝方式與出貨檢驗。",
+    "gamma.txt": "丙類文件說明料號 CC-3003 的機構尺寸與組裝步驟。",
+}
+
+
+def close(engine):
+    engine.vector_store.client.close()
+    engine.byte_store.close()
+
+
+def ingest(engine, tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir(exist_ok=True)
+    for name, text in FILES.items():
+        (docs / name).write_text(text, encoding="utf-8")
+    engine.ingest_directory(str(docs))
+    return docs
+
+
+def sources(engine, query, search="keyword"):
+    result = engine.retrieve(query, k=10, search=search)
+    return sorted({doc.metadata["source"].rsplit("/", 1)[-1] for doc in result["parent_documents"]})
+
+
+def assert_beta_removed(engine):
+    assert sources(engine, "BB-2002 包裝") == []
+    assert sources(engine, "AA-1001 電氣") == ["alpha.txt"]
+    assert sources(engine, "CC-3003 機構") == ["gamma.txt"]
+    assert sources(engine, "料號", search="vector") == ["alpha.txt", "gamma.txt"]
+    assert engine.manifest.count() == 2
+    assert len(list(engine.byte_store.yield_keys())) == 2
+
+
+@pytest.mark.parametrize("quantization", ["none", "int8"])
+def test_remove_and_compact_survive_reopen(make_engine, tmp_path, monkeypatch, quantization):
+    monkeypatch.setattr(parent_rag_server, "VECTOR_QUANTIZATION", quantization)
+    engine = make_engine()
+    docs = ingest(engine, tmp_path)
+
+    removed = engine.remove_documents(sources=[str(docs / "beta.txt")])
+    assert removed == {"parents": 1, "children": 1}
+    assert engine.fragmentation() > 0
+    assert_beta_removed(engine)
+
+    report = engine.compact(force=True)
+    assert report["vector_index_rebuilt"]
+    assert report["docstore_bytes"]["after"] < report["docstore_bytes"]["before"]
+    assert engine.fragmentation() == 0
+    assert_beta_removed(engine)
+    close(engine)
+
+    reopened = make_engine()
+    assert reopened.fragmentation() == 0
+    assert_beta_removed(reopened)
+    # 重新匯入時已刪除的檔案不會被誤判為未變更
+    (docs / "beta.txt").unlink()
+    counts = reopened.ingest_directory(str(docs))
+    assert (counts["added"], counts["skipped"], counts["removed"]) == (0, 2, 0)
+
+
+def test_crash_during_docstore_compaction_keeps_data(make_engine, tmp_path, monkeypatch):
+    engine = make_engine()
+    docs = ingest(engine, tmp_path)
+    engine.remove_documents(sources=[str(docs / "beta.txt")])
+
+    def crash(src, dst):
+        raise OSError("power loss")
+
+    monkeypatch.setattr(rag_docstore.os, "replace", crash)
+    with pytest.raises(OSError):
+        engine.compact(force=True)
+    monkeypatch.undo()
+    close(engine)
+
+    reopened = make_engine()
+    assert_beta_removed(reopened)
+    reopened.compact(force=True)
+    assert_beta_removed(reopened)
+
+
+def test_rebuild_stops_waiting_for_stuck_compaction(make_engine, tmp_path, monkeypatch):
+    engine = make_engine()
+    ingest(engine, tmp_path)
+    client = engine.vector_store.client
+    polls = []
+    monkeypatch.setattr(parent_rag_server, "MILVUS_COMPACTION_TIMEOUT", 0.2)
+    monkeypatch.setattr(client, "compact", lambda collection: 7)
+    monkeypatch.setattr(client, "get_compaction_state", lambda job_id: polls.append(job_id) or "Executing")
+
+    start = time.monotonic()
+    engine._rebuild_vector_index()
+    assert time.monotonic() - start < 5
+    assert polls and set(polls) == {7}
+    assert sources(engine, "料號", search="vector") == ["alpha.txt", "beta.txt", "gamma.txt"]
+
+
+@pytest.mark.parametrize("backend", ["log", "pickle"])
+def test_stats_counts_parents_without_scanning(make_engine, tmp_path, monkeypatch, backend):
+    monkeypatch.setattr(parent_rag_server, "DOCSTORE_BACKEND", backend)
+    engine = make_engine()
+    docs = ingest(engine, tmp_path)
+    engine.remove_documents(sources=[str(docs / "beta.txt")])
+
+    def scan(*args, **kwargs):
+        raise AssertionError("stats should not list every key")
+
+    monkeypatch.setattr(engine.byte_store, "yield_keys", scan)
+    assert engine.stats()["sizes"]["parents"] == 2
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import pytest
+from langchain_core.documents import Document
+
+from rag_bm25 import BM25Index, reciprocal_rank_fusion, tokenize
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("品質管理", ["品質", "質管", "管理"]),
+    ("料號：AB-1234。", ["料號", "ab", "1234", "ab1234"]),
+    # 全形英數經 NFKC 正規化，單一 CJK 字元保留為一個詞
+    ("Ｍ３螺絲 與 v1.2.0", ["m3", "螺絲", "與", "v1", "2", "0", "v120"]),
+    ("カタカナ", ["カタ", "タカ", "カナ"]),
+    ("，。！", []),
+])
+def test_tokenize(text, expected):
+    assert tokenize(text) == expected
+
+
+def chunk(text, parent_id, **metadata):
+    return Document(page_content=text, metadata={"doc_id": parent_id, **metadata})
+
+
+def make_index(tmp_path):
+    index = BM25Index(str(tmp_path / "bm25.db"))
+    index.add(
+        [1, 2, 3],
+        [
+            chunk("料號 AB-1234 的電氣特性", "p1", source="a.txt"),
+            chunk("料號 CD-5678 的包裝方式", "p1", source="a.txt"),
+            chunk("品質管理部門負責出貨檢驗", "p2", source="b.txt"),
+        ],
+        "doc_id",
+    )
+    return index
+
+
+def test_search_ranks_and_reopens(tmp_path):
+    make_index(tmp_path)
+    index = BM25Index(str(tmp_path / "bm25.db"))
+    assert index.count() == 3
+    assert sorted(index.child_ids()) == [1, 2, 3]
+    assert sorted(index.children_of(["p1", "missing"])) == [1, 2]
+
+    results = index.search("ab1234 電氣", k=10)
+    assert [doc.metadata["pk"] for doc in results] == [1]
+    assert results[0].metadata["source"] == "a.txt"
+    assert results[0].metadata["bm25_score"] > 0
+    # 任一詞彙命中即為候選，命中較多詞彙者排在前面
+    assert [doc.metadata["pk"] for doc in index.search("料號 包裝", k=10)] == [2, 1]
+    assert [doc.metadata["pk"] for doc in index.search("品質檢驗", k=10)] == [3]
+    assert index.search("，", k=10) == []
+    assert index.get([3, 99])[3].page_content == "品質管理部門負責出貨檢驗"
+
+
+def test_replace_and_delete(tmp_path):
+    index = make_index(tmp_path)
+    index.add([2], [chunk("料號 CD-5678 改為紙箱包裝", "p1")], "doc_id")
+    assert index.count() == 3
+    assert index.search("紙箱", k=10)[0].metadata["pk"] == 2
+
+    index.delete([1, 2, 99])
+    assert index.search("料號", k=10) == []
+    assert index.children_of(["p1"]) == []
+    index.optimize()
+
+    reopened = BM25Index(str(tmp_path / "bm25.db"))
+    assert reopened.child_ids() == [3]
+    assert reopened.search("ab1234", k=10) == []
+
+
+def ranked(*pks):
+    return [Document(page_content=str(pk), metadata={"pk": pk}) for pk in pks]
+
+
+def test_reciprocal_rank_fusion_ordering():
+    vector = ranked(1, 2, 3)
+    keyword = ranked(3, 4, 1)
+    keyword[0].metadata["bm25_score"] = 2.5
+
+    fused = reciprocal_rank_fusion([vector, keyword], k=3, rrf_k=60)
+    # 兩邊都出現的排在前面；同分時維持先出現的順序
+    assert [doc.metadata["pk"] for doc in fused] == [1, 3, 2]
+    assert fused[0].metadata["rrf_score"] == pytest.approx(1 / 61 + 1 / 63)
+    # 合併時保留另一份結果才有的 metadata
+    assert fused[1].metadata["bm25_score"] == 2.5
+    assert reciprocal_rank_fusion([[], []], k=3) == []
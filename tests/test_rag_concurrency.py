@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from rag_concurrency import JobRegistry, QueryGate, ReadWriteLock
+
+
+def start(target):
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_writers_are_exclusive():
+    lock = ReadWriteLock()
+    inside, peak = [0], [0]
+
+    def write():
+        for _ in range(20):
+            with lock.write():
+                inside[0] += 1
+                peak[0] = max(peak[0], inside[0])
+                time.sleep(0.001)
+                inside[0] -= 1
+
+    threads = [start(write) for _ in range(4)]
+    for thread in threads:
+        thread.join(5)
+    assert peak[0] == 1
+
+
+def test_readers_share_the_lock():
+    lock = ReadWriteLock()
+    barrier = threading.Barrier(3, timeout=5)
+    passed = []
+
+    def read():
+        with lock.read():
+            barrier.wait()
+            passed.append(True)
+
+    threads = [start(read) for _ in range(3)]
+    for thread in threads:
+        thread.join(5)
+    assert len(passed) == 3
+
+
+def test_readers_wait_for_writer():
+    lock = ReadWriteLock()
+    writing, read_done = threading.Event(), threading.Event()
+    release = threading.Event()
+
+    def write():
+        with lock.write():
+            writing.set()
+            release.wait(5)
+
+    def read():
+        with lock.read():
+            read_done.set()
+
+    start(write)
+    writing.wait(5)
+    start(read)
+    assert not read_done.wait(0.1)
+    release.set()
+    assert read_done.wait(5)
+
+
+def test_waiting_writer_blocks_new_readers():
+    lock = ReadWriteLock()
+    order = []
+    reading, release = threading.Event(), threading.Event()
+
+    def first_reader():
+        with lock.read():
+            reading.set()
+            release.wait(5)
+            order.append("reader-1")
+
+    def writer():
+        with lock.write():
+            order.append("writer")
+
+    def second_reader():
+        with lock.read():
+            order.append("reader-2")
+
+    threads = [start(first_reader)]
+    reading.wait(5)
+    threads.append(start(writer))
+    time.sleep(0.05)
+    threads.append(start(second_reader))
+    time.sleep(0.05)
+    # 寫入者排隊中，新的讀取者不能插隊
+    assert order == []
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert order == ["reader-1", "writer", "reader-2"]
+
+
+def test_write_lock_is_reentrant_and_allows_reads():
+    lock = ReadWriteLock()
+    read_done = threading.Event()
+
+    def read():
+        with lock.read():
+            read_done.set()
+
+    with lock.write():
+        with lock.write():
+            with lock.read():
+                pass
+        # 內層寫入結束後仍由外層持有
+        thread = start(read)
+        assert not read_done.wait(0.1)
+    assert read_done.wait(5)
+    thread.join(5)
+
+
+def test_query_gate_yields_until_queries_finish():
+    gate = QueryGate(max_yield=5)
+    start_time = time.monotonic()
+    gate.yield_to_queries()
+    assert time.monotonic() - start_time < 0.1
+
+    def query():
+        with gate.active():
+            time.sleep(0.2)
+
+    thread = start(query)
+    time.sleep(0.05)
+    start_time = time.monotonic()
+    gate.yield_to_queries()
+    waited = time.monotonic() - start_time
+    thread.join(5)
+    assert 0.05 < waited < 2
+
+
+def test_query_gate_waits_at_most_max_yield():
+    gate = QueryGate(max_yield=0.1)
+    with gate.active():
+        start_time = time.monotonic()
+        gate.yield_to_queries()
+        assert 0.05 < time.monotonic() - start_time < 2
+
+
+def test_job_status_transitions():
+    registry = JobRegistry()
+    started, release = threading.Event(), threading.Event()
+
+    def work(value, progress):
+        progress({"done": 1})
+        started.set()
+        release.wait(5)
+        return value * 2
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        # 第一個工作佔住唯一的執行緒，第二個工作保持排隊
+        running_id = registry.submit(executor, "ingest", work, 21)
+        started.wait(5)
+        queued_id = registry.submit(executor, "ingest", work, 1)
+        assert registry.get(queued_id)["state"] == "queued"
+        job = registry.get(running_id)
+        assert (job["state"], job["progress"], job["finished_at"]) == ("running", {"done": 1}, None)
+        release.set()
+
+    job = registry.get(running_id)
+    assert (job["state"], job["result"], job["error"]) == ("succeeded", 42, None)
+    assert job["created_at"] <= job["started_at"] <= job["finished_at"]
+    assert registry.get(queued_id)["state"] == "succeeded"
+    assert registry.get("missing") is None
+
+
+def test_failed_job_reports_error():
+    registry = JobRegistry()
+
+    def broken(progress):
+        raise ValueError("bad document")
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        job_id = registry.submit(executor, "ingest", broken)
+    job = registry.get(job_id)
+    assert (job["state"], job["error"], job["result"]) == ("failed", "bad document", None)
+
+
+def test_finished_jobs_are_pruned():
+    registry = JobRegistry(max_finished=2)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        ids = [registry.submit(executor, "noop", lambda progress: None) for _ in range(3)]
+    # 下一次提交時才修剪，只保留最新的已結束工作
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        ids.append(registry.submit(executor, "noop", lambda progress: None))
+    assert [job["job_id"] for job in registry.list()] == ids[1:]
+    assert registry.get(ids[0]) is None
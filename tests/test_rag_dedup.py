@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import parent_rag_server
+from rag_dedup import ChildDeduplicator, SignatureSet, is_near_duplicate, signature
+
+TABLE_A = "\n".join([
+    "| 料號 | 電壓 | 電流 | 溫度 | 備註 |",
+    "| --- | --- | --- | --- | --- |",
+    "| AB-1001 | 5V | 1A | 25C | 量產 |",
+    "| AB-1002 | 5V | 1A | 25C | 量產 |",
+    "| AB-1003 | 5V | 1A | 25C | 量產 |",
+])
+TABLE_B = "\n".join([
+    "| 料號 | 電壓 | 電流 | 溫度 | 備註 |",
+    "| --- | --- | --- | --- | --- |",
+    "| CD-2001 | 12V | 3A | 60C | 試產 |",
+    "| CD-2002 | 12V | 3A | 60C | 試產 |",
+    "| CD-2003 | 12V | 3A | 60C | 試產 |",
+])
+BOILERPLATE = "本規格書適用於料號 AB-{} 之產品，內容包含電氣特性、機構尺寸、包裝方式與品質保證條款，未經許可不得轉載"
+DISCLAIMER = "本文件僅供內部參考使用，未經許可不得轉載或散布，如有疑問請洽品質管理部門窗口"
+
+
+def test_repeated_tokens_do_not_collapse_signatures():
+    a, b = signature(TABLE_A), signature(TABLE_B)
+    assert a[1] != b[1]
+    assert not is_near_duplicate(a, b, 3)
+
+
+def test_near_duplicate_requires_same_numbers():
+    a, b = signature(BOILERPLATE.format(1001)), signature(BOILERPLATE.format(1002))
+    assert not is_near_duplicate(a, b, 64, 0.0)
+    reordered = signature(BOILERPLATE.format(1001).replace("電氣特性、機構尺寸", "機構尺寸、電氣特性"))
+    assert is_near_duplicate(a, reordered, 64, 0.9)
+
+
+def test_exact_only_by_default(tmp_path):
+    sig = signature(DISCLAIMER + "。")
+    other = signature(DISCLAIMER.replace("散布", "散佈") + "。")
+    pending = SignatureSet()
+    pending.add(sig, "first")
+    assert pending.find(sig) == "first"
+    assert pending.find(other) is None
+
+    deduplicator = ChildDeduplicator(str(tmp_path / "dedup.db"))
+    deduplicator.add([1], [sig], ["parent"])
+    assert deduplicator.find(sig) == 1
+    assert deduplicator.find(other) is None
+
+
+@pytest.mark.parametrize("near", [False, True])
+def test_distinct_chunks_stay_retrievable(make_engine, tmp_path, monkeypatch, near):
+    monkeypatch.setattr(parent_rag_server, "CHILD_NEAR_DEDUP", near)
+    engine = make_engine()
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "table_a.txt").write_text(TABLE_A, encoding="utf-8")
+    (docs / "table_b.txt").write_text(TABLE_B, encoding="utf-8")
+    for number in range(1001, 1006):
+        (docs / f"spec_{number}.txt").write_text(BOILERPLATE.format(number), encoding="utf-8")
+
+    counts = engine.ingest_directory(str(docs))
+    assert counts["added"] == 7
+    assert counts["duplicates"] == 0
+    assert engine.keyword_index.count() == counts["chunks"]
+
+    result = engine.retrieve("CD-2002", k=1, search="keyword")
+    assert "CD-2002" in result["child_documents"][0].page_content
+    for number in range(1001, 1006):
+        result = engine.retrieve(f"AB-{number} 規格書", k=1, search="keyword")
+        child = result["child_documents"][0]
+        assert f"AB-{number}" in child.page_content
+        assert "shared_parents" not in child.metadata
+
+
+def test_exact_duplicates_are_shared(make_engine, tmp_path):
+    engine = make_engine(child_chunk_size=50)
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    for number in range(3):
+        (docs / f"doc_{number}.txt").write_text(f"第{number}份文件說明料號 XY-{number} 的測試流程。\n\n{DISCLAIMER}", encoding="utf-8")
+
+    counts = engine.ingest_directory(str(docs))
+    assert counts["duplicates"] == 2
+    result = engine.retrieve("品質管理部門窗口", k=1, search="keyword")
+    assert len(result["child_documents"][0].metadata["shared_parents"]) == 2
+    assert len(result["parent_ids"]) == 3
+
+
+@pytest.mark.parametrize("search", ["keyword", "hybrid", "vector"])
+def test_shared_chunk_moves_to_surviving_owner(make_engine, tmp_path, search):
+    engine = make_engine(child_chunk_size=50)
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    for name, number in (("f1.txt", 1), ("f2.txt", 2)):
+        (docs / name).write_text(f"第{number}份文件說明料號 XY-{number} 的測試流程。\n\n{DISCLAIMER}", encoding="utf-8")
+    assert engine.ingest_directory(str(docs))["duplicates"] == 1
+    survivor = engine.manifest.get(str(docs / "f2.txt"))["parent_id"]
+
+    engine.remove_documents(sources=[str(docs / "f1.txt")])
+    result = engine.retrieve("品質管理部門窗口", k=10, search=search)
+    shared = [doc for doc in result["child_documents"] if DISCLAIMER in doc.page_content]
+    assert len(shared) == 1
+    assert shared[0].metadata["source"].endswith("f2.txt")
+    assert shared[0].metadata[engine.retriever.id_key] == survivor
+    assert "shared_parents" not in shared[0].metadata
+    assert survivor in result["parent_ids"]
+    assert all(doc.metadata["source"].endswith("f2.txt") for doc in result["parent_documents"])
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+
+import rag_docstore
+from rag_docstore import LogStructuredStore
+
+
+def open_store(path, **options):
+    options.setdefault("fsync", False)
+    return LogStructuredStore(str(path), **options)
+
+
+def segment_files(path):
+    return sorted(name for name in os.listdir(path) if name.endswith((".seg", ".base")))
+
+
+def test_truncated_tail_is_dropped_on_reopen(tmp_path):
+    store = open_store(tmp_path)
+    store.mset([("a", b"first"), ("b", b"second")])
+    store.close()
+    last = tmp_path / segment_files(tmp_path)[-1]
+    size = last.stat().st_size
+    with open(last, "r+b") as f:
+        f.truncate(size - 3)
+
+    store = open_store(tmp_path)
+    assert store.mget(["a", "b"]) == [b"first", None]
+    store.mset([("c", b"third")])
+    store.close()
+
+    store = open_store(tmp_path)
+    assert store.mget(["a", "b", "c"]) == [b"first", None, b"third"]
+    store.close()
+
+
+def test_corrupted_tail_is_dropped_on_reopen(tmp_path):
+    store = open_store(tmp_path)
+    store.mset([("a", b"first")])
+    store.mset([("b", b"second")])
+    store.close()
+    last = tmp_path / segment_files(tmp_path)[-1]
+    data = bytearray(last.read_bytes())
+    data[-1] ^= 0xFF
+    last.write_bytes(bytes(data))
+
+    store = open_store(tmp_path)
+    assert store.mget(["a", "b"]) == [b"first", None]
+    assert last.stat().st_size < len(data)
+    store.close()
+
+
+def test_leftover_tmp_from_interrupted_compaction(tmp_path):
+    store = open_store(tmp_path)
+    store.mset([("a", b"first"), ("b", b"second")])
+    store.close()
+    (tmp_path / "00000001.base.tmp").write_bytes(b"partial base")
+
+    store = open_store(tmp_path)
+    assert store.mget(["a", "b"]) == [b"first", b"second"]
+    assert not any(name.endswith(".tmp") for name in os.listdir(tmp_path))
+    store.close()
+
+
+def test_writes_during_compaction_survive_reopen(tmp_path, monkeypatch):
+    store = open_store(tmp_path)
+    store.mset([(f"k{i}", f"v{i}".encode()) for i in range(10)])
+    store.mset([("k0", b"v0-updated")])
+    store.mdelete(["k1"])
+
+    replace = os.replace
+
+    def write_then_replace(src, dst):
+        # 壓縮已讀完快照、尚未換上 base 檔時發生的覆寫與刪除
+        store.mset([("k2", b"v2-during"), ("new", b"added-during")])
+        store.mdelete(["k3"])
+        replace(src, dst)
+
+    monkeypatch.setattr(rag_docstore.os, "replace", write_then_replace)
+    store.compact()
+    monkeypatch.setattr(rag_docstore.os, "replace", replace)
+
+    expected = {f"k{i}": f"v{i}".encode() for i in range(10)}
+    expected.update({"k0": b"v0-updated", "k1": None, "k2": b"v2-during", "k3": None, "new": b"added-during"})
+    keys = sorted(expected)
+    assert store.mget(keys) == [expected[key] for key in keys]
+    store.close()
+
+    store = open_store(tmp_path)
+    assert store.mget(keys) == [expected[key] for key in keys]
+    assert any(name.endswith(".base") for name in os.listdir(tmp_path))
+    store.close()
+
+
+def test_concurrent_compactions_are_serialized(tmp_path):
+    store = open_store(tmp_path)
+    for round_ in range(5):
+        store.mset([(f"k{i}", f"v{i}-{round_}".encode() * 50) for i in range(200)])
+    errors = []
+
+    def compact():
+        try:
+            store.compact()
+        except Exception as e:  # pragma: no cover - 失敗時由下方斷言回報
+            errors.append(e)
+
+    threads = [threading.Thread(target=compact) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    expected = [f"v{i}-4".encode() * 50 for i in range(200)]
+    assert store.mget([f"k{i}" for i in range(200)]) == expected
+    store.close()
+    store = open_store(tmp_path)
+    assert store.mget([f"k{i}" for i in range(200)]) == expected
+    store.close()
+
+
+def test_zlib_round_trip(tmp_path):
+    value = "父文件內容重複的段落。".encode("utf-8") * 200
+    store = open_store(tmp_path, compress_level=6)
+    store.mset([("doc", value), ("tiny", b"x")])
+    assert store._index["doc"][3] is True
+    assert store._index["tiny"][3] is False
+    assert store.mget(["doc", "tiny"]) == [value, b"x"]
+    store.close()
+
+    # 以不壓縮的設定重新開啟仍可讀取既有的壓縮紀錄，壓縮後也保留壓縮格式
+    store = open_store(tmp_path, compress_level=0)
+    assert store.mget(["doc", "tiny"]) == [value, b"x"]
+    store.compact()
+    assert store._index["doc"][3] is True
+    store.close()
+    store = open_store(tmp_path)
+    assert store.mget(["doc", "tiny"]) == [value, b"x"]
+    store.close()
+
+
+def test_count_tracks_puts_and_deletes(tmp_path):
+    store = open_store(tmp_path)
+    store.mset([("a", b"1"), ("b", b"2")])
+    store.mset([("a", b"3")])
+    store.mdelete(["b", "missing"])
+    assert store.count() == 1
+    store.compact()
+    store.close()
+    store = open_store(tmp_path)
+    assert store.count() == len(list(store.yield_keys())) == 1
+    store.close()
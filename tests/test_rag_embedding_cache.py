@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from rag_embedding_cache import CachedEmbeddings
+
+
+class CountingEmbeddings(Embeddings):
+    def __init__(self, dim: int = 8):
+        self.dim = dim
+        self.calls = 0
+        self.texts = 0
+
+    def _vector(self, text):
+        rng = np.random.default_rng(abs(hash((text, self.dim))) % (1 << 32))
+        return rng.standard_normal(self.dim).astype(np.float32).tolist()
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        self.texts += len(texts)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def cached(inner, tmp_path, model_id="model-a", **options):
+    return CachedEmbeddings(inner, model_id=model_id, cache_dir=str(tmp_path), initial_capacity=4, **options)
+
+
+def test_reload_serves_vectors_without_the_model(tmp_path):
+    inner = CountingEmbeddings()
+    texts = [f"文件 {i}" for i in range(10)]
+    expected = cached(inner, tmp_path).embed_documents(texts)
+
+    again = CountingEmbeddings()
+    reloaded = cached(again, tmp_path)
+    vectors = reloaded.embed_documents(texts + ["  文件   3 "])
+    assert again.calls == 0
+    np.testing.assert_allclose(vectors[:10], expected, atol=1e-2)
+    np.testing.assert_allclose(vectors[10], expected[3], atol=1e-2)
+    assert reloaded.stats() == {"hits": 11, "misses": 0, "size": 10}
+
+
+def test_queries_and_documents_are_cached_separately(tmp_path):
+    inner = CountingEmbeddings()
+    cache = cached(inner, tmp_path)
+    cache.embed_documents(["同一段文字"])
+    cache.embed_query("同一段文字")
+    assert inner.texts == 2
+    cache.embed_queries(["同一段文字"])
+    assert inner.texts == 2
+
+
+def test_index_longer_than_vectors_after_crash(tmp_path):
+    inner = CountingEmbeddings()
+    cache = cached(inner, tmp_path)
+    texts = [f"chunk {i}" for i in range(6)]
+    expected = cache.embed_documents(texts)
+
+    # 模擬崩潰：向量檔只剩前 3 列，索引尾端多了半筆紀錄
+    row_bytes = cache._dim * cache.dtype.itemsize
+    with open(cache._vectors_path, "r+b") as f:
+        f.truncate(3 * row_bytes)
+    with open(cache._index_path, "ab") as f:
+        f.write(b"partial")
+
+    again = CountingEmbeddings()
+    reloaded = cached(again, tmp_path)
+    assert reloaded.stats()["size"] == 3
+    vectors = reloaded.embed_documents(texts)
+    assert again.texts == 3
+    np.testing.assert_allclose(vectors, expected, atol=1e-2)
+    assert os.path.getsize(reloaded._index_path) == 6 * 20
+
+    final = cached(CountingEmbeddings(), tmp_path)
+    assert final.stats()["size"] == 6
+
+
+def test_unreadable_meta_resets_cache(tmp_path):
+    cache = cached(CountingEmbeddings(), tmp_path)
+    cache.embed_documents(["a", "b"])
+    with open(cache._meta_path, "w") as f:
+        f.write("{\"dim\": ")
+
+    inner = CountingEmbeddings()
+    reloaded = cached(inner, tmp_path)
+    assert reloaded.stats()["size"] == 0
+    reloaded.embed_documents(["a"])
+    assert inner.texts == 1
+    with open(reloaded._meta_path) as f:
+        assert json.load(f)["dim"] == 8
+
+
+def test_dtype_change_resets_cache(tmp_path):
+    cached(CountingEmbeddings(), tmp_path, dtype="float16").embed_documents(["a"])
+    inner = CountingEmbeddings()
+    reloaded = cached(inner, tmp_path, dtype="float32")
+    reloaded.embed_documents(["a"])
+    assert inner.texts == 1
+
+
+def test_model_change_uses_a_separate_cache(tmp_path):
+    cached(CountingEmbeddings(), tmp_path, model_id="model-a").embed_documents(["a"])
+    inner = CountingEmbeddings()
+    other = cached(inner, tmp_path, model_id="model-b")
+    other.embed_documents(["a"])
+    assert inner.texts == 1
+    assert other.directory != cached(CountingEmbeddings(), tmp_path, model_id="model-a").directory
+
+
+def test_dimension_change_invalidates_cache(tmp_path):
+    cached(CountingEmbeddings(dim=8), tmp_path).embed_documents(["a", "b"])
+
+    inner = CountingEmbeddings(dim=16)
+    cache = cached(inner, tmp_path)
+    vectors = cache.embed_documents(["a", "c"])
+    assert [len(vector) for vector in vectors] == [16, 16]
+    assert cache.stats()["size"] == 2
+    # 先算出未命中的 c 才發現維度改變，a、c 整批重算，之後命中新的向量
+    np.testing.assert_allclose(cache.embed_documents(["a"])[0], vectors[0], atol=1e-2)
+    assert inner.texts == 3
+
+    reloaded = cached(CountingEmbeddings(dim=16), tmp_path)
+    assert len(reloaded.embed_documents(["c"])[0]) == 16
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+from parent_rag_server import IngestPipeline
+from rag_manifest import IngestManifest
+
+
+def record(path, parent_id="p", sha256="x", size=1, mtime_ns=1, child_ids=(1, 2)):
+    return {"path": path, "size": size, "mtime_ns": mtime_ns, "sha256": sha256, "parent_id": parent_id,
+            "child_ids": list(child_ids)}
+
+
+def test_manifest_round_trip(tmp_path):
+    manifest = IngestManifest(str(tmp_path / "manifest.db"))
+    manifest.upsert([
+        record("/docs/a.txt", "pa"), record("/docs/sub/b.txt", "pb"), record("/docs2/c.txt", "pc"),
+    ])
+    manifest.touch("/docs/a.txt", 5, 99)
+    manifest.remove(["/docs2/c.txt"])
+
+    reopened = IngestManifest(str(tmp_path / "manifest.db"))
+    assert reopened.count() == 2
+    assert reopened.get("/docs/a.txt") == record("/docs/a.txt", "pa", size=5, mtime_ns=99)
+    assert reopened.get("/docs2/c.txt") is None
+    # 前綴比對以目錄為界，/docs2 不屬於 /docs
+    manifest.upsert([record("/docs2/c.txt", "pc")])
+    assert sorted(reopened.paths_under("/docs")) == ["/docs/a.txt", "/docs/sub/b.txt"]
+    assert reopened.paths_for_parents(["pb", "missing"]) == ["/docs/sub/b.txt"]
+
+
+def write(directory, name, text, mtime=None):
+    path = directory / name
+    path.write_text(text, encoding="utf-8")
+    if mtime is not None:
+        os.utime(path, ns=(mtime, mtime))
+    return path
+
+
+def counts_of(result):
+    return {key: result[key] for key in ("added", "updated", "skipped", "removed")}
+
+
+def parent_count(engine):
+    return len(list(engine.byte_store.yield_keys()))
+
+
+def keyword_sources(engine, query):
+    result = engine.retrieve(query, k=10, search="keyword")
+    return sorted(os.path.basename(doc.metadata["source"]) for doc in result["parent_documents"])
+
+
+def test_incremental_ingest_classification(make_engine, tmp_path):
+    engine = make_engine()
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    write(docs, "a.txt", "甲文件描述料號 AA-1001。", mtime=10 ** 18)
+    write(docs, "b.txt", "乙文件描述料號 BB-2002。")
+    write(docs, "c.txt", "丙文件描述料號 CC-3003。")
+    assert counts_of(engine.ingest_directory(str(docs))) == {"added": 3, "updated": 0, "skipped": 0, "removed": 0}
+    assert counts_of(engine.ingest_directory(str(docs))) == {"added": 0, "updated": 0, "skipped": 3, "removed": 0}
+
+    # 內容改變 → updated；只改 mtime → skipped 並更新 manifest 的 mtime；刪除 → removed；新檔 → added
+    write(docs, "b.txt", "乙文件改版後描述料號 BB-2099。")
+    a = write(docs, "a.txt", "甲文件描述料號 AA-1001。", mtime=2 * 10 ** 18)
+    (docs / "c.txt").unlink()
+    write(docs, "d.txt", "丁文件描述料號 DD-4004。")
+    assert counts_of(engine.ingest_directory(str(docs))) == {"added": 1, "updated": 1, "skipped": 1, "removed": 1}
+    assert engine.manifest.get(str(a))["mtime_ns"] == 2 * 10 ** 18
+
+    assert keyword_sources(engine, "2002") == []
+    assert keyword_sources(engine, "2099") == ["b.txt"]
+    assert keyword_sources(engine, "3003") == []
+    assert keyword_sources(engine, "4004") == ["d.txt"]
+    assert parent_count(engine) == engine.manifest.count() == 3
+
+
+def test_failed_ingest_keeps_manifest_consistent(make_engine, tmp_path, monkeypatch):
+    engine = make_engine()
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    for i in range(4):
+        write(docs, f"f{i}.txt", f"第{i}份文件描述料號 XX-{i}00{i}。")
+    inner = engine.embeddings.embed_documents
+    calls = []
+
+    def flaky(texts):
+        calls.append(texts)
+        if len(calls) == 3:
+            raise RuntimeError("GPU out of memory")
+        return inner(texts)
+
+    monkeypatch.setattr(engine.embeddings, "embed_documents", flaky)
+    with pytest.raises(RuntimeError):
+        IngestPipeline(engine, str(docs), "**/*.txt", embed_batch_size=1, queue_size=1).run()
+    monkeypatch.undo()
+
+    # 失敗前寫入的檔案都有 manifest 紀錄，目錄中的其他檔案不會被當作已刪除
+    written = engine.manifest.count()
+    assert 0 < written < 4
+    assert parent_count(engine) == written
+
+    counts = engine.ingest_directory(str(docs))
+    assert (counts["added"], counts["skipped"], counts["removed"]) == (4 - written, written, 0)
+    assert parent_count(engine) == engine.manifest.count() == 4
+    assert engine.keyword_index.count() == 4
+
+
+def test_interrupted_manifest_update_does_not_duplicate(make_engine, tmp_path, monkeypatch):
+    engine = make_engine()
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    write(docs, "a.txt", "甲文件描述料號 AA-1001。")
+    write(docs, "b.txt", "乙文件描述料號 BB-2002。")
+
+    def crash(records):
+        raise OSError("disk full")
+
+    # 寫入知識庫之後、更新 manifest 之前中斷
+    monkeypatch.setattr(engine.manifest, "upsert", crash)
+    with pytest.raises(OSError):
+        engine.ingest_directory(str(docs))
+    monkeypatch.undo()
+    assert engine.manifest.count() == 0
+
+    counts = engine.ingest_directory(str(docs))
+    assert counts["added"] == 2
+    assert parent_count(engine) == engine.manifest.count() == 2
+    assert engine.keyword_index.count() == 2
+    assert keyword_sources(engine, "1001") == ["a.txt"]
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+from langchain_core.documents import Document
+
+import parent_rag_server
+
+
+class ReadyEngine:
+    def __init__(self, engine):
+        self.engine = engine
+
+    async def get(self):
+        return self.engine
+
+
+@pytest.fixture
+def engine(make_engine, monkeypatch):
+    engine = make_engine()
+    engine.add_documents([Document(page_content="0123456789", metadata={"source": "digits.txt"})], ids=["p1"])
+    monkeypatch.setattr(parent_rag_server, "ParentRAG", ReadyEngine(engine))
+    return engine
+
+
+def fetch(*args, **kwargs):
+    return asyncio.run(parent_rag_server.get_parent_document(*args, **kwargs))
+
+
+def test_returns_requested_range(engine):
+    result = fetch("p1", start=2, end=5)
+    assert (result["status"], result["text"], result["length"], result["end"]) == ("success", "234", 10, 5)
+    assert fetch("p1", start=8, end=100)["text"] == "89"
+    assert fetch("p1")["text"] == "0123456789"
+    assert fetch("missing")["status"] == "error"
+
+
+@pytest.mark.parametrize("start, end", [(-1, None), (-3, 2), (5, 5), (5, 2), (0, 0), (0, -1)])
+def test_rejects_invalid_range(engine, start, end):
+    result = fetch("p1", start=start, end=end)
+    assert result["status"] == "error"
+    assert "text" not in result
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import json
+
+import numpy as np
+import pytest
+
+from rag_quantization import QuantizedVectorStore
+
+
+def random_vectors(count, dim=16, seed=0):
+    vectors = np.random.default_rng(seed).standard_normal((count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize("mode", ["int8", "binary"])
+def test_reload_keeps_vectors_and_ids(tmp_path, mode):
+    vectors = random_vectors(50)
+    store = QuantizedVectorStore(str(tmp_path), mode=mode, initial_capacity=8)
+    ids = store.add(vectors)
+    assert ids == list(range(1, 51))
+    store.delete([3])
+    before = store.search(vectors[:5], 3)
+
+    reopened = QuantizedVectorStore(str(tmp_path), mode=mode, initial_capacity=8)
+    assert reopened.count() == 49
+    assert reopened.search(vectors[:5], 3) == before
+    assert reopened.add(random_vectors(1, seed=1)) == [51]
+
+
+def test_mode_mismatch_is_rejected(tmp_path):
+    QuantizedVectorStore(str(tmp_path), mode="int8").add(random_vectors(2))
+    with pytest.raises(ValueError):
+        QuantizedVectorStore(str(tmp_path), mode="binary")
+
+
+def test_ids_are_not_reused_after_compaction(tmp_path):
+    vectors = random_vectors(10)
+    store = QuantizedVectorStore(str(tmp_path), initial_capacity=4)
+    store.add(vectors)
+    store.delete([9, 10])
+    assert store.compact() == 2
+    assert store.add(random_vectors(2, seed=1)) == [11, 12]
+
+    # 剩下的向量仍以原本的 ID 找到
+    top = store.search(vectors[:8], 1)
+    assert [hits[0][0] for hits in top] == list(range(1, 9))
+
+    reopened = QuantizedVectorStore(str(tmp_path), initial_capacity=4)
+    assert [hits[0][0] for hits in reopened.search(vectors[:8], 1)] == list(range(1, 9))
+    reopened.delete([11, 12])
+    reopened.compact()
+    reopened = QuantizedVectorStore(str(tmp_path), initial_capacity=4)
+    assert reopened.add(random_vectors(1, seed=2)) == [13]
+
+
+def test_explicit_ids_advance_next_id(tmp_path):
+    store = QuantizedVectorStore(str(tmp_path))
+    assert store.add(random_vectors(2), ids=[100, 200]) == [100, 200]
+    assert store.add(random_vectors(1, seed=1)) == [201]
+
+
+def test_meta_without_next_id_falls_back_to_max_id(tmp_path):
+    store = QuantizedVectorStore(str(tmp_path))
+    store.add(random_vectors(3))
+    meta_path = tmp_path / "meta.json"
+    meta = json.loads(meta_path.read_text())
+    del meta["next_id"]
+    meta_path.write_text(json.dumps(meta))
+    assert QuantizedVectorStore(str(tmp_path)).add(random_vectors(1, seed=1)) == [4]
+
+
+def data_files(path):
+    return sorted(entry.name for entry in path.iterdir() if entry.name != "meta.json")
+
+
+def test_crash_before_meta_switch_keeps_old_generation(tmp_path, monkeypatch):
+    vectors = random_vectors(10)
+    store = QuantizedVectorStore(str(tmp_path), initial_capacity=4)
+    store.add(vectors)
+    store.delete([2, 5])
+    files = data_files(tmp_path)
+
+    def crash():
+        raise OSError("disk full")
+
+    monkeypatch.setattr(store, "_save_meta", crash)
+    with pytest.raises(OSError):
+        store.compact()
+
+    reopened = QuantizedVectorStore(str(tmp_path), initial_capacity=4)
+    assert data_files(tmp_path) == files
+    assert reopened.count() == 8
+    assert reopened.fragmentation() == pytest.approx(0.2)
+    kept = [i for i in range(10) if i + 1 not in (2, 5)]
+    assert [hits[0][0] for hits in reopened.search(vectors[kept], 1)] == [i + 1 for i in kept]
+
+
+def test_crash_after_meta_switch_drops_old_generation(tmp_path, monkeypatch):
+    import rag_quantization
+
+    vectors = random_vectors(10)
+    store = QuantizedVectorStore(str(tmp_path), initial_capacity=4)
+    store.add(vectors)
+    store.delete([2, 5])
+
+    def crash(path):
+        raise OSError("interrupted")
+
+    monkeypatch.setattr(rag_quantization.os, "remove", crash)
+    assert store.compact() == 2
+    monkeypatch.undo()
+    assert len(data_files(tmp_path)) == 10
+
+    reopened = QuantizedVectorStore(str(tmp_path), initial_capacity=4)
+    assert data_files(tmp_path) == sorted(f"1.{name}" for name in rag_quantization._DATA_FILES)
+    assert reopened.count() == 8
+    assert reopened.fragmentation() == 0.0
+    kept = [i for i in range(10) if i + 1 not in (2, 5)]
+    assert [hits[0][0] for hits in reopened.search(vectors[kept], 1)] == [i + 1 for i in kept]
+    assert reopened.add(random_vectors(1, seed=1)) == [11]
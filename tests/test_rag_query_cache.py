@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+from langchain_core.documents import Document
+
+import parent_rag_server
+from parent_rag_server import QueryResultCache
+
+
+def test_lru_and_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(parent_rag_server.time, "monotonic", lambda: now[0])
+    cache = QueryResultCache(max_size=2, ttl=10)
+    cache.put(("a",), {"n": 1})
+    cache.put(("b",), {"n": 2})
+    assert cache.get(("a",)) == {"n": 1}
+    cache.put(("c",), {"n": 3})
+    # b 最久未使用而被淘汰
+    assert cache.get(("b",)) is None
+    now[0] += 11
+    assert cache.get(("a",)) is None
+    assert cache.stats() == {"hits": 1, "misses": 2, "hit_rate": 0.3333, "size": 1}
+
+
+def test_disabled_cache_stores_nothing():
+    cache = QueryResultCache(max_size=0)
+    cache.put(("a",), {})
+    assert cache.get(("a",)) is None
+
+
+def test_queries_are_embedded_as_written(make_engine, monkeypatch):
+    engine = make_engine()
+    engine.add_documents([Document(page_content="品質管理部門負責產品檢驗", metadata={"source": "qa.txt"})])
+    embedded = []
+    original = parent_rag_server.embed_query_batch
+
+    def spy(embeddings, texts):
+        embedded.extend(texts)
+        return original(embeddings, texts)
+
+    monkeypatch.setattr(parent_rag_server, "embed_query_batch", spy)
+    results = engine.retrieve_many(["品質，檢驗", "品質,檢驗", "品質，檢驗"], search="hybrid")
+    # 正規化後相同的查詢只計算一次，送去嵌入的是使用者原本的文字
+    assert embedded == ["品質，檢驗"]
+    assert results[0] is results[1] is results[2]
+
+
+def test_writes_invalidate_cached_results(make_engine):
+    engine = make_engine()
+    engine.add_documents([Document(page_content="第一份文件介紹料號 AB-1001", metadata={"source": "a.txt"})], ids=["p1"])
+
+    first = engine.retrieve("AB-1001 料號", search="keyword")
+    assert engine.retrieve("AB-1001 料號", search="keyword") is first
+    hits = engine.query_cache.stats()["hits"]
+
+    generation = engine.generation
+    engine.add_documents([Document(page_content="第二份文件也提到料號 AB-1001", metadata={"source": "b.txt"})], ids=["p2"])
+    assert engine.generation > generation
+    after_add = engine.retrieve("AB-1001 料號", search="keyword")
+    assert sorted(after_add["parent_ids"]) == ["p1", "p2"]
+
+    engine.remove_documents(parent_ids=["p2"])
+    assert engine.retrieve("AB-1001 料號", search="keyword")["parent_ids"] == ["p1"]
+
+    generation = engine.generation
+    engine.compact(force=True)
+    assert engine.generation > generation
+    assert engine.retrieve("AB-1001 料號", search="keyword") is not first
+    assert engine.query_cache.stats()["hits"] == hits
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from types import SimpleNamespace
+
+from langchain_core.documents import Document
+
+import parent_rag_server
+from parent_rag_server import _format_retrieve_result
+
+
+def test_snippet_count_reports_emitted_snippets(monkeypatch):
+    engine = SimpleNamespace(retriever=SimpleNamespace(id_key="doc_id"))
+    monkeypatch.setattr(parent_rag_server, "ParentRAG", SimpleNamespace(engine=engine))
+    first = "甲" * 100 + "第一段命中" + "乙" * 100 + "第二段命中" + "丙" * 100
+    second = "另一份文件的命中內容"
+    result = {
+        "parent_ids": ["p1", "p2", "p3"],
+        "parent_documents": [
+            Document(page_content=first, metadata={"source": "a.txt"}),
+            Document(page_content=second, metadata={"source": "b.txt"}),
+            Document(page_content="沒有子 chunk 命中的文件", metadata={"source": "c.txt"}),
+        ],
+        "child_documents": [
+            Document(page_content="第一段命中", metadata={"doc_id": "p1"}),
+            Document(page_content="第二段命中", metadata={"doc_id": "p1"}),
+            Document(page_content="命中內容", metadata={"doc_id": "p2"}),
+        ],
+    }
+
+    formatted = _format_retrieve_result(result, "snippet", max_chars=10_000)
+    emitted = [snippet for document in formatted["documents"] for snippet in document["snippets"]]
+    assert formatted["count"] == len(emitted) == 2
+
+
+def test_client_memory_shares_the_server_token_estimate():
+    import client_memory
+    import rag_snippets
+
+    assert client_memory.estimate_tokens is rag_snippets.estimate_tokens
+    assert rag_snippets.estimate_tokens("父文件 parent") == 3 + 2
@@ -5,4 +5,6 @@ vllm serve /home/user/models/Qwen3-32B \
     --tensor-parallel-size 4 \
     --gpu-memory-utilization 0.95 \
     --enable-auto-tool-choice \
-    --tool-call-parser hermes
\ No newline at end of file
+    --tool-call-parser hermes \
+    --enable-prefix-caching \
+    --enable-prompt-tokens-details